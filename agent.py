@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Warm RFC 6349 agent: a daemon that keeps the measurement code loaded and
+runs test jobs sent over a Unix socket, and the thin client to send them.
+
+    python3 agent.py serve [--group wpms]
+    python3 agent.py --reverse 200000000 202.90.158.6 202.90.158.6
+    python3 agent.py ping
+
+The client only imports the standard library, the interpreter, imports
+and config.ini are paid for once by the daemon. Jobs run one at a time.
+nping and iperf3 processes a job leaves behind are killed when it ends.
+See wpms-agent.service for running the daemon with only the network
+capabilities it needs.
+"""
+import argparse
+import errno
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = "/run/wpms/agent.sock"
+CHILDREN = ("nping", "iperf3")
+
+
+def request(message, path=SOCKET_PATH, timeout=None):
+    """
+    Send one request to the agent and wait for its reply.
+    :raises OSError when the agent isn't running
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            reply = f.readline()
+    if not reply:
+        raise ConnectionError("agent closed the connection")
+    return json.loads(reply)
+
+
+def reap_children(names=CHILDREN):
+    """
+    Kill the child processes of this process running one of names.
+    :returns their pids
+    """
+    killed = []
+    parent = os.getpid()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # pid (comm) state ppid ..., comm may contain spaces
+        comm = stat[stat.index("(") + 1:stat.rindex(")")]
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        if ppid != parent or comm not in names:
+            continue
+        pid = int(entry)
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        killed.append(pid)
+    if killed:
+        logger.warning("killed leftover %s processes %s", "/".join(names),
+                       killed)
+    return killed
+
+
+def run_job(job):
+    """run the RFC 6349 test process of a job and store its result"""
+    import rfc6349
+    handler = rfc6349.TcpTest(job["mode"], job["cir"], job["server"],
+                              job["nping_server"], port=job.get("port"))
+    result = rfc6349.run_test(handler)
+    rfc6349.save_result(result)
+    rfc6349.upload_result(result)
+    return result
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # e.g. a new agent checking whether this one is running
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            return self.reply({"ok": False, "error": "bad request: {}".format(e)})
+        if job.get("op") == "ping":
+            return self.reply({"ok": True, "pid": os.getpid(),
+                               "jobs": self.server.jobs})
+        self.server.jobs += 1
+        try:
+            result = self.server.runner(job)
+        except Exception as e:
+            logger.exception("job %s failed", job)
+            reply = {"ok": False, "error": str(e) or type(e).__name__}
+        else:
+            reply = {"ok": True, "result": result}
+        finally:
+            reap_children()
+        self.reply(reply)
+
+    def reply(self, message):
+        self.wfile.write(json.dumps(message, default=str).encode() + b"\n")
+
+
+class AgentServer(socketserver.UnixStreamServer):
+    """
+    Serves jobs on path, one at a time. Clients need write access to the
+    socket: it is made mode, owned by group when given.
+    :raises OSError (EADDRINUSE) when an agent is already listening on path
+    """
+
+    def __init__(self, path=SOCKET_PATH, runner=run_job, mode=0o660,
+                 group=None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except FileNotFoundError:
+                pass
+            except ConnectionRefusedError:
+                os.unlink(path)  # left by an agent that was killed
+            else:
+                raise OSError(errno.EADDRINUSE,
+                              "an agent is already listening", path)
+        super().__init__(path, JobHandler)
+        os.chmod(path, mode)
+        if group is not None:
+            import grp
+            os.chown(path, -1, grp.getgrnam(group).gr_gid)
+        self.runner = runner
+        self.jobs = 0
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def warm_up():
+    """import what every job needs and read config.ini"""
+    import tenacity  # noqa: F401
+    import rfc6349
+    import wpms.prober  # noqa: F401
+    rfc6349.load_config()
+
+
+def serve(path, group=None):
+    warm_up()
+    server = AgentServer(path, group=group)
+    # systemd stops the agent with SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    logger.info("agent listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--group", help="group allowed to send jobs")
+    parser.add_argument("--port", type=int, help="iperf3 server port")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--forward", dest="mode", action="store_const",
+                      const="--forward")
+    mode.add_argument("--reverse", dest="mode", action="store_const",
+                      const="--reverse")
+    parser.add_argument("command", help="serve, ping or the cir of a job")
+    parser.add_argument("args", nargs="*", help="server nping_server")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO)
+        serve(args.socket, args.group)
+        return 0
+    if args.command == "ping":
+        message = {"op": "ping"}
+    elif args.mode and args.command.isdigit() and len(args.args) == 2:
+        message = {"mode": args.mode, "cir": int(args.command),
+                   "server": args.args[0], "nping_server": args.args[1],
+                   "port": args.port}
+    else:
+        parser.print_usage(sys.stderr)
+        return 2
+    try:
+        reply = request(message, args.socket)
+    except OSError as e:
+        print("agent not reachable on {}: {}".format(args.socket, e),
+              file=sys.stderr)
+        return 2
+    print(json.dumps(reply.get("result", reply)))
+    if not reply.get("ok"):
+        print("job failed: {}".format(reply.get("error")), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
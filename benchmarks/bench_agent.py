@@ -0,0 +1,56 @@
+"""
+Per job overhead of starting rfc6349.py for every test vs sending the job
+to a warm agent.py daemon.
+
+    python3 benchmarks/bench_agent.py [runs]
+
+Cold is an interpreter importing rfc6349 and reading config.ini, what every
+`sudo python3 rfc6349.py` paid before measuring anything. Warm is the thin
+client asking a running agent over its socket; the agent here answers a
+ping instead of running a test.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import agent  # noqa: E402
+
+COLD = "import rfc6349, tenacity, wpms.prober; rfc6349.load_config()"
+
+
+def timed(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    print("{:<6} median {:7.1f} ms  min {:7.1f} ms".format(
+        name, statistics.median(times) * 1000, min(times) * 1000))
+
+
+def main(runs=20):
+    report("cold", timed([sys.executable, "-c", COLD], runs))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "agent.sock")
+        server = agent.AgentServer(path, runner=lambda job: None)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            report("warm", timed([sys.executable, "agent.py", "--socket",
+                                  path, "ping"], runs))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,92 @@
+"""
+Load test of the dashboard broadcast path: hundreds of simulated agents
+report telemetry while several dashboards are connected. Compares one emit
+per message (the old server.py behaviour) with wpms.broadcast.Coalescer.
+
+    python3 benchmarks/bench_broadcast.py [agents] [dashboards] [seconds]
+
+Emits are simulated by serializing the payload once per dashboard, which is
+what the Socket.IO server has to do for every frame sent to the room.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from wpms.broadcast import Coalescer  # noqa: E402
+
+REPORT_RATE = 20  # messages per second per agent
+
+
+class Room:
+    def __init__(self, dashboards):
+        self.dashboards = dashboards
+        self.frames = 0
+
+    async def emit(self, event, data, room=None):
+        for _ in range(self.dashboards):
+            json.dumps([event, data])
+            self.frames += 1
+        await asyncio.sleep(0)
+
+
+async def agent(name, publish, stop):
+    seq = 0
+    while not stop.is_set():
+        await publish('client_latency', name, {'data': seq * 0.001})
+        seq += 1
+        await asyncio.sleep(1 / REPORT_RATE)
+
+
+async def lag_monitor(lags, stop, period=0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(period)
+        lags.append(loop.time() - started - period)
+
+
+async def scenario(agents, dashboards, seconds, coalesce):
+    room = Room(dashboards)
+    stop = asyncio.Event()
+    lags = []
+    if coalesce:
+        coalescer = Coalescer(room.emit, tick_rate=10)
+        coalescer.start()
+
+        async def publish(event, sid, data):
+            coalescer.push(event, sid, data)
+    else:
+        async def publish(event, sid, data):
+            await room.emit(event, data, room='/dashboard')
+
+    tasks = [asyncio.ensure_future(agent("agent-%d" % i, publish, stop))
+             for i in range(agents)]
+    tasks.append(asyncio.ensure_future(lag_monitor(lags, stop)))
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    if coalesce:
+        await coalescer.stop()
+    elapsed = time.perf_counter() - started
+    lags.sort()
+    return {
+        "frames/s": room.frames / elapsed,
+        "lag p99 ms": lags[int(len(lags) * 0.99)] * 1000,
+        "lag max ms": lags[-1] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    dashboards = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print("{} agents @ {} msg/s, {} dashboards, {}s".format(
+        agents, REPORT_RATE, dashboards, seconds))
+    for name, coalesce in (("direct", False), ("coalesced", True)):
+        result = asyncio.run(scenario(agents, dashboards, seconds, coalesce))
+        print("{:10} ".format(name) + "  ".join(
+            "{} {:.1f}".format(k, v) for k, v in result.items()))
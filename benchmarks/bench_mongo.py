@@ -0,0 +1,59 @@
+"""
+Insert rate of one insert_one per result vs the buffered ResultRepository.
+
+    python3 benchmarks/bench_mongo.py [documents] [mongodb uri]
+
+Without a uri the mongomock in-memory stand-in is used, which only shows
+the client side cost; against a local mongod the round trips saved by
+insert_many dominate.
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from wpms.db import ResultRepository  # noqa: E402
+
+
+def document(i):
+    return {
+        "test_id": str(uuid.uuid4()),
+        "mode": ("forward", "reverse")[i % 2],
+        "actual_thpt": 90000000 + i,
+        "transfer_time_ratio": 1.05,
+        "tcp_efficiency": 99.9,
+        "buffer_delay": 12.5,
+    }
+
+
+def single(collection, docs):
+    for doc in docs:
+        collection.insert_one(doc)
+
+
+def bulk(collection, docs):
+    with ResultRepository(collection, batch_size=500) as repo:
+        for doc in docs:
+            repo.add(doc)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2:
+        from pymongo import MongoClient
+        client = MongoClient(sys.argv[2])
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    database = client.wpms_benchmark
+    for name, fn in (("insert_one", single), ("insert_many", bulk)):
+        collection = database[name]
+        collection.drop()
+        docs = [document(i) for i in range(count)]
+        started = time.perf_counter()
+        fn(collection, docs)
+        elapsed = time.perf_counter() - started
+        assert collection.count_documents({}) == count
+        print("{:12} {:>10.0f} inserts/s".format(name, count / elapsed))
+        collection.drop()
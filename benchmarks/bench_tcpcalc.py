@@ -0,0 +1,66 @@
+"""
+Scalar TcpCalc loop vs utils.batch_metrics on a synthetic set of runs.
+
+    python3 benchmarks/bench_tcpcalc.py [rows]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils import TcpCalc, batch_metrics, get_max_thpt  # noqa: E402
+
+
+def synthetic_runs(rows, seed=6349):
+    rng = np.random.default_rng(seed)
+    rtx = rng.integers(0, 10**5, rows)
+    return {
+        "link_speed": rng.choice([10**8, 2 * 10**8, 10**9], rows),
+        "mtu": rng.integers(576, 1501, rows),
+        "block_size": np.full(rows, 10**8),
+        "actual_transfer_time": rng.uniform(0.5, 30, rows),
+        "transfer_bytes": rng.integers(10**6, 10**9, rows) + rtx,
+        "retransmit_bytes": rtx,
+        "avg_rtt": rng.uniform(0.001, 0.2, rows),
+        "baseline_rtt": rng.uniform(0.001, 0.1, rows),
+    }
+
+
+def scalar(runs):
+    calc = TcpCalc()
+    cols = [runs[k].tolist() for k in (
+        "link_speed", "mtu", "block_size", "actual_transfer_time",
+        "transfer_bytes", "retransmit_bytes", "avg_rtt", "baseline_rtt")]
+    out = []
+    for link, mtu, block, att, tx, rtx, avg, base in zip(*cols):
+        max_thpt = get_max_thpt(link, mtu)
+        itt = calc.get_itt(block, max_thpt)
+        out.append((max_thpt, itt, calc.get_ttr(att, itt),
+                    ((tx - rtx) / tx) * 100,
+                    calc.get_buffer_delay(avg, base)))
+    return out
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    runs = synthetic_runs(rows)
+    expected, scalar_time = timed(scalar, runs)
+    out, batch_time = timed(batch_metrics, runs)
+    keys = ("max_achievable_thpt", "ideal_transfer_time",
+            "transfer_time_ratio", "tcp_efficiency", "buffer_delay")
+    for i, key in enumerate(keys):
+        assert np.array_equal(out[key].filled(np.nan),
+                              [row[i] for row in expected]), key
+    print("rows:   {}".format(rows))
+    print("scalar: {:.3f}s".format(scalar_time))
+    print("batch:  {:.3f}s".format(batch_time))
+    print("speedup {:.1f}x, results identical".format(
+        scalar_time / batch_time))
@@ -0,0 +1,89 @@
+"""
+Loopback file transfer: the 1024 byte read/send/recv loop of the old
+send_file.py/received_file.py against wpms.transfer (sendfile on the
+sender, recv_into a preallocated buffer or an mmap on the receiver).
+
+    python3 benchmarks/bench_transfer.py [megabytes]
+
+CPU time is process time of sender and receiver together, on a Raspberry
+Pi that is what caps the old loop well below line rate.
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from wpms.transfer import Receiver, send_file  # noqa: E402
+
+
+def chunked(path, target):
+    """the old scripts, ported to python 3 as they were"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def receive():
+        c, _ = server.accept()
+        with open(target, "wb") as f:
+            data = c.recv(1024)
+            while data:
+                f.write(data)
+                data = c.recv(1024)
+        c.send(b"Thank you for connecting")
+        c.close()
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    s = socket.socket()
+    s.connect(server.getsockname())
+    with open(path, "rb") as f:
+        data = f.read(1024)
+        while data:
+            s.send(data)
+            data = f.read(1024)
+    s.shutdown(socket.SHUT_WR)
+    s.recv(1024)
+    s.close()
+    thread.join()
+    server.close()
+
+
+def zero_copy(path, target, use_mmap):
+    with Receiver(0, host="127.0.0.1", path=target,
+                  use_mmap=use_mmap) as receiver:
+        thread = threading.Thread(target=receiver.serve_once)
+        thread.start()
+        send_file(path, "127.0.0.1", receiver.port)
+        thread.join()
+
+
+def measure(name, size, fn, *args):
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    fn(*args)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print("{:<20} {:>9.1f} MB/s {:>8.3f}s wall {:>8.3f}s cpu".format(
+        name, size / wall / 1e6, wall, cpu))
+
+
+def main(megabytes=256):
+    size = megabytes * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tosend.bin")
+        target = os.path.join(tmp, "torecv.bin")
+        with open(path, "wb") as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+        print("{} MB over loopback".format(megabytes))
+        measure("1024 byte loop", size, chunked, path, target)
+        measure("sendfile/recv_into", size, zero_copy, path, target, False)
+        measure("sendfile/mmap", size, zero_copy, path, target, True)
+        measure("sendfile/discard", size, zero_copy, path, None, False)
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -1,6 +1,14 @@
 #!/usr/bin/sh
 
 chmod +x rfc6349.py
+chmod +x agent.py
 chmod +x run.sh
 sudo cp ./config.ini /var/local/
 sudo mkdir -p /var/local/netmon
+sudo mkdir -p /var/local/starmon
+sudo groupadd -f wpms
+sudo usermod -aG wpms "$USER"
+sed "s|@WPMS@|$PWD|g" wpms-agent.service | \
+    sudo tee /etc/systemd/system/wpms-agent.service > /dev/null
+sudo systemctl daemon-reload
+sudo systemctl enable --now wpms-agent
@@ -1,21 +1,39 @@
-import socket               # Import socket module
+#!/usr/bin/env python3
+"""
+Known size file transfer, RFC 6349 step 7. Receiver side.
 
-s = socket.socket()         # Create a socket object
-host = socket.gethostname() # Get local machine name
-port = 12345                 # Reserve a port for your service.
-s.bind((host, port))        # Bind to the port
-f = open('torecv.png','wb')
-s.listen(5)                 # Now wait for client connection.
-while True:
-    c, addr = s.accept()     # Establish connection with client.
-    print 'Got connection from', addr
-    print "Receiving..."
-    l = c.recv(1024)
-    while (l):
-        print "Receiving..."
-        f.write(l)
-        l = c.recv(1024)
-    f.close()
-    print "Done Receiving"
-    c.send('Thank you for connecting')
-    c.close()                # Close the connection
+    python3 received_file.py [--port 12345] [--file torecv.png] [--discard]
+                             [--mmap] [--rcvbuf bytes] [--mss bytes] [--once]
+"""
+import argparse
+import logging
+
+from wpms.transfer import Receiver
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--file", default="torecv.png")
+    parser.add_argument("--discard", action="store_true",
+                        help="don't store the received data")
+    parser.add_argument("--mmap", action="store_true",
+                        help="receive straight into a mapping of the file")
+    parser.add_argument("--rcvbuf", type=int)
+    parser.add_argument("--mss", type=int)
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with Receiver(args.port, path=None if args.discard else args.file,
+                  use_mmap=args.mmap, rcvbuf=args.rcvbuf,
+                  mss=args.mss) as receiver:
+        print("rcvbuf {rcvbuf} mss {mss}".format(**receiver.options))
+        if args.once:
+            receiver.serve_once()
+        else:
+            receiver.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
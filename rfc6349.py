@@ -1,23 +1,17 @@
 #!/usr/bin/env python3
 import subprocess
-import re
 import json
-import csv
 import sys
 import os
 import signal
 import uuid
 import configparser
+import functools
+import math
+import threading
+import time
 from datetime import datetime
 
-import requests
-from tenacity import (
-    retry,
-    wait_fixed,
-    stop_after_attempt
-    )
-from requests.exceptions import ConnectionError
-
 import logging
 from logger_settings import Logger
 
@@ -26,35 +20,133 @@ from utils import (
     TCP_WINDOW_SIZE,
     IP_HEADER_SIZE,
     FRAME_BYTE_SIZE,
+    TcpCalc,
     get_max_thpt
     )
+from wpms import iperf_stream, metrics, netperf, nping
+from wpms.bandwidth import BandwidthSearch, Trial
+from wpms.baseline import BaselineStore
+from wpms.cache import TtlCache
+from wpms.convergence import ConvergenceMonitor, interval_rtt
+from wpms.outbox import Outbox, Uploader
+from wpms.pmtu import bisect_payload
+from wpms.results import ResultStore
+from wpms.route import egress_interface
 logger = logging.getLogger(__name__)
 logger = Logger(logger)
 
 config = configparser.ConfigParser()
 config_path = '/var/local/config.ini'
 csv_path = "/var/local/starmon/"
-config.read(config_path)
-
-
-def get_min_rtt(res):
-    rtts = re.findall("rtt: \d+.\d+ms", res)
-    if not rtts:
-        return False
-    min_rtt = rtts[1]
-    min_rtt = re.search("\d+.\d+",min_rtt)  # get actual value
-    min_rtt = float(min_rtt.group())
-    return min_rtt
-
+results_path = csv_path + "results.db"
+outbox_path = csv_path + "outbox.db"
+baseline_path = csv_path + "baseline.db"
+pmtu_cache_path = "/var/local/starmon/pmtu_cache.json"
+bandwidth_cache_path = "/var/local/starmon/bandwidth_cache.json"
+config_lock = threading.Lock()
+config_mtime = None
+
+
+def load_config():
+    """
+    Read config_path into config, again whenever the file changed since
+    the last read, so a long running agent picks up edits between tests.
+    Every read starts from a new ConfigParser that replaces config, so
+    options deleted from the file are gone as well.
+    """
+    global config, config_mtime
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except OSError:
+        return config
+    with config_lock:
+        if mtime != config_mtime:
+            fresh = configparser.ConfigParser()
+            fresh.read(config_path)
+            config = fresh
+            config_mtime = mtime
+        return config
+
+
+def retried(wait, attempts):
+    """
+    tenacity.retry waiting wait seconds between at most attempts calls.
+    tenacity is imported on the first call, it is slow to import.
+    """
+    def decorator(fn):
+        retrying = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal retrying
+            if retrying is None:
+                from tenacity import retry, stop_after_attempt, wait_fixed
+                retrying = retry(wait=wait_fixed(wait),
+                                 stop=stop_after_attempt(attempts),
+                                 before_sleep=metrics.count_retry)(fn)
+            return retrying(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class NpingProbe:
+    """
+    nping --icmp subprocess with the same interface as wpms.prober.ProberThread,
+    used when rtt_method is set to nping. Its output is parsed by
+    wpms.nping while it runs.
+    """
+
+    def __init__(self, host, count=None):
+        cmd = ["nping", "--icmp", "--df"]
+        if count:
+            cmd += ["-c", str(count)]
+        self.cmd = cmd + [host]
+        self.proc = None
+        self.reader = None
+        self.summary = nping.Summary()
+        self.error = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.proc = metrics.popen(
+            self.cmd, "nping",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
 
-def get_avg_rtt(res):
-    rtts = re.findall("rtt: \d+.\d+ms", res)
-    if not rtts:
-        return False
-    avg_rtt = rtts[2]
-    avg_rtt = re.search("\d+.\d+",avg_rtt)  # get actual value
-    avg_rtt = float(avg_rtt.group())
-    return avg_rtt
+    def _read(self):
+        try:
+            for _ in nping.iter_probes(self.proc.stdout, self.summary):
+                pass
+        except nping.NpingError as e:
+            self.error = e
+            # keep draining so nping never blocks on a full pipe
+            for _ in self.proc.stdout:
+                pass
+
+    def result(self, timeout=None):
+        """
+        :returns wpms.nping.Summary, used like wpms.prober.RttStats
+        """
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.reader.join()
+        self.proc.stdout.close()
+        metrics.observe("wpms_subprocess_run_seconds",
+                        time.perf_counter() - self.started, command="nping",
+                        outcome="ok" if self.error is None else "error")
+        if self.error is not None:
+            logger.error("nping %s", self.error)
+        return self.summary
+
+    def stop(self, timeout=None):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+        return self.result(timeout)
 
 
 """
@@ -92,7 +184,7 @@ the value used for calculating the Ideal Transfer time.
 
 
 class TcpTest:
-    def __init__(self, mode, cir, server_ip, nping_server):
+    def __init__(self, mode, cir, server_ip, nping_server, port=None):
         self.mode = mode
         self.cir = int(cir)
         self.server_ip = server_ip
@@ -102,6 +194,7 @@ class TcpTest:
         self.target_bitrate = "300M"
         self.server_ip = server_ip
         self.nping_server_ip = nping_server
+        self.port = port  # iperf3 server port, None for the default 5201
         self.client_output = None
         self.server_output = None
         self.mtu = 1500
@@ -135,6 +228,17 @@ class TcpTest:
         self.remote_system_util = 0
         self.test_mode = None
         self.jitter = 0
+        self.intervals = {}
+        self.iperf_worker = None
+        self.streams = 1
+        self.stream_window = 0
+        self.stream_results = []
+        self.fairness = None
+        self.bb_confidence = None
+        self.bb_probe_time = 0
+        self.bb_trials = 0
+        self.converged = False
+        self.measured_time = 0
 
         self.sender = True
         if mode == "--forward":
@@ -148,48 +252,70 @@ class TcpTest:
 
         logger.debug("init sender %s", self.sender)
 
-    @retry(wait=wait_fixed(10),
-           stop=stop_after_attempt(20))
+    @retried(wait=10, attempts=20)
+    @metrics.timed("wpms_attempt_seconds", phase="pmtu")
     def pmtu(self):
         """
         Measure MTU using trial and error.
         1) perform a TCP ping (3-way handshake)  with a payload
-        2) repeat until no rtt is measured during the process
-        3) the MTU is taken from the last payload with a valid rtt
+        2) bisect the payload size between pmtu_floor and pmtu_ceiling,
+           keeping the largest payload with a valid rtt
+        3) the MTU is taken from the largest payload with a valid rtt
         RTT here doesn't matter and is not used, it is only used
         to confirm that the server was able to capture the data.
+        The result is cached per destination and egress interface for
+        pmtu_cache_ttl seconds so repeated runs skip the discovery.
         """
-        logger.debug("Finding PMTU")
-        while True:
-            logger.debug("PAYLOAD %s", self.payload_size)
-            p = subprocess.run(
-                [
-                    "nping",
-                    "--tcp",
-                    "--data-length",
-                    str(self.payload_size),
-                    "--df",
-                    str(server_ip)],
-                shell=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            min_rtt = get_min_rtt(p.stdout.decode())
-            if p.stderr and "failed" in p.stderr.decode():
-                logger.error("nping %s", p.stderr.decode())
-                raise SystemError("nping connection failed")
-            if not min_rtt:
-                self.payload_size -= 10
-                continue
-            break
+        floor = config.getint('RFC6349', 'pmtu_floor', fallback=536)
+        ceiling = config.getint('RFC6349', 'pmtu_ceiling',
+                                fallback=self.payload_size)
+        ttl = config.getint('RFC6349', 'pmtu_cache_ttl', fallback=86400)
+        cache = TtlCache(pmtu_cache_path, ttl=ttl)
+        key = cache.make_key(self.server_ip, egress_interface(self.server_ip))
+
+        payload_size = cache.get(key) if ttl > 0 else None
+        if payload_size:
+            logger.debug("PMTU cache hit %s payload %s", key, payload_size)
+        else:
+            logger.debug("Finding PMTU")
+            payload_size = bisect_payload(self.probe_payload, floor, ceiling)
+            if payload_size is None:
+                raise ValueError("No payload between {} and {} bytes "
+                                 "reached the server".format(floor, ceiling))
+            if ttl > 0:
+                cache.set(key, payload_size)
+        self.payload_size = payload_size
         self.mss = self.payload_size
         pmtu = self.mss + TCP_HEADER_SIZE + IP_HEADER_SIZE
         self.mtu = int(pmtu)
         return self.mtu
 
-
-    @retry(wait=wait_fixed(10),
-        stop=stop_after_attempt(20))
+    def probe_payload(self, payload_size):
+        """
+        TCP ping with the DF bit set, returns True if the payload got through.
+        """
+        logger.debug("PAYLOAD %s", payload_size)
+        p = metrics.run(
+            [
+                "nping",
+                "--tcp",
+                "--data-length",
+                str(payload_size),
+                "--df",
+                str(self.server_ip)],
+            "nping",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if p.stderr and "failed" in p.stderr.decode():
+            logger.error("nping %s", p.stderr.decode())
+            raise SystemError("nping connection failed")
+        with metrics.span("wpms_parse_seconds", format="nping"):
+            summary = nping.parse(p.stdout.decode().splitlines())
+        return summary.min is not None
+
+    @retried(wait=10, attempts=20)
+    @metrics.timed("wpms_attempt_seconds", phase="baseline_rtt")
     def baseline_rtt(self):
         """
         RFC6349 suggests to use TCPTRACE to analyze packets captured to derived the
@@ -200,9 +326,10 @@ class TcpTest:
         rtt (IPERF automatically includes this in the json data). What's important is to conduct
         this TCP Throughput test during noncongested time, when there is no one using the network
         yet. This will give the inherent rtt of the network.
+        The baseline is the minimum rtt of the path (egress interface, nping
+        server) over the last baseline_horizon seconds, see BaselineStore.
         """
         logger.debug("Measuring RTT")
-        baseline_rtt = float(config['RFC6349']['baseline_rtt'])
 
         # p = subprocess.run(
         #     [
@@ -225,40 +352,29 @@ class TcpTest:
         #         "--dont-fragment"
         #         ],
         #     stdout=subprocess.PIPE)
-        p = subprocess.run(
-            [
-                "nping",
-                "--icmp",
-                "--df",
-                self.nping_server_ip
-                ],
-            stdout=subprocess.PIPE)
-        output = p.stdout
-        if not output:
-            raise ValueError("baseline_rtt Failed subprocess returned None")
+        count = config.getint('RFC6349', 'rtt_count', fallback=5)
+        stats = self.start_rtt_probe(count).result()
+        if stats.min is None:
+            raise ValueError("baseline_rtt Failed, no probe was answered")
         # output = output.decode()
         # data = json.loads(output)
         # if self.sender:
         #     min_rtt = data['end']['streams'][0]['sender']['min_rtt']
         # else:
         #     min_rtt = data['server_output_json']['end']['streams'][0]['sender']['min_rtt']
-        min_rtt = get_min_rtt(output.decode())
-        min_rtt = float(min_rtt)/1000
-        logger.debug("config baseline_rtt %s", baseline_rtt)
-        logger.debug("current min rtt %s", min_rtt)
-        if min_rtt < baseline_rtt or baseline_rtt == 0:
-            baseline_rtt = min_rtt
-            config.set("RFC6349", "baseline_rtt", str(baseline_rtt))
-            with open(config_path, 'w') as configfile:
-                config.write(configfile)
-            logger.debug("Baseline RTT was Changed!")
+        min_rtt = stats.min
+        iface = egress_interface(self.nping_server_ip)
+        horizon = config.getint('RFC6349', 'baseline_horizon', fallback=86400)
+        with BaselineStore(baseline_path, horizon=horizon) as store:
+            baseline_rtt = store.update(iface, self.nping_server_ip, min_rtt)
+        logger.debug("current min rtt %s, baseline rtt of %s via %s %s",
+                     min_rtt, self.nping_server_ip, iface, baseline_rtt)
 
         self.base_rtt = baseline_rtt
         self.rtt = min_rtt  # use the current min rtt for the current test
         return self.base_rtt
 
-    @retry(wait=wait_fixed(10),
-           stop=stop_after_attempt(20))
+    @metrics.timed("wpms_attempt_seconds", phase="bandwidth")
     def bandwidth(self):
         """
         Bottleneck Bandwidth. Based on experiments, raspberry pi 4 can achieve up to
@@ -270,59 +386,254 @@ class TcpTest:
         test which can only achieve a 300Mbps speed, setting affinity to 1 solved this and was
         able to reach 956Mbps on a 1Gbps network. The 1st stream result will be omitted since
         based on experiments the first stream sometimes gives a very low value.
+        With bandwidth_search (default) short trials search for the highest
+        loss free rate up to the CIR instead of one 20 second run, see
+        search_bandwidth.
+        The result is cached for bandwidth_cache_ttl seconds per server, direction,
+        CIR and MTU, see cached_bandwidth.
         """
+        if self.cached_bandwidth():
+            return int(self.bb)
         logger.debug("Measuring Bottleneck bandwidth")
-        p = subprocess.run(
-            [
-                "iperf3",
-                "--client",
-                self.server_ip,
-                self.mode,
-                "--udp",
-                "--bitrate",
-                f"{self.cir}/10",
-                "--pacing-timer",
-                "10",
-                "--affinity",
-                "1",
-                "--time",
-                "20",
-                "--omit",
-                "1",
-                "--json",
-                "--get-server-output"],
-            stdout=subprocess.PIPE)
-
-        output = p.stdout
-        if not output:
-            logger.error("BB test failed, subprocess returned NoneType")
-            raise ValueError("thpt_test failed, subprocess returned NoneType")
-        output = output.decode()
-        data = json.loads(output)
-        if 'error' in data:
-            logger.error('Iperf Error %s', data['error'])
-            raise ValueError("Invalid Iperf Result")
-
-        if self.sender:
-            server_data = data['end']['sum_received']
-            bits_per_second = server_data['bits_per_second']
-            self.jitter = server_data['jitter_ms']
+        if config.getboolean('RFC6349', 'bandwidth_search', fallback=True):
+            self.search_bandwidth()
         else:
-            receiver_data = data['end']['sum_received']
-            bits_per_second = receiver_data['bits_per_second']
-            self.jitter = receiver_data['jitter_ms']
-        self.bb = bits_per_second
+            started = time.monotonic()
+            sample = self.bandwidth_trial(self.cir, duration=20, omit=1)
+            self.bb = sample.received
+            self.jitter = sample.jitter_ms
+            self.bb_confidence = None
+            self.bb_probe_time = time.monotonic() - started
+            self.bb_trials = 1
         self.set_bdp()
+        self.cache_bandwidth()
         return int(self.bb)
 
+    @retried(wait=10, attempts=20)
+    def bandwidth_trial(self, rate, duration, omit=None):
+        """
+        UDP run at rate bits/s, returns a wpms.bandwidth.Trial. A failed
+        run is retried on its own, the trials before it are kept.
+        """
+        try:
+            result = self.run_iperf(
+                phase="bandwidth",
+                udp=True,
+                bitrate=f"{int(rate)}/10",
+                pacing_timer=10,
+                affinity=1,
+                duration=duration,
+                omit=omit,
+                get_server_output=True)
+        except netperf.IperfError as e:
+            logger.error('Iperf Error %s', e)
+            raise
+        # sum_received is the receiving end in both directions
+        received = result.sum_received
+        return Trial(rate, received.bits_per_second, received.lost_percent,
+                     received.jitter_ms)
+
+    def search_bandwidth(self):
+        """
+        Bottleneck bandwidth from a wpms.bandwidth.BandwidthSearch of
+        bandwidth_trial second UDP runs between the CIR and the highest
+        rate without more than bandwidth_loss percent loss (and
+        bandwidth_jitter ms jitter, 0 to ignore jitter). Like the single
+        run the first second of every trial is omitted.
+        """
+        search = BandwidthSearch(
+            lambda rate: self.bandwidth_trial(
+                rate, config.getint('RFC6349', 'bandwidth_trial', fallback=2),
+                omit=1),
+            self.cir,
+            start=config.getfloat('RFC6349', 'bandwidth_start', fallback=0.5),
+            loss=config.getfloat('RFC6349', 'bandwidth_loss', fallback=0.1),
+            jitter=config.getfloat('RFC6349', 'bandwidth_jitter', fallback=0),
+            tolerance=config.getfloat('RFC6349', 'bandwidth_tolerance',
+                                      fallback=0.05),
+            max_trials=config.getint('RFC6349', 'bandwidth_trials',
+                                     fallback=10))
+        estimate = search.run()
+        self.bb = estimate.bandwidth
+        self.jitter = estimate.jitter_ms
+        self.bb_confidence = estimate.confidence
+        self.bb_probe_time = estimate.probe_time
+        self.bb_trials = len(estimate.trials)
+        logger.info("Bottleneck bandwidth %s confidence %.2f after %s trials "
+                    "in %.1fs", int(self.bb), self.bb_confidence,
+                    self.bb_trials, self.bb_probe_time)
+        return estimate
+
+    def bandwidth_cache(self):
+        ttl = config.getint('RFC6349', 'bandwidth_cache_ttl', fallback=1800)
+        cache = TtlCache(bandwidth_cache_path, ttl=ttl)
+        key = cache.make_key(self.server_ip, self.test_mode, self.cir, self.mtu)
+        return cache, key
+
+    def cached_bandwidth(self):
+        """
+        Restore the bottleneck bandwidth and jitter of a previous run, the
+        BDP and window follow from the current rtt. The entry is dropped
+        when the current rtt drifted more than rtt_drift (fraction) from
+        the rtt it was measured with, since the path has most likely
+        changed.
+        """
+        cache, key = self.bandwidth_cache()
+        if cache.ttl <= 0:
+            return False
+        entry = cache.get(key)
+        if not entry:
+            return False
+        drift = config.getfloat('RFC6349', 'rtt_drift', fallback=0.25)
+        if entry['rtt'] and abs(self.rtt - entry['rtt']) / entry['rtt'] > drift:
+            logger.debug("rtt drifted from %s to %s, measuring bandwidth",
+                         entry['rtt'], self.rtt)
+            cache.delete(key)
+            return False
+        logger.debug("Bottleneck bandwidth cache hit %s", key)
+        self.bb = entry['bb']
+        self.jitter = entry['jitter']
+        self.bb_confidence = entry.get('bb_confidence')
+        self.bb_probe_time = 0
+        self.bb_trials = 0
+        self.set_bdp()
+        return True
+
+    def cache_bandwidth(self):
+        cache, key = self.bandwidth_cache()
+        if cache.ttl <= 0:
+            return
+        cache.set(key, {
+            'bb': self.bb,
+            'jitter': self.jitter,
+            'rtt': self.rtt,
+            'bb_confidence': self.bb_confidence,
+            })
+
+    def run_iperf(self, phase=None, stop=None, **settings):
+        """
+        Run an iperf3 test against the server, settings are
+        wpms.netperf.IperfClient settings, direction and port are added.
+        With iperf_driver = library the test runs through libiperf in a
+        worker process kept for all phases of this test, with cli the
+        iperf3 command is run and its --json document parsed.
+        With iperf_stream enabled the command's output is read with
+        --json-stream while the test runs: intervals are folded into
+        self.intervals (running sender/receiver aggregates) and, when
+        dashboard_url is set, forwarded to the dashboard as they arrive.
+        A stop callable (see wpms.iperf_stream.run) always streams.
+        :returns wpms.netperf.IperfResult
+        :raises wpms.netperf.IperfError
+        """
+        settings = dict(settings, server_hostname=self.server_ip,
+                        reverse=not self.sender, port=self.port)
+        if stop is not None or config.getboolean('RFC6349', 'iperf_stream',
+                                                 fallback=False):
+            return self.run_iperf_stream(settings, phase, stop)
+        driver = config.get('RFC6349', 'iperf_driver', fallback='library')
+        if driver == 'library' and netperf.available():
+            if self.iperf_worker is None:
+                self.iperf_worker = netperf.IperfWorker(
+                    timeout=config.getfloat('RFC6349', 'iperf_timeout',
+                                            fallback=600))
+            with metrics.span("wpms_subprocess_run_seconds",
+                              command="iperf3-worker"):
+                return self.iperf_worker.run(settings)
+        if driver == 'library':
+            logger.warning("libiperf not found, running the iperf3 command")
+        cmd = ["iperf3"] + netperf.arguments(settings) + ["--json"]
+        p = metrics.run(cmd, "iperf3", stdout=subprocess.PIPE)
+        with metrics.span("wpms_parse_seconds", format="iperf3"):
+            return netperf.IperfResult.from_json(
+                json.loads(p.stdout.decode()) if p.stdout else None)
+
+    def run_iperf_stream(self, settings, phase=None, stop=None):
+        cmd = ["iperf3"] + netperf.arguments(settings)
+        forwarder = None
+        url = config.get('RFC6349', 'dashboard_url', fallback='')
+        if url:
+            forwarder = iperf_stream.DashboardForwarder(
+                url, phase=phase, mode=self.test_mode, server=self.server_ip)
+        try:
+            data, self.intervals = iperf_stream.run(
+                cmd, reverse=not self.sender, on_interval=forwarder,
+                stop=stop)
+        finally:
+            if forwarder is not None:
+                forwarder.close()
+        for aggregate in self.intervals.values():
+            logger.debug("%s intervals %s", phase, aggregate.as_dict())
+        if getattr(stop, "converged", False):
+            # terminating iperf3 is not an error of the test
+            data.pop("error", None)
+        with metrics.span("wpms_parse_seconds", format="iperf3"):
+            return netperf.IperfResult.from_json(data)
+
+    def close(self):
+        """stop the iperf3 worker process"""
+        if self.iperf_worker is not None:
+            self.iperf_worker.close()
+            self.iperf_worker = None
+        self.streams = 1
+        self.stream_window = 0
+        self.stream_results = []
+        self.fairness = None
+        self.converged = False
+        self.measured_time = 0
+
+    def start_rtt_probe(self, count=None):
+        """
+        Start probing the rtt to the nping server in the background.
+        rtt_method selects in-process icmp, tcp or udp probing (see
+        wpms.prober), nping keeps using the nping --icmp subprocess.
+        Without a count the probe runs until stop() is called.
+        """
+        method = config.get('RFC6349', 'rtt_method', fallback='icmp')
+        if method == 'nping':
+            probe = NpingProbe(self.nping_server_ip, count or 1000)
+        else:
+            # asyncio is only imported when probing in-process
+            from wpms.prober import ProberThread, RttProber
+            prober = RttProber(
+                self.nping_server_ip,
+                method=method,
+                port=config.getint('RFC6349', 'rtt_port', fallback=7),
+                interval=config.getfloat('RFC6349', 'rtt_interval',
+                                         fallback=0.1))
+            probe = ProberThread(prober, count)
+        probe.start()
+        return probe
+
     def calculate_optimal_wnd(self):
+        self.minimum_wnd_size = self.optimal_wnd(self.tcp_wnd_size)
+
+    def optimal_wnd(self, wnd_size):
+        """
+        Smallest window of at least wnd_size bytes that is the largest
+        unscaled window, an even multiple of the MSS, doubled.
+        """
         frame_size = self.mtu + FRAME_BYTE_SIZE
         logger.debug("FRAME SIZE %s", frame_size)
         even_multipleof_max_window = int(TCP_WINDOW_SIZE / frame_size)
-        unscaled_window = self.mss * even_multipleof_max_window
-        self.minimum_wnd_size = unscaled_window
-        while self.minimum_wnd_size < self.tcp_wnd_size:
-            self.minimum_wnd_size = self.minimum_wnd_size * 2
+        window = self.mss * even_multipleof_max_window
+        while window < wnd_size:
+            window = window * 2
+        return window
+
+    def stream_count(self):
+        """
+        Number of parallel connections of the throughput test.
+        streams = 0 picks enough streams for stream_window bytes per stream
+        to cover the BDP, at most max_streams.
+        """
+        streams = config.getint('RFC6349', 'streams', fallback=1)
+        if streams > 0:
+            return streams
+        stream_window = config.getint('RFC6349', 'stream_window',
+                                      fallback=TCP_WINDOW_SIZE)
+        streams = math.ceil(self.tcp_wnd_size / stream_window)
+        max_streams = config.getint('RFC6349', 'max_streams', fallback=8)
+        return max(1, min(streams, max_streams))
 
     def set_bdp(self):
         logger.debug("Calculating Bandwidth Delay Product")
@@ -333,98 +644,190 @@ class TcpTest:
     def calculate_bdp_bytes(self):
         self.tcp_wnd_size = int(self.bdp / 8) # bits to bytes
 
-    # @retry(wait=wait_fixed(10),
-    #        stop=stop_after_attempt(20))
+    def convergence_monitor(self, rtt_probe):
+        """
+        Stop criterion of the throughput test when convergence is enabled:
+        the last convergence_window interval throughputs (and with
+        convergence_rtt_cov the rtt over those intervals) vary by less
+        than convergence_cov. None when convergence is disabled.
+        """
+        if not config.getboolean('RFC6349', 'convergence', fallback=False):
+            return None
+        rtt = None
+        rtt_cov = config.getfloat('RFC6349', 'convergence_rtt_cov',
+                                  fallback=0)
+        if rtt_cov and hasattr(rtt_probe, "prober"):
+            rtt = interval_rtt(rtt_probe.prober.stats)
+        return ConvergenceMonitor(
+            "sender" if self.sender else "receiver",
+            window=config.getint('RFC6349', 'convergence_window', fallback=5),
+            max_cov=config.getfloat('RFC6349', 'convergence_cov',
+                                    fallback=0.05),
+            rtt=rtt,
+            max_rtt_cov=rtt_cov)
+
+    # @retried(wait=10, attempts=20)
     def thpt_test(self):
         """
         TCP throughput test will be conducted without specifying the target bitrate.
         We will let the optimal window size drive that Iperf test, this should give the
         throughput of the system. Rememer that TCP Window size must be set equal or greater
         than the BDP. TCP Window will also be an even multiple of the MTU.
+        With convergence enabled the test is stopped once the throughput is
+        steady, see converged_transfer.
         """
-        logger.info("Measuring TCP Throughput")
-        rtt_proc = subprocess.Popen(
-            [
-                "nping",
-                "--icmp",
-                "--df",
-                "-c",
-                "1000",
-                self.nping_server_ip
-                ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-
+        self.streams = self.stream_count()
+        if self.streams == 1:
+            self.stream_window = self.minimum_wnd_size
+        else:
+            # every connection carries its share of the BDP
+            self.stream_window = self.optimal_wnd(
+                math.ceil(self.tcp_wnd_size / self.streams))
+        logger.info("Measuring TCP Throughput, %s streams of window %s",
+                    self.streams, self.stream_window)
+        rtt_probe = self.start_rtt_probe()
+        monitor = self.convergence_monitor(rtt_probe)
         try:
-            p = subprocess.run(
-                [
-                    "iperf3",
-                    "--client",
-                    server_ip,
-                    self.mode,
-                    "--window",
-                    str(self.minimum_wnd_size),
-                    "--set-mss",
-                    str(self.mss),
-                    "--bytes",
-                    f"{self.file_size/8}",
-                    "--json",
-                    "--get-server-output",
-                    ],
-                stdout=subprocess.PIPE)
-            output = p.stdout
-            rtt_proc.send_signal(signal.SIGINT)
-            stdout, stderr = rtt_proc.communicate()
-            if not output:
-                logger.error('thp_test failed, subprocess returned NoneType')
-                raise ValueError('Iperf3 NoneType Value Error')
-            output = output.decode()
-            data = json.loads(output)
-            if 'error' in data:
-                logger.error('Iperf Error %s', data['error'])
-                raise ValueError("Iperf encountered an error.")
-
-            logger.debug("Is Sender %s", self.sender)
-            # Test Info
-            test_info = data['start']
-            test_info_xtras = data['end']
-            cpu_util = test_info_xtras['cpu_utilization_percent']
-            self.timestamp = test_info['timestamp']['timesecs']
-            d = datetime.fromtimestamp(self.timestamp)
-            self.timestamp = d.strftime("%m/%d/%Y, %H:%M:%S")
-            logger.info("DateTime %s", self.timestamp)
-            self.iperf_version = test_info['version']
-            self.system_info = test_info['system_info']
-            self.sndbuf_actual = test_info['sndbuf_actual']
-            self.rcvbuf_actual = test_info['rcvbuf_actual']
-            self.sndr_tcp_congestion = test_info_xtras['sender_tcp_congestion']
-            self.rcvr_tcp_congestion = test_info_xtras['receiver_tcp_congestion']
-            self.host_system_util = cpu_util['host_system']
-            self.remote_system_util = cpu_util['remote_system']
-            if self.sender:
-                sender_data = data['end']['streams'][0]['sender']
-                self.thpt = sender_data['bits_per_second']
-                self.actual_transfer_time = float(sender_data['seconds'])
-                self.avg_rtt = get_avg_rtt(stdout.decode()) / 1000
-                self.retransmit_bytes = int(sender_data['retransmits']) * self.mtu
-                self.transfer_bytes = int(sender_data['bytes']) \
-                    + self.retransmit_bytes
-            else:
-                receiver_data = data['end']['streams'][0]['receiver']
-                sender_data = data['server_output_json']['end']['streams'][0]['sender']
-                self.thpt = receiver_data['bits_per_second']
-                self.actual_transfer_time = float(receiver_data['seconds'])
-                self.avg_rtt = get_avg_rtt(stdout.decode()) / 1000
-                self.retransmit_bytes = int(sender_data['retransmits']) * self.mtu
-                self.retransmit_bytes = int(sender_data['retransmits']) * self.mtu
-                self.transfer_bytes = int(sender_data['bytes']) \
-                    + self.retransmit_bytes
-
-            logger.debug("average rtt %s", self.avg_rtt)
-            logger.debug("jitter %s", self.jitter)
-            return self.thpt
-        except:
+            result = self.run_iperf(
+                phase="throughput",
+                stop=monitor,
+                window=self.stream_window,
+                mss=self.mss,
+                bytes=f"{self.file_size/8}",
+                num_streams=self.streams if self.streams > 1 else None,
+                interval=config.getfloat('RFC6349', 'convergence_interval',
+                                         fallback=1) if monitor else None,
+                get_server_output=True)
+        except Exception as e:
+            logger.error('Iperf Error %s', e)
+            try:
+                rtt_probe.stop()
+            except Exception:
+                # keep the iperf error, not the prober's
+                logger.exception("rtt probe failed")
             raise
+        rtt_stats = rtt_probe.stop()
+
+        logger.debug("Is Sender %s", self.sender)
+        # Test Info
+        d = datetime.fromtimestamp(result.timestamp)
+        self.timestamp = d.strftime("%m/%d/%Y, %H:%M:%S")
+        logger.info("DateTime %s", self.timestamp)
+        self.iperf_version = result.version
+        self.system_info = result.system_info
+        self.sndbuf_actual = result.sndbuf_actual
+        self.rcvbuf_actual = result.rcvbuf_actual
+        self.sndr_tcp_congestion = result.sender_tcp_congestion
+        self.rcvr_tcp_congestion = result.receiver_tcp_congestion
+        self.host_system_util = result.host_system_util
+        self.remote_system_util = result.remote_system_util
+        # None when no probe was answered, buffer_delay is unknown then
+        self.avg_rtt = rtt_stats.avg
+        if self.avg_rtt is None:
+            logger.warning("no rtt probe answered during the throughput "
+                           "test, buffer delay unknown")
+        self.stream_results = []
+        self.converged = bool(monitor and monitor.converged)
+        if self.converged:
+            self.converged_transfer(self.intervals[monitor.role],
+                                    monitor.steady_bps)
+            logger.info("Throughput converged after %.1fs", self.measured_time)
+            return self.thpt
+        if self.sender:
+            senders = [stream.sender for stream in result.streams]
+            measured = senders
+            sender_data = result.sum_sent
+            measured_data = sender_data
+        else:
+            # retransmits are only known to the sending server
+            senders = [stream.sender
+                       for stream in result.server_output.streams]
+            measured = [stream.receiver for stream in result.streams]
+            sender_data = result.server_output.sum_sent
+            measured_data = result.sum_received
+        self.thpt = measured_data.bits_per_second
+        self.actual_transfer_time = measured_data.seconds
+        self.measured_time = measured_data.seconds
+        self.retransmit_bytes = int(sender_data.retransmits) * self.mtu
+        self.transfer_bytes = int(sender_data.bytes) + self.retransmit_bytes
+        for sender, receiver in zip(senders, measured):
+            retransmit_bytes = int(sender.retransmits) * self.mtu
+            self.stream_results.append({
+                "thpt": int(receiver.bits_per_second),
+                "transfer_time": receiver.seconds,
+                "transfer_bytes": int(sender.bytes) + retransmit_bytes,
+                "retransmit_bytes": retransmit_bytes,
+                })
+
+        logger.debug("average rtt %s", self.avg_rtt)
+        logger.debug("jitter %s", self.jitter)
+        return self.thpt
+
+    def converged_transfer(self, aggregate, steady_bps):
+        """
+        Results of a throughput test stopped at convergence. The file's
+        remaining bytes are assumed to move at the steady throughput, so
+        actual_transfer_time is for the whole file like the ideal transfer
+        time it is compared with, and retransmissions are scaled up at the
+        rate seen so far. Reverse tests see no retransmits, the server's
+        counts only come with the final result, so their retransmit_bytes
+        (and TCP efficiency) are None.
+        Every stream is taken to move its share of the bytes measured so
+        far for the whole transfer time.
+        :aggregate - wpms.iperf_stream.IntervalAggregate of the measured side
+        """
+        file_bytes = self.file_size / 8
+        remaining = max(0, file_bytes - aggregate.bytes)
+        self.thpt = steady_bps
+        self.measured_time = aggregate.seconds
+        self.actual_transfer_time = (aggregate.seconds +
+                                     remaining * 8 / steady_bps)
+        self.retransmit_bytes = self.scaled_retransmit_bytes(
+            aggregate.retransmits, file_bytes / aggregate.bytes)
+        self.transfer_bytes = int(file_bytes) + (self.retransmit_bytes or 0)
+        if not aggregate.streams:
+            logger.warning("iperf3 reported no stream intervals, no per "
+                           "stream results")
+        for stream in aggregate.streams.values():
+            share = stream.bytes / aggregate.bytes
+            retransmit_bytes = self.scaled_retransmit_bytes(
+                stream.retransmits, file_bytes / aggregate.bytes)
+            self.stream_results.append({
+                "thpt": int(steady_bps * share),
+                "transfer_time": self.actual_transfer_time,
+                "transfer_bytes": (int(file_bytes * share) +
+                                   (retransmit_bytes or 0)),
+                "retransmit_bytes": retransmit_bytes,
+                })
+
+    def scaled_retransmit_bytes(self, retransmits, scale):
+        """
+        Retransmitted bytes of the whole file from the retransmits seen so
+        far, None when they are unknown because the server is sending.
+        """
+        if not self.sender:
+            return None
+        return int(retransmits * scale) * self.mtu
+
+    def calculate_stream_metrics(self):
+        """
+        Transfer time ratio and TCP efficiency of every stream and the
+        fairness of the streams. A stream's ideal transfer time is that of
+        the bytes it moved at its share of the maximum achievable
+        throughput.
+        """
+        calc = TcpCalc()
+        share = self.max_achievable_thpt / len(self.stream_results)
+        for stream in self.stream_results:
+            retransmit_bytes = stream["retransmit_bytes"]
+            sent = stream["transfer_bytes"] - (retransmit_bytes or 0)
+            stream["transfer_time_ratio"] = calc.get_ttr(
+                stream["transfer_time"], calc.get_itt(sent * 8, share))
+            stream["tcp_efficiency"] = (
+                None if retransmit_bytes is None
+                else calc.get_tcp_efficiency(sent, retransmit_bytes))
+        self.fairness = calc.get_fairness(
+            [stream["thpt"] for stream in self.stream_results])
 
     def create_dict(self):
 
@@ -435,6 +838,9 @@ class TcpTest:
             "baseline_rtt": self.base_rtt,
             "Jitter": self.jitter,
             "bb": int(self.bb),
+            "bb_confidence": self.bb_confidence,
+            "bb_probe_time": self.bb_probe_time,
+            "bb_trials": self.bb_trials,
             "bdp": self.bdp,
             "rwnd": self.minimum_wnd_size,
             "actual_thpt": int(self.thpt),
@@ -442,6 +848,8 @@ class TcpTest:
             "ideal_transfer_time": self.ideal_transfer_time,
             "actual_transfer_time": self.actual_transfer_time,
             "transfer_time_ratio": self.transfer_time_ratio,
+            "converged": self.converged,
+            "measured_time": self.measured_time,
             "tcp_efficiency": self.tcp_efficiency,
             "buffer_delay": self.buffer_delay,
             "timestamp": self.timestamp,
@@ -451,34 +859,54 @@ class TcpTest:
             "transfer_bytes": self.transfer_bytes,
             "retransmit_bytes": self.retransmit_bytes,
             "mode": self.test_mode,
+            "server": self.server_ip,
             "sender_tcp_congestion": self.sndr_tcp_congestion,
             "receiver_tcp_congestion": self.rcvr_tcp_congestion,
             "host_system_util": self.host_system_util,
             "remote_system_util": self.remote_system_util,
+            "streams": self.streams,
+            "stream_window": self.stream_window,
+            "fairness": self.fairness,
+            "stream_results": self.stream_results,
             "test_id": str(uuid.uuid4())
         }
 
         return test_data
 
 
-if __name__ == "__main__":
-    mode = sys.argv[1]
-    cir = sys.argv[2]
-    server_ip = sys.argv[3]
-    nping_server = sys.argv[4]
-    logger.info("mode %s", mode)
-    handler = TcpTest(mode, cir, server_ip, nping_server)
-    pmtu = handler.pmtu()
+def run_test(handler):
+    """
+    Run every phase of the RFC 6349 test process on handler and
+    calculate the TCP metrics.
+    :returns the result as created by TcpTest.create_dict
+    """
+    load_config()
+    try:
+        with metrics.span("wpms_test_seconds", mode=handler.test_mode):
+            return _run_phases(handler)
+    finally:
+        handler.close()
+        push_metrics()
+
+
+def run_phase(name, phase):
+    """phase(), timed with its retries into wpms_phase_seconds"""
+    with metrics.span("wpms_phase_seconds", phase=name):
+        return phase()
+
+
+def _run_phases(handler):
+    pmtu = run_phase("pmtu", handler.pmtu)
     logger.info("PMTU %s", pmtu)
     logger.info("MSS %s", handler.mss)
-    baseline_rtt = handler.baseline_rtt()
+    baseline_rtt = run_phase("baseline_rtt", handler.baseline_rtt)
     logger.info("Baseline RTT %s", baseline_rtt)
-    bb = handler.bandwidth()
+    bb = run_phase("bandwidth", handler.bandwidth)
     logger.info("Bottleneck BW %s", bb)
     logger.info("BDP %s bits", handler.bdp)
     logger.info("BDP Bytes %s", handler.tcp_wnd_size)
     logger.info("Optimal Window Size %s", handler.minimum_wnd_size)
-    thpt = handler.thpt_test()
+    thpt = run_phase("throughput", handler.thpt_test)
     logger.info("TCP Throughput %s", handler.thpt)
     logger.debug("Calculate Max Achievable THPT")
     handler.max_achievable_thpt = get_max_thpt(handler.cir, handler.mtu)
@@ -488,58 +916,94 @@ if __name__ == "__main__":
     logger.debug("Ideal Transfer Time %s", handler.ideal_transfer_time)
     logger.debug("Actual Transfer Time %s", handler.actual_transfer_time)
     logger.info("Transfer Time Ratio %s", handler.transfer_time_ratio)
-    handler.tcp_efficiency = ((
-        handler.transfer_bytes - handler.retransmit_bytes) /
-        handler.transfer_bytes) * 100
+    if handler.retransmit_bytes is None:
+        # converged reverse test, the server's retransmits are unknown
+        handler.tcp_efficiency = None
+    else:
+        handler.tcp_efficiency = ((
+            handler.transfer_bytes - handler.retransmit_bytes) /
+            handler.transfer_bytes) * 100
     logger.info("TCP Efficiency %s%%", handler.tcp_efficiency)
-    handler.buffer_delay = ((handler.avg_rtt - handler.base_rtt) /
-                            handler.base_rtt) * 100
+    if handler.avg_rtt is None:
+        handler.buffer_delay = None
+    else:
+        handler.buffer_delay = ((handler.avg_rtt - handler.base_rtt) /
+                                handler.base_rtt) * 100
     logger.info("Buffery delay %s%%", handler.buffer_delay)
+    if handler.stream_results:
+        handler.calculate_stream_metrics()
+        logger.info("Fairness %s over %s streams", handler.fairness,
+                    handler.streams)
+    return handler.create_dict()
+
+
+def push_metrics():
+    """
+    Send the metrics recorded since the last push to the dashboard at
+    dashboard_url, which serves them on /metrics. Best effort: metrics
+    that can't be sent are dropped.
+    """
+    url = config.get('RFC6349', 'dashboard_url', fallback='')
+    if not url:
+        return
+    forwarder = iperf_stream.DashboardForwarder(
+        url, event="agent_metrics",
+        station=config.get('upload', 'station', fallback='') or None)
+    try:
+        forwarder(metrics.registry.snapshot(reset=True))
+    finally:
+        forwarder.close()
+
+
+def save_result(rfc_data, store=None):
+    """
+    Append the result to the results store, store defaults to results_path.
+    """
+    if store is not None:
+        store.append(rfc_data)
+        return
+    with ResultStore(results_path) as store:
+        store.append(rfc_data)
+
+
+def upload_result(rfc_data):
+    """
+    Queue the result in the local outbox and upload whatever is waiting
+    for at most upload timeout seconds. Results that couldn't be sent
+    stay in the outbox for the next run.
+    :returns True when the outbox was emptied
+    """
+    outbox = Outbox(outbox_path)
+    try:
+        outbox.put(rfc_data)
+        base_url = config.get('upload', 'base_url', fallback='')
+        if not base_url:
+            return False
+        credentials = {
+            key: config.get('upload', key, fallback='')
+            for key in ('email', 'station', 'password')}
+        uploader = Uploader(
+            outbox, base_url, credentials,
+            batch_size=config.getint('upload', 'batch_size', fallback=50))
+        try:
+            return uploader.drain(
+                timeout=config.getfloat('upload', 'timeout', fallback=30))
+        finally:
+            uploader.stop()
+    finally:
+        outbox.close()
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1]
+    cir = sys.argv[2]
+    server_ip = sys.argv[3]
+    nping_server = sys.argv[4]
+    logger.info("mode %s", mode)
+    handler = TcpTest(mode, cir, server_ip, nping_server)
     # print("mode: {} \t cir: {}".format(mode, cir))
     # print("uscaled_windows: ", unscaled_window)
-    rfc_data = handler.create_dict()
+    rfc_data = run_test(handler)
     print(rfc_data)
-    # BASE_URL = "http://ec2-108-137-45-5.ap-southeast-3.compute.amazonaws.com/api/"
-    # TOKEN_URL = "user/auth-token/"
-    # RFC_URL = "netmon/rfcdata/"
-    # headers = {
-    #     "Accept": "Application/json",
-    #     "Content-Type": "application/json"
-    # }
-    # payload = {
-    #     "email": "tester@wpms.com",
-    #     "station": "rpi_malvar",
-    #     "password": "netmesh!@#"
-    # }
-    dt = datetime.strptime(handler.timestamp,
-                                  "%m/%d/%Y, %H:%M:%S")
-    filename = dt.strftime("%m%d%Y_%H%M%S") + ".csv"
-
-    file_path = csv_path + filename
-    with open(file_path, 'w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=rfc_data.keys())
-        writer.writeheader()
-        writer.writerow(rfc_data)
-
-    # auth_obj = None
-    # payload = json.dumps(payload)
-    # rfc_data = json.dumps(rfc_data)
-    # try:
-    #     res = requests.post(BASE_URL + TOKEN_URL,
-    #                         data=payload,
-    #                         headers=headers
-    #                         )
-    #     auth_obj = res.json()
-
-    # except ConnectionError as e:
-    #     logger.error("Connection error %s", e)
-
-    # token = auth_obj.get('token')
-    # headers['Authorization'] = f"Token {token}"
-    # logger.debug("Token %s", token)
-    # res = requests.post(
-    #     BASE_URL + RFC_URL,
-    #     headers=headers,
-    #     data=rfc_data)
-    # logger.debug(" %s ", res)
-    # logger.debug("RFC POST %s", res.status_code)
+    save_result(rfc_data)
+    upload_result(rfc_data)
@@ -1,53 +1,48 @@
 import json
-import re
+import socket
 import subprocess
 from multiprocessing import Process
 from datetime import datetime
-from time import time as timer
 import asyncio
 import socketio
 
 #from wpms.netperf import IperfClient
 from wpms import ping
+from wpms.latency import LatencyProber
 from wpms.ookla import speedtest
 
 
 sio = socketio.AsyncClient()
 
-last = 0
-send_ping_to_server = True
+# probes every 50ms, at most 64 in flight, percentiles reported every second
+latency_prober = LatencyProber(sio.emit, interval=0.05, window=64,
+                               report_interval=1.0,
+                               station=socket.gethostname())
 
 
-def get_min_rtt(res):
-    rtts = re.findall("rtt: \d+.\d+ms", res)
-    min_rtt = rtts[1]
-    min_rtt = re.search("\d+.\d+",min_rtt) # get actual value
-    if not min_rtt:
-        return False
-    min_rtt = float(min_rtt.group())
-    return min_rtt
+speedtest_task = None
 
-async def send():
-    global last
-    last = timer()
-    await sio.emit('ping_from_client')
 
+async def background_task(msg):
+    """
+    Tasks run next to the latency probing, run_task returns right away.
+    """
+    global speedtest_task
+    task = msg.get('task')
+    if task == 1:  # ookla speedtest
+        if speedtest_task is not None and not speedtest_task.done():
+            print('speedtest already running')
+            return
+        print("running ookla speedtest")
+        speedtest_task = asyncio.ensure_future(speedtest.run_async(sio.emit))
+    else:
+        print('unsupported task', task)
 
+
+# tasks 2 - 4 are not ported yet
 #async def background_task(msg):
 #    task = msg.get('task')
-#    print("running ookla speedtest")
-#    if task == 1: # ookla speedtest
-#        proc = speedtest.run()
-#        while task:
-#            out = proc.stdout.readline()
-#            if out == '' and proc.poll() is not None:
-#                break
-#            if out:
-#                serialize = json.loads(out)
-#                await sio.sleep(0.1)
-#                await sio.emit('ookla', serialize)
-#
-#    elif task == 2: # Ping test
+#    if task == 2: # Ping test
 #        addr = msg.get('data')
 #        proc = ping.run(addr)
 #        print(proc)
@@ -78,7 +73,7 @@ async def send():
 #        while True:
 #            p = subprocess.run(f"sudo nping --tcp --data-length {payload_size} --df  --echo-client  \
 #            test 192.168.1.214", shell=True, stdout=subprocess.PIPE)
-#            min_rtt = get_min_rtt(p.stdout.decode())
+#            min_rtt = nping.parse(p.stdout.decode().splitlines()).min
 #            if not min_rtt:
 #                payload_size -= 10
 #                continue
@@ -90,7 +85,7 @@ async def send():
 #        # Using nping with data-length set to largest MTU from 1
 #        p = subprocess.run("sudo nping --tcp --data-length 1460 --df  --echo-client  \
 #        test 192.168.1.214", shell=True, stdout=subprocess.PIPE)
-#        min_rtt = get_min_rtt(p.stdout.decode())
+#        min_rtt = nping.parse(p.stdout.decode().splitlines()).min
 #        print(min_rtt)
 
 
@@ -104,17 +99,25 @@ async def run_task(msg):
     await background_task(msg)
 
 
+@sio.event
+async def cancel_task(msg=None):
+    if speedtest_task is not None and not speedtest_task.done():
+        speedtest_task.cancel()
+        print('speedtest cancelled')
+
+
 @sio.event
 async def connect():
     print('connection established')
     await sio.sleep(1)
     await sio.emit('join_dashboard')
-    await send()
+    latency_prober.start()
 
 
 @sio.event
 async def disconnect():
     print('disconnected from server')
+    latency_prober.stop()
 
 
 @sio.event
@@ -124,20 +127,12 @@ async def server_event(data):
 
 @sio.event
 async def stop_ping_server():
-    global send_ping_to_server
-    send_ping_to_server = False
+    latency_prober.stop()
 
 
 @sio.event
-async def pong_from_server():
-    global last
-    global send_ping_to_server
-    latency = timer() - last
-    last = latency
-    await sio.emit('client_latency', {'data': latency})
-    #await sio.sleep(0.1)
-    if send_ping_to_server:
-        await send()
+async def pong_from_server(seq):
+    latency_prober.on_pong(seq)
 
 
 async def main():
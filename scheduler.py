@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Run an RFC 6349 test plan against many servers in parallel.
+
+    python3 scheduler.py plan.ini
+
+The plan is an ini file with a [plan] section and one section per server:
+
+    [plan]
+    workers = 4
+    repetitions = 1
+
+    [202.90.158.6]
+    nping_server = 202.90.158.6
+    directions = reverse, forward
+    cir = 100000000
+    reverse_cir = 200000000
+    ports = 5201
+
+Jobs of different servers run concurrently on a pool of workers, jobs of
+the same server never overlap. Every running job holds one of the server's
+iperf3 ports, so a server with several iperf3 daemons can be given a
+higher concurrency.
+"""
+import configparser
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import logging
+from logger_settings import Logger
+
+logger = logging.getLogger(__name__)
+logger = Logger(logger)
+
+DEFAULT_PORT = 5201
+
+
+class Job:
+    def __init__(self, server, nping_server, direction, cir, repetition=0):
+        self.server = server
+        self.nping_server = nping_server
+        self.direction = direction
+        self.cir = int(cir)
+        self.repetition = repetition
+        self.port = None
+        self.result = None
+        self.error = None
+        self.elapsed = 0
+
+    @property
+    def ok(self):
+        return self.error is None and self.result is not None
+
+    def __repr__(self):
+        return "<Job {} {} {} #{}>".format(
+            self.server, self.direction, self.cir, self.repetition)
+
+
+class ServerSlots:
+    """
+    Ports and concurrency of a single iperf3 server.
+    """
+
+    def __init__(self, ports=(DEFAULT_PORT,), concurrency=1):
+        if not ports or concurrency < 1:
+            raise ValueError("A server needs at least one port and slot")
+        self.free_ports = deque(ports)
+        self.concurrency = min(concurrency, len(self.free_ports))
+        self.running = 0
+
+    @property
+    def available(self):
+        return self.running < self.concurrency and bool(self.free_ports)
+
+    def acquire(self):
+        self.running += 1
+        return self.free_ports.popleft()
+
+    def release(self, port):
+        self.running -= 1
+        # the port goes to the back, the next job tries a different daemon
+        self.free_ports.append(port)
+
+
+def split_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def load_plan(path):
+    """
+    :returns (jobs, slots, workers)
+    """
+    plan = configparser.ConfigParser()
+    if not plan.read(path):
+        raise FileNotFoundError(path)
+    workers = plan.getint("plan", "workers", fallback=4)
+    repetitions = plan.getint("plan", "repetitions", fallback=1)
+
+    jobs = []
+    slots = {}
+    servers = [s for s in plan.sections() if s != "plan"]
+    for repetition in range(repetitions):
+        for server in servers:
+            section = plan[server]
+            for direction in split_list(section.get("directions",
+                                                    "reverse, forward")):
+                if direction not in ("reverse", "forward"):
+                    raise ValueError("Unknown direction {} for {}".format(
+                        direction, server))
+                cirs = section.get(direction + "_cir", section.get("cir"))
+                if not cirs:
+                    raise ValueError("No cir for {} {}".format(
+                        server, direction))
+                for cir in split_list(cirs):
+                    jobs.append(Job(
+                        server,
+                        section.get("nping_server", server),
+                        direction,
+                        cir,
+                        repetition))
+    for server in servers:
+        section = plan[server]
+        ports = [int(p) for p in split_list(
+            section.get("ports", str(DEFAULT_PORT)))]
+        slots[server] = ServerSlots(
+            ports, section.getint("concurrency", fallback=1))
+    return jobs, slots, workers
+
+
+def run_job(job):
+    """
+    Default job runner: run the RFC 6349 test process in this process.
+    """
+    import rfc6349
+    handler = rfc6349.TcpTest("--" + job.direction, job.cir, job.server,
+                              job.nping_server, port=job.port)
+    return rfc6349.run_test(handler)
+
+
+class Scheduler:
+    """
+    Dispatches jobs to a thread pool. A job is only handed to a worker
+    when its server has a free slot, so workers never sit blocked on a
+    busy server while jobs of idle servers are waiting.
+    """
+
+    def __init__(self, jobs, slots=None, workers=4, runner=run_job,
+                 on_result=None):
+        self.jobs = list(jobs)
+        self.slots = slots or {}
+        for job in self.jobs:
+            self.slots.setdefault(job.server, ServerSlots())
+        self.workers = workers
+        self.runner = runner
+        self.on_result = on_result
+        self.done = 0
+
+    def _execute(self, job):
+        started = time.monotonic()
+        try:
+            job.result = self.runner(job)
+        except Exception as e:
+            logger.exception("%r failed", job)
+            job.error = e
+        finally:
+            job.elapsed = time.monotonic() - started
+        return job
+
+    def _next_job(self, pending):
+        for server, queue in pending.items():
+            if self.slots[server].available:
+                job = queue.popleft()
+                if not queue:
+                    del pending[server]
+                return job
+        return None
+
+    def run(self):
+        pending = {}
+        for job in self.jobs:
+            pending.setdefault(job.server, deque()).append(job)
+        total = len(self.jobs)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                while len(running) < self.workers:
+                    job = self._next_job(pending)
+                    if job is None:
+                        break
+                    job.port = self.slots[job.server].acquire()
+                    running[executor.submit(self._execute, job)] = job
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    self.slots[job.server].release(job.port)
+                    self.done += 1
+                    if job.ok and self.on_result is not None:
+                        self.on_result(job.result)
+                    logger.info("[%s/%s] %s %s %s: %s in %.1fs",
+                                self.done, total, job.server, job.direction,
+                                job.cir, "ok" if job.ok else "failed",
+                                job.elapsed)
+        return self.jobs
+
+
+def report(jobs):
+    failed = [job for job in jobs if not job.ok]
+    logger.info("%s jobs, %s ok, %s failed",
+                len(jobs), len(jobs) - len(failed), len(failed))
+    for job in jobs:
+        if job.ok:
+            logger.info("%s %s cir=%s #%s thpt=%s ttr=%s efficiency=%s",
+                        job.server, job.direction, job.cir, job.repetition,
+                        job.result.get("actual_thpt"),
+                        job.result.get("transfer_time_ratio"),
+                        job.result.get("tcp_efficiency"))
+        else:
+            logger.error("%s %s cir=%s #%s failed: %s",
+                         job.server, job.direction, job.cir, job.repetition,
+                         job.error)
+    return not failed
+
+
+if __name__ == "__main__":
+    import rfc6349
+    jobs, slots, workers = load_plan(sys.argv[1])
+    with rfc6349.ResultStore(rfc6349.results_path) as store:
+        jobs = Scheduler(jobs, slots, workers, on_result=store.append).run()
+    sys.exit(0 if report(jobs) else 1)
@@ -1,18 +1,33 @@
-import socket               # Import socket module
+#!/usr/bin/env python3
+"""
+Known size file transfer, RFC 6349 step 7. Sender side, start
+received_file.py on the other host first.
 
-s = socket.socket()         # Create a socket object
-host = socket.gethostname() # Get local machine name
-port = 12345                 # Reserve a port for your service.
+    python3 send_file.py host [--port 12345] [--file tosend.png]
+                         [--sndbuf bytes] [--mss bytes]
+"""
+import argparse
 
-s.connect((host, port))
-f = open('tosend.png','rb')
-print 'Sending...'
-l = f.read(1024)
-while (l):
-    print 'Sending...'
-    s.send(l)
-    l = f.read(1024)
-f.close()
-print "Done Sending"
-print s.recv(1024)
-s.close
+from wpms.transfer import send_file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("host")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--file", default="tosend.png")
+    parser.add_argument("--sndbuf", type=int)
+    parser.add_argument("--mss", type=int)
+    args = parser.parse_args()
+
+    result = send_file(args.file, args.host, args.port,
+                       sndbuf=args.sndbuf, mss=args.mss)
+    print("sent {bytes} bytes in {receiver_seconds:.3f}s "
+          "({seconds:.3f}s until acked), {mbps:.2f} Mbps".format(
+              mbps=result["throughput"] / 1e6 if result["throughput"] else 0,
+              **result))
+    print("sndbuf {sndbuf} mss {mss}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
+import json
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 
+import tornado.httputil
 import tornado.ioloop
 from tornado.options import define, options, parse_command_line
 import tornado.web
@@ -7,54 +13,106 @@ import tornado.autoreload
 
 import socketio
 
+from wpms import metrics
+from wpms.broadcast import Coalescer
+from wpms.downsample import METHODS
+from wpms.results import ResultStore
+
 define('port', default=5000, help="run on the given port", type=int)
 define('debug', default=False, help='run in debug mode')
+define('tick_rate', default=10, help='dashboard updates per second', type=int)
+define('results_db', default='/var/local/starmon/results.db',
+       help='results database of the history API, latency is stored in it')
 
 sio = socketio.AsyncServer(async_mode='tornado', cors_allowed_origins='*')
+connections = 0
+store = None
+
+
+async def emit(event, data=None, **kwargs):
+    """sio.emit, counted per event for /metrics"""
+    metrics.inc('wpms_socketio_emits_total', event=event)
+    await sio.emit(event, data, **kwargs)
+
+
+# only the latest speedtest progress value is worth showing
+broadcaster = Coalescer(emit, room='/dashboard', limits={
+    'ping_from_server': 1,
+    'dl_result': 1,
+    'ul_result': 1,
+    })
 
 
 @sio.on('ookla')
 async def client_response(sid, data):
     dtype = data.get('type')
     if not dtype:
-        await sio.emit('speedtest_error')
+        await emit('speedtest_error')
     elif dtype == 'ping':
-        await sio.emit('ping_from_server', {'data': data['ping']['latency']},
-                       room='/dashboard')
+        broadcaster.push('ping_from_server', sid,
+                         {'data': data['ping']['latency']})
         print('latency: ', data['ping']['latency'])
     elif dtype == 'download':
-        await sio.emit('dl_result', {'data': data['download']['bandwidth']},
-                       room='/dashboard')
+        broadcaster.push('dl_result', sid,
+                         {'data': data['download']['bandwidth']})
     elif dtype == 'upload':
-        await sio.emit('ul_result', {'data': data['upload']['bandwidth']},
-                       room='/dashboard')
+        broadcaster.push('ul_result', sid,
+                         {'data': data['upload']['bandwidth']})
 
 
 @sio.event
 async def start_speedtest(sid):
-    await sio.emit('speedtest_task', {'data': 'hello'})
+    await emit('speedtest_task', {'data': 'hello'})
 
 
 @sio.event
 async def tasks_event(sid, msg):
     print(sid, msg)
-    await sio.emit('run_task', msg, room="/dashboard")
+    await emit('run_task', msg, room="/dashboard")
+
+
+@sio.event
+async def cancel_task_event(sid, msg=None):
+    await emit('cancel_task', msg, room="/dashboard")
 
 
 @sio.event
 async def ping_event(sid, msg):
     print(msg)
-    await sio.emit('ping_result', msg, room="/dashboard")
+    broadcaster.push('ping_result', sid, msg)
 
 
 @sio.event
 async def connect(sid, environ, auth):
+    global connections
     print('Connect', sid)
-    await sio.emit('my_response', {'data': 'Please Join Room'}, room=sid)
+    connections += 1
+    metrics.registry.set('wpms_socketio_connections', connections)
+    metrics.inc('wpms_socketio_connects_total')
+    await emit('my_response', {'data': 'Please Join Room'}, room=sid)
     # tornado.ioloop.IOLoop.current().spawn_callback(background_task)
     # tornado.ioloop.IOLoop.current().spawn_callback(background_task)
 
 
+@sio.event
+async def disconnect(sid):
+    global connections
+    connections -= 1
+    metrics.registry.set('wpms_socketio_connections', connections)
+
+
+@sio.event
+async def agent_metrics(sid, msg):
+    """span metrics pushed by rfc6349.push_metrics at the end of a test"""
+    if not isinstance(msg, dict):
+        return
+    station = str(msg.pop('station', None) or sid)
+    try:
+        metrics.registry.merge(msg, station=station)
+    except ValueError as e:
+        print('dropping metrics of', repr(station), e)
+
+
 @sio.event
 async def join_dashboard(sid):
     print('joining...')
@@ -62,15 +120,25 @@ async def join_dashboard(sid):
 
 
 @sio.event
-async def ping_from_client(sid):
-    await sio.sleep(0.5)
-    await sio.emit('pong_from_server', room=sid)
+async def ping_from_client(sid, seq=None):
+    if seq is None:
+        # stop-and-wait agents pace themselves with the server's delay
+        await sio.sleep(0.5)
+        await emit('pong_from_server', room=sid)
+    else:
+        await emit('pong_from_server', seq, room=sid)
+
+
+@sio.event
+async def iperf_interval(sid, msg):
+    broadcaster.push('iperf_interval', sid, msg)
 
 
 @sio.event
 async def client_latency(sid, msg):
-    await sio.emit('client_latency', {'data': msg.get('data')},
-                   room='/dashboard')
+    broadcaster.push('client_latency', sid, {'data': msg.get('data')})
+    if store is not None:
+        store.append_latency(msg.get('station') or sid, msg)
 
 
 # class BaseHandler(tornado.web.RequestHandler):
@@ -83,6 +151,185 @@ class MainHandler(tornado.web.RequestHandler):
         print(self.request.headers.get('Authorization'))
         self.render("index.html")
 
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        metrics.registry.set('wpms_broadcast_received', broadcaster.received)
+        metrics.registry.set('wpms_broadcast_dropped', broadcaster.dropped)
+        metrics.registry.set('wpms_broadcast_frames', broadcaster.frames)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.registry.render())
+
+
+class HistoryHandler(tornado.web.RequestHandler):
+    """
+    Base of the history API, JSON for a time range of the results database.
+    Queries and downsampling run in a thread pool on connections of their
+    own, so a long range never holds up the Socket.IO traffic on the
+    IOLoop; in WAL mode they don't block the writer either.
+    The ETag changes when a row is added to the range and Last-Modified is
+    the time of its newest row, so a dashboard loading the same range
+    again gets a 304. Bodies are kept in a small LRU cache, other clients
+    asking for the same range aren't computed again either.
+    """
+    executor = ThreadPoolExecutor(max_workers=2,
+                                  thread_name_prefix='history')
+    local = threading.local()
+    cache = OrderedDict()
+    cache_size = 128
+
+    def initialize(self, path):
+        self.path = path
+
+    def _call(self, fn):
+        # runs in the executor, one connection per thread and database
+        stores = self.local.__dict__.setdefault('stores', {})
+        if self.path not in stores:
+            stores[self.path] = ResultStore(self.path)
+        return fn(stores[self.path])
+
+    def query(self, fn):
+        """:returns awaitable of fn(ResultStore) run in the executor"""
+        return tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, self._call, fn)
+
+    def number(self, name, default=None, cast=float, low=None, high=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            value = cast(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "bad %s %r", name, value)
+        if low is not None:
+            value = max(value, low)
+        if high is not None:
+            value = min(value, high)
+        return value
+
+    def downsampler(self):
+        """:returns (method, function downsampling a series of points)"""
+        budget = self.number('points', 1000, int, low=2, high=10000)
+        method = self.get_argument('method', 'lttb')
+        if method not in METHODS:
+            raise tornado.web.HTTPError(400, "unknown method %r", method)
+        return method, lambda points: METHODS[method](points, budget)
+
+    def not_modified(self, last_modified):
+        if self.request.headers.get('If-None-Match'):
+            return self.check_etag_header()
+        since = self.request.headers.get('If-Modified-Since')
+        if since is None or last_modified is None:
+            return False
+        try:
+            since = parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+
+    async def respond(self, version, compute):
+        """
+        :version - function of a ResultStore returning version() of the
+        range
+        :compute - function of a ResultStore returning the response
+        """
+        count, last_id, last_ts = await self.query(version)
+        etag = '"{}-{}"'.format(count, last_id or 0)
+        self.set_header('Etag', etag)
+        if last_ts is not None:
+            self.set_header('Last-Modified',
+                            tornado.httputil.format_timestamp(last_ts))
+        self.set_header('Cache-Control', 'no-cache')
+        if self.not_modified(last_ts):
+            self.set_status(304)
+            return
+        key = (self.request.uri, etag)
+        body = self.cache.get(key)
+        if body is None:
+            body = await self.query(lambda store: json.dumps(compute(store)))
+            self.cache[key] = body
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        self.set_header('Content-Type', 'application/json')
+        self.write(body)
+
+
+class ResultsHandler(HistoryHandler):
+    """
+    GET /api/results?start=&end=&mode=&server=&limit=&offset=
+    RFC 6349 results oldest first, limit per page, next is the offset of
+    the following page.
+    """
+
+    async def get(self):
+        start, end = self.number('start'), self.number('end')
+        filters = {'mode': self.get_argument('mode', None),
+                   'server': self.get_argument('server', None)}
+        limit = self.number('limit', 100, int, low=1, high=1000)
+        offset = self.number('offset', 0, int, low=0)
+
+        def page(store):
+            results = store.query(start, end, limit=limit, offset=offset,
+                                  **filters)
+            total = store.count(start, end, **filters)
+            following = offset + len(results)
+            return {'results': results, 'total': total, 'offset': offset,
+                    'next': following if following < total else None}
+
+        await self.respond(
+            lambda store: store.version('results', start, end, **filters),
+            page)
+
+
+class ResultSeriesHandler(HistoryHandler):
+    """
+    GET /api/results/series/<field>?start=&end=&mode=&server=&points=&method=
+    [ts, value] of a numeric result field, e.g. actual_thpt, downsampled
+    to points with lttb (default) or minmax.
+    """
+
+    async def get(self, field):
+        start, end = self.number('start'), self.number('end')
+        filters = {'mode': self.get_argument('mode', None),
+                   'server': self.get_argument('server', None)}
+        method, downsample = self.downsampler()
+
+        def series(store):
+            points = store.series(field, start, end, **filters)
+            return {'field': field, 'method': method, 'total': len(points),
+                    'points': downsample(points)}
+
+        await self.respond(
+            lambda store: store.version('results', start, end, **filters),
+            series)
+
+
+class LatencyHandler(HistoryHandler):
+    """
+    GET /api/latency?start=&end=&station=&field=&points=&method=
+    [ts, value] of the latency agents reported, field is a key of
+    wpms.latency.LatencyProber.summary (data, the median, by default).
+    """
+
+    async def get(self):
+        start, end = self.number('start'), self.number('end')
+        station = self.get_argument('station', None)
+        field = self.get_argument('field', 'data')
+        method, downsample = self.downsampler()
+
+        def series(store):
+            points = store.latency_series(field, start, end, station)
+            return {'field': field, 'method': method, 'total': len(points),
+                    'points': downsample(points)}
+
+        await self.respond(
+            lambda store: store.version('latency', start, end,
+                                        station=station),
+            series)
+
+
 # class LoginHandler(BaseHandler):
 #     def get(self):
 #         self.write('<html><body><form action="/login" method="post">'
@@ -102,20 +349,36 @@ def addwatchfiles(*paths):
         tornado.autoreload.watch(file_path)
 
 
-if __name__ == "__main__":
-    parse_command_line()
-    app = tornado.web.Application([
+def make_app(results_db, debug=False):
+    """:results_db - path of the results database of the history API"""
+    history = dict(path=results_db)
+    return tornado.web.Application([
         (r'/', MainHandler),
+        (r'/metrics', MetricsHandler),
         (r'/socket.io/', socketio.get_tornado_handler(sio)),
+        (r'/api/results', ResultsHandler, history),
+        (r'/api/results/series/(\w+)', ResultSeriesHandler, history),
+        (r'/api/latency', LatencyHandler, history),
         #(r'/api/sensor/([^/]+)?', SensorHandler),
         #(r'/api/data/([^/]+)?', DataHandler),
         #(r'/api/tcpmon/([^/]+)?', TcpMonHandler)
         ],
         template_path=os.path.join(os.path.dirname(__file__), "templates"),
         static_path=os.path.join(os.path.dirname(__file__), "static"),
-        debug=options.debug,
+        compress_response=True,
+        debug=debug,
     )
+
+
+if __name__ == "__main__":
+    parse_command_line()
+    store = ResultStore(options.results_db)
+    app = make_app(options.results_db, debug=options.debug)
     app.listen(options.port)
+    # latency summaries are written in batches
+    tornado.ioloop.PeriodicCallback(store.flush, 5000).start()
+    broadcaster.tick_rate = options.tick_rate
+    tornado.ioloop.IOLoop.current().spawn_callback(broadcaster.run)
     tornado.autoreload.start()
     addwatchfiles('templates/index.html')
     tornado.ioloop.IOLoop.current().start()
@@ -10,6 +10,17 @@ function formatBytes(bytes, decimals = 2) {
 }
 
 
+// telemetry arrives coalesced as {batch: {agent: [msg, ...]}}
+function onBatch(socket, event, handler) {
+    socket.on(event, function(msg) {
+        if (!msg.batch)
+            return handler(msg);
+        for (const agent in msg.batch)
+            msg.batch[agent].forEach(handler);
+    });
+}
+
+
 $(document).ready(function() {
       // socket
       var socket = io.connect('http://localhost:5000', namespaces=['/dashboard']);
@@ -23,7 +34,7 @@ $(document).ready(function() {
           }
           $('#transport').text('(Connected)');
       });
-      socket.on('ping_from_server', function(msg) {
+      onBatch(socket, 'ping_from_server', function(msg) {
 
           $('#latency').text(msg.data.toFixed() + 'ms');
       });
@@ -37,21 +48,25 @@ $(document).ready(function() {
           $('#transport').text('(disconnected)');
       });
 
-      socket.on('dl_result', function(msg) {
+      onBatch(socket, 'dl_result', function(msg) {
           $('#dl_speed').text(formatBytes(msg.data));
       });
-      socket.on('ul_result', function(msg) {
+      onBatch(socket, 'ul_result', function(msg) {
           $('#ul_speed').text(formatBytes(msg.data));
       });
       socket.on('speedtest_error', function(){
           alert('An error occured, Please try again.')
       })
-      socket.on('client_latency', function(msg){
+      onBatch(socket, 'client_latency', function(msg){
         if (time)
             time.append(+new Date, msg.data);
     })
 
-      socket.on('ping_result', function(msg){
+      onBatch(socket, 'iperf_interval', function(msg){
+        console.log(msg.phase, msg.role, msg.bits_per_second);
+    })
+
+      onBatch(socket, 'ping_result', function(msg){
         console.log(msg.data);
         // time.append(+new Date, msg.data);
     })
@@ -0,0 +1,5 @@
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-thresholds", action="store_true", default=False,
+        help="fail benchmarks slower than their mean time in "
+             "tests/fixtures/benchmark_thresholds.json")
@@ -0,0 +1,102 @@
+import errno
+import socket
+import subprocess
+import threading
+
+import pytest
+
+import agent
+
+
+@pytest.fixture
+def server(tmp_path):
+    jobs = []
+
+    def runner(job):
+        jobs.append(job)
+        if job["cir"] == 0:
+            raise ValueError("cir must be positive")
+        return {"mode": job["mode"], "actual_thpt": job["cir"] // 2}
+
+    path = str(tmp_path / "agent.sock")
+    server = agent.AgentServer(path, runner=runner)
+    server.jobs_run = jobs
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_job_roundtrip(server):
+    path = server.server_address
+    reply = agent.request({"mode": "--reverse", "cir": 200, "server": "a",
+                           "nping_server": "b"}, path, timeout=5)
+    assert reply == {"ok": True,
+                     "result": {"mode": "--reverse", "actual_thpt": 100}}
+    reply = agent.request({"mode": "--forward", "cir": 0, "server": "a",
+                           "nping_server": "b"}, path, timeout=5)
+    assert reply == {"ok": False, "error": "cir must be positive"}
+    assert agent.request({"op": "ping"}, path, timeout=5)["jobs"] == 2
+    assert len(server.jobs_run) == 2
+
+
+def test_main(server, capsys):
+    path = server.server_address
+    assert agent.main(["--socket", path, "--reverse", "200",
+                       "a", "b"]) == 0
+    assert '"actual_thpt": 100' in capsys.readouterr().out
+    assert agent.main(["--socket", path, "--forward", "0", "a", "b"]) == 1
+    assert agent.main(["--socket", path, "200", "a", "b"]) == 2
+    assert agent.main(["--socket", path + ".gone", "ping"]) == 2
+
+
+def test_reap_children():
+    sleeper = subprocess.Popen(["sleep", "30"])
+    other = subprocess.Popen(["sleep", "30"])
+    try:
+        assert set(agent.reap_children(("sleep",))) == {sleeper.pid,
+                                                          other.pid}
+        assert agent.reap_children(("sleep",)) == []
+    finally:
+        for proc in (sleeper, other):
+            proc.kill()
+
+
+def test_socket_of_a_running_agent_is_kept(server):
+    path = server.server_address
+    with pytest.raises(OSError) as e:
+        agent.AgentServer(path)
+    assert e.value.errno == errno.EADDRINUSE
+    assert agent.request({"op": "ping"}, path, timeout=5)["ok"]
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "agent.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server = agent.AgentServer(path)
+    try:
+        assert server.server_address == path
+    finally:
+        server.server_close()
+
+
+def test_config_reload_drops_deleted_options(tmp_path, monkeypatch):
+    import os
+
+    import rfc6349
+    path = tmp_path / "config.ini"
+    path.write_text("[RFC6349]\nstreams = 4\nbandwidth_search = no\n")
+    monkeypatch.setattr(rfc6349, "config_path", str(path))
+    monkeypatch.setattr(rfc6349, "config_mtime", None)
+    monkeypatch.setattr(rfc6349, "config", rfc6349.config)
+    assert rfc6349.load_config().getint("RFC6349", "streams") == 4
+    path.write_text("[RFC6349]\nstreams = 2\n")
+    os.utime(path, ns=(0, 10 ** 9))
+    config = rfc6349.load_config()
+    assert config is rfc6349.config
+    assert config.getint("RFC6349", "streams") == 2
+    assert not config.has_option("RFC6349", "bandwidth_search")
@@ -0,0 +1,208 @@
+import random
+
+import pytest
+
+from wpms.bandwidth import BandwidthSearch, Trial
+
+CIR = 10 ** 9
+
+
+def link(capacity, noise=0.0, seed=1, log=None):
+    """UDP over a bottleneck, what exceeds the capacity is dropped"""
+    rnd = random.Random(seed)
+
+    def run_trial(rate):
+        if log is not None:
+            log.append(rate)
+        received = min(rate, capacity) * (1 - rnd.uniform(0, noise))
+        lost = max(0.0, (rate - capacity) / rate * 100)
+        return Trial(rate, received, lost, 0.05)
+    return run_trial
+
+
+@pytest.mark.parametrize("capacity", [9.4e8, 6e8, 3.3e8, 1.2e8, 3e7])
+def test_finds_the_bottleneck(capacity):
+    estimate = BandwidthSearch(link(capacity, noise=0.01), CIR).run()
+    assert estimate.bandwidth == pytest.approx(capacity, rel=0.06)
+    assert estimate.bandwidth <= capacity
+    assert estimate.confidence >= 0.95
+    assert len(estimate.trials) <= 8
+
+
+def test_clean_link_stops_at_the_ceiling():
+    rates = []
+    estimate = BandwidthSearch(link(2 * CIR, log=rates), CIR).run()
+    assert rates == [CIR / 2, CIR]
+    assert estimate.bandwidth == CIR
+    assert estimate.confidence == 1
+
+
+def test_nothing_clean():
+    def run_trial(rate):
+        return Trial(rate, rate * 0.99 * min(1, 2e8 / rate), 1.0, 0.05)
+    estimate = BandwidthSearch(run_trial, CIR, max_trials=4).run()
+    assert estimate.confidence == 0
+    assert estimate.bandwidth < 2e8
+    assert len(estimate.trials) == 4
+
+
+def test_jitter_threshold():
+    def run_trial(rate):
+        return Trial(rate, rate, 0, 5.0 if rate > 4e8 else 0.1)
+    estimate = BandwidthSearch(run_trial, CIR, jitter=1.0).run()
+    assert 3.8e8 <= estimate.bandwidth <= 4e8
+
+
+def test_tcptest_bandwidth(monkeypatch):
+    import configparser
+
+    import rfc6349
+    from wpms.netperf import IperfResult
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"bandwidth_cache_ttl": "0"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    handler = rfc6349.TcpTest("--reverse", CIR, "10.0.0.1", "10.0.0.1")
+    handler.rtt = 0.01
+    trial = link(4e8)
+    durations = []
+
+    def run_iperf(phase=None, **settings):
+        durations.append(settings["duration"])
+        assert settings["omit"] == 1
+        rate = int(settings["bitrate"].split("/")[0])
+        result = trial(rate)
+        udp = {"bits_per_second": result.received, "seconds": 2,
+               "lost_percent": result.lost_percent, "jitter_ms": 0.05}
+        return IperfResult.from_json({"end": {"sum_received": udp}})
+    monkeypatch.setattr(handler, "run_iperf", run_iperf)
+    assert handler.bandwidth() == pytest.approx(4e8, rel=0.05)
+    assert set(durations) == {2}
+    assert handler.bb_trials == len(durations)
+    assert handler.bb_confidence >= 0.95
+    assert handler.bdp == int(0.01 * handler.bb)
+
+
+def test_failed_trial_is_retried_alone(monkeypatch):
+    import configparser
+
+    import tenacity
+
+    import rfc6349
+    from wpms.netperf import IperfError, IperfResult
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"bandwidth_cache_ttl": "0"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    monkeypatch.setattr(tenacity.nap.time, "sleep", lambda seconds: None)
+    handler = rfc6349.TcpTest("--reverse", CIR, "10.0.0.1", "10.0.0.1")
+    handler.rtt = 0.01
+    trial = link(4e8)
+    rates = []
+
+    def run_iperf(phase=None, **settings):
+        rate = int(settings["bitrate"].split("/")[0])
+        rates.append(rate)
+        if len(rates) == 3:
+            raise IperfError("the server is busy running a test")
+        result = trial(rate)
+        udp = {"bits_per_second": result.received, "seconds": 2,
+               "lost_percent": result.lost_percent, "jitter_ms": 0.05}
+        return IperfResult.from_json({"end": {"sum_received": udp}})
+    monkeypatch.setattr(handler, "run_iperf", run_iperf)
+    assert handler.bandwidth() == pytest.approx(4e8, rel=0.05)
+    # the failed third trial ran again, the search didn't start over
+    assert rates[2] == rates[3]
+    assert handler.bb_trials == len(rates) - 1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def cached(monkeypatch, tmp_path):
+    """TcpTest with the bandwidth cache in tmp_path and a fake clock"""
+    import configparser
+
+    import rfc6349
+    from wpms import cache
+    from wpms.netperf import IperfResult
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"bandwidth_cache_ttl": "600",
+                                  "rtt_drift": "0.25"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    monkeypatch.setattr(rfc6349, "bandwidth_cache_path",
+                        str(tmp_path / "bandwidth.json"))
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    trials = []
+
+    def make(rtt=0.01, server="10.0.0.1", mode="--reverse", cir=CIR,
+             mtu=1500):
+        handler = rfc6349.TcpTest(mode, cir, server, server)
+        handler.rtt = rtt
+        handler.mtu = mtu
+        trial = link(4e8)
+
+        def run_iperf(phase=None, **settings):
+            result = trial(int(settings["bitrate"].split("/")[0]))
+            trials.append(result.rate)
+            udp = {"bits_per_second": result.received, "seconds": 2,
+                   "lost_percent": result.lost_percent, "jitter_ms": 0.05}
+            return IperfResult.from_json({"end": {"sum_received": udp}})
+        monkeypatch.setattr(handler, "run_iperf", run_iperf)
+        return handler
+    make.config = config
+    make.clock = clock
+    make.trials = trials
+    return make
+
+
+def test_bandwidth_cache_hit_skips_udp(cached):
+    bb = cached().bandwidth()
+    measured = len(cached.trials)
+    handler = cached(rtt=0.012)
+    assert handler.bandwidth() == bb
+    assert len(cached.trials) == measured
+    assert handler.bb_trials == 0
+    # the window follows the current rtt, not the cached one
+    assert handler.bdp == int(0.012 * handler.bb)
+    assert handler.tcp_wnd_size == handler.bdp // 8
+
+
+def test_bandwidth_cache_expires(cached):
+    cached().bandwidth()
+    measured = len(cached.trials)
+    cached.clock.now += 601
+    cached().bandwidth()
+    assert len(cached.trials) == 2 * measured
+
+
+def test_bandwidth_cache_disabled(cached):
+    cached.config.set("RFC6349", "bandwidth_cache_ttl", "0")
+    cached().bandwidth()
+    measured = len(cached.trials)
+    assert not cached().cached_bandwidth()
+    cached().bandwidth()
+    assert len(cached.trials) == 2 * measured
+
+
+def test_bandwidth_cache_rtt_drift(cached):
+    cached().bandwidth()
+    drifted = cached(rtt=0.02)
+    assert not drifted.cached_bandwidth()
+    # the entry is gone, even a run with the original rtt measures again
+    assert not cached().cached_bandwidth()
+
+
+@pytest.mark.parametrize("key", [{"server": "10.0.0.2"},
+                                 {"mode": "--forward"},
+                                 {"cir": CIR // 10},
+                                 {"mtu": 9000}])
+def test_bandwidth_cache_key(cached, key):
+    cached().bandwidth()
+    assert not cached(**key).cached_bandwidth()
+    assert cached().cached_bandwidth()
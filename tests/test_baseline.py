@@ -0,0 +1,45 @@
+import threading
+
+from wpms.baseline import BaselineStore
+
+
+def test_minimum_per_path(tmp_path):
+    with BaselineStore(tmp_path / "baseline.db", horizon=100) as store:
+        assert store.get("eth0", "10.0.0.1") is None
+        assert store.update("eth0", "10.0.0.1", 0.020, now=0) == 0.020
+        assert store.update("eth0", "10.0.0.1", 0.025, now=10) == 0.020
+        # a fast server doesn't lower the baseline of a slow one
+        assert store.update("eth0", "10.0.0.2", 0.002, now=20) == 0.002
+        assert store.update("wlan0", "10.0.0.1", 0.030, now=30) == 0.030
+        assert store.get("eth0", "10.0.0.1", now=30) == 0.020
+
+
+def test_window_slides(tmp_path):
+    with BaselineStore(tmp_path / "baseline.db", horizon=100) as store:
+        store.update("eth0", "10.0.0.1", 0.010, now=0)
+        store.update("eth0", "10.0.0.1", 0.030, now=60)
+        # the route changed, the old minimum ages out
+        assert store.update("eth0", "10.0.0.1", 0.040, now=150) == 0.030
+        assert store.get("eth0", "10.0.0.1", now=170) == 0.040
+        assert store.conn.execute(
+            "SELECT COUNT(*) FROM baseline").fetchone()[0] == 2
+
+
+def test_concurrent_updates(tmp_path):
+    path = tmp_path / "baseline.db"
+    BaselineStore(path).close()
+
+    def run(i):
+        with BaselineStore(path) as store:
+            for j in range(20):
+                store.update("eth0", "10.0.0.1", 0.010 + (i * 20 + j) / 1e4)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with BaselineStore(path) as store:
+        assert store.get("eth0", "10.0.0.1") == 0.010
+        assert store.conn.execute(
+            "SELECT COUNT(*) FROM baseline").fetchone()[0] == 80
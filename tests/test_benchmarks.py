@@ -0,0 +1,210 @@
+"""
+Benchmarks of the parsing and reporting hot paths on recorded tool output
+in tests/fixtures, run with pytest-benchmark:
+
+    python3 -m pytest tests/test_benchmarks.py --benchmark-autosave
+    python3 -m pytest tests/test_benchmarks.py \
+        --benchmark-compare --benchmark-compare-fail=mean:25%
+
+With --benchmark-thresholds every benchmark also has to stay below its
+mean time in tests/fixtures/benchmark_thresholds.json (seconds, with
+headroom for a Raspberry Pi agent), wall clock limits are not checked
+on a plain run. With --benchmark-disable the code runs once as a plain
+test.
+
+    python3 -m pytest tests/test_benchmarks.py --benchmark-thresholds
+"""
+import configparser
+import json
+import os
+import uuid
+
+import pytest
+
+import rfc6349
+import trace_rtt
+from tests.test_pcap_rtt import CLIENT, MS, SERVER, connection, frame, \
+    write_pcap
+from utils import TcpCalc, batch_metrics, get_max_thpt
+from wpms import nping
+from wpms.netperf import IperfResult
+from wpms.pcap_rtt import TCP_ACK, analyze
+from wpms.prober import RttStats
+from wpms.results import ResultStore
+
+pytest.importorskip("pytest_benchmark")
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+IPERF_DOCUMENTS = ["iperf3_tcp_forward", "iperf3_tcp_reverse",
+                   "iperf3_udp_forward", "iperf3_udp_reverse"]
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+THRESHOLDS = json.loads(fixture("benchmark_thresholds.json"))
+
+
+@pytest.fixture(autouse=True)
+def threshold(benchmark, request):
+    yield
+    if not request.config.getoption("benchmark_thresholds"):
+        return
+    if benchmark.disabled or benchmark.stats is None:
+        return
+    mean = benchmark.stats.stats.mean
+    limit = THRESHOLDS[request.node.name]
+    assert mean <= limit, "{} mean {:.6f}s over {}s".format(
+        request.node.name, mean, limit)
+
+
+class Probe:
+    def stop(self):
+        return RttStats()
+
+
+def tcp_test(monkeypatch, name, streams=1):
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"streams": str(streams)}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    mode = "--reverse" if "reverse" in name else "--forward"
+    handler = rfc6349.TcpTest(mode, 10 ** 8, "202.90.158.6", "202.90.158.6")
+    handler.mss = 1460
+    handler.rtt = 0.0107
+    handler.base_rtt = 0.0107
+    handler.bb = 9.5 * 10 ** 7
+    handler.set_bdp()
+    text = fixture(name + ".json")
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: Probe())
+    monkeypatch.setattr(
+        handler, "run_iperf",
+        lambda phase=None, stop=None, **settings:
+            IperfResult.from_json(json.loads(text)))
+    return handler
+
+
+def test_nping(benchmark):
+    lines = fixture("nping_icmp.txt").splitlines()
+    summary = benchmark(nping.parse, lines)
+    assert (summary.min, summary.avg) == pytest.approx((0.010704, 0.012728))
+
+
+@pytest.mark.parametrize("name", IPERF_DOCUMENTS)
+def test_iperf_result(benchmark, name):
+    text = fixture(name + ".json")
+    result = benchmark(lambda: IperfResult.from_json(json.loads(text)))
+    assert result.sum_received.bytes
+
+
+@pytest.mark.parametrize("name", IPERF_DOCUMENTS[:2])
+def test_thpt_test(benchmark, monkeypatch, name):
+    handler = tcp_test(monkeypatch, name, streams=4)
+    assert benchmark(handler.thpt_test) > 0
+    assert len(handler.stream_results) == 4
+    assert handler.retransmit_bytes
+
+
+@pytest.mark.parametrize("name", IPERF_DOCUMENTS[2:])
+def test_bandwidth_trial(benchmark, monkeypatch, name):
+    handler = tcp_test(monkeypatch, name)
+    trial = benchmark(handler.bandwidth_trial, 10 ** 8, 2)
+    assert trial.lost_percent > 0
+
+
+def test_create_dict(benchmark, monkeypatch):
+    handler = tcp_test(monkeypatch, "iperf3_tcp_forward", streams=4)
+    handler.thpt_test()
+    handler.max_achievable_thpt = get_max_thpt(handler.cir, handler.mtu)
+    handler.calculate_stream_metrics()
+    record = benchmark(handler.create_dict)
+    assert json.loads(json.dumps(record))["streams"] == 4
+
+
+def test_save_result(benchmark, monkeypatch, tmp_path):
+    handler = tcp_test(monkeypatch, "iperf3_tcp_forward")
+    handler.thpt_test()
+    handler.timestamp = "10/18/2026, 09:12:09"
+    record = handler.create_dict()
+    with ResultStore(tmp_path / "results.db", batch_size=50) as store:
+        benchmark(lambda: rfc6349.save_result(
+            dict(record, test_id=str(uuid.uuid4())), store))
+    with ResultStore(tmp_path / "results.db") as store:
+        assert store.count()
+
+
+@pytest.fixture(scope="module")
+def capture(tmp_path_factory):
+    """one bulk transfer of 2000 segments, every other one acked"""
+    packets = connection()
+    seq = 1001
+    for i in range(2000):
+        t = 20 * MS + i * MS
+        packets.append((t, frame(CLIENT, SERVER, seq, 5001, TCP_ACK, 1448)))
+        seq += 1448
+        if i % 2:
+            packets.append((t + 10 * MS, frame(SERVER, CLIENT, 5001, seq,
+                                               TCP_ACK)))
+    path = tmp_path_factory.mktemp("pcap") / "iperf.dump"
+    write_pcap(path, sorted(packets, key=lambda p: p[0]))
+    return str(path)
+
+
+def test_capture_rtt(benchmark, capture):
+    flows = benchmark(analyze, capture)
+    assert flows[0]["a2b"]["rtt_samples"] > 900
+
+
+def test_capture_rtt_csv(benchmark, capture, capsys):
+    benchmark(trace_rtt.main, capture)
+    rows = capsys.readouterr().out.splitlines()
+    assert rows[0].startswith("a,b,RTT_min_a2b")
+
+
+@pytest.fixture(scope="module")
+def runs():
+    calc_runs = []
+    for i in range(1000):
+        calc_runs.append({
+            "link_speed": (10 ** 8, 2 * 10 ** 8, 10 ** 9)[i % 3],
+            "mtu": 576 + i % 925,
+            "block_size": 10 ** 8,
+            "actual_transfer_time": 0.5 + i % 30,
+            "transfer_bytes": 10 ** 6 + i * 1000 + i % 97,
+            "retransmit_bytes": i % 97,
+            "avg_rtt": 0.001 + (i % 200) / 1000,
+            "baseline_rtt": 0.001 + (i % 100) / 1000,
+        })
+    return calc_runs
+
+
+def test_tcpcalc(benchmark, runs):
+    calc = TcpCalc()
+
+    def metrics():
+        out = []
+        for run in runs:
+            max_thpt = get_max_thpt(run["link_speed"], run["mtu"])
+            itt = calc.get_itt(run["block_size"], max_thpt)
+            out.append((
+                calc.get_ttr(run["actual_transfer_time"], itt),
+                calc.get_tcp_efficiency(
+                    run["transfer_bytes"] - run["retransmit_bytes"],
+                    run["retransmit_bytes"]),
+                calc.get_buffer_delay(run["avg_rtt"], run["baseline_rtt"])))
+        return out
+
+    assert len(benchmark(metrics)) == len(runs)
+
+
+def test_batch_metrics(benchmark, runs):
+    pytest.importorskip("numpy")
+    columns = {key: [run[key] for run in runs] for key in runs[0]}
+    out = benchmark(batch_metrics, columns)
+    assert len(out["buffer_delay"]) == len(runs)
+
+
+def test_fairness(benchmark):
+    thpts = [2.3e7 + 1e5 * i for i in range(64)]
+    assert 0.99 < benchmark(TcpCalc().get_fairness, thpts) <= 1
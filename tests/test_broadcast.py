@@ -0,0 +1,56 @@
+import asyncio
+
+from wpms.broadcast import Coalescer
+
+
+class FakeServer:
+    def __init__(self):
+        self.frames = []
+
+    async def emit(self, event, data, room=None):
+        self.frames.append((event, data, room))
+
+
+def test_flush_coalesces_per_event():
+    server = FakeServer()
+    coalescer = Coalescer(server.emit)
+    for i in range(3):
+        coalescer.push('client_latency', 'agent-a', {'data': i})
+        coalescer.push('client_latency', 'agent-b', {'data': i * 10})
+    coalescer.push('dl_result', 'agent-a', {'data': 5})
+    asyncio.run(coalescer.flush())
+    assert len(server.frames) == 2
+    event, data, room = server.frames[0]
+    assert event == 'client_latency' and room == '/dashboard'
+    assert data['batch']['agent-b'] == [{'data': 0}, {'data': 10},
+                                        {'data': 20}]
+    asyncio.run(coalescer.flush())
+    assert len(server.frames) == 2  # nothing new, nothing emitted
+
+
+def test_superseded_samples_are_dropped():
+    server = FakeServer()
+    coalescer = Coalescer(server.emit, max_samples=2,
+                          limits={'dl_result': 1})
+    for i in range(5):
+        coalescer.push('client_latency', 'a', i)
+        coalescer.push('dl_result', 'a', i)
+    asyncio.run(coalescer.flush())
+    batches = {event: data['batch']['a'] for event, data, _ in server.frames}
+    assert batches == {'client_latency': [3, 4], 'dl_result': [4]}
+    assert coalescer.dropped == 3 + 4
+
+
+def test_run_ticks_and_stop_flushes():
+    server = FakeServer()
+
+    async def main():
+        coalescer = Coalescer(server.emit, tick_rate=100)
+        coalescer.start()
+        coalescer.push('ping_result', 'a', 1)
+        await asyncio.sleep(0.05)
+        coalescer.push('ping_result', 'a', 2)
+        await coalescer.stop()
+
+    asyncio.run(main())
+    assert [f[1]['batch']['a'] for f in server.frames] == [[1], [2]]
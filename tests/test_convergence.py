@@ -0,0 +1,166 @@
+import configparser
+import json
+
+import pytest
+
+import rfc6349
+from wpms import iperf_stream
+from wpms.convergence import ConvergenceMonitor, interval_rtt
+from wpms.prober import RttStats
+
+
+def sample(bps, role="sender"):
+    return {"role": role, "bits_per_second": bps}
+
+
+def stream_lines(rates, sender=True):
+    yield json.dumps({"event": "start", "data": {
+        "version": "iperf 3.17", "timestamp": {"timesecs": 0}}})
+    for i, bps in enumerate(rates):
+        total = {"start": i, "end": i + 1, "seconds": 1.0,
+                 "bytes": bps // 8, "bits_per_second": bps, "sender": sender}
+        if sender:
+            total["retransmits"] = 2
+        yield json.dumps({"event": "interval", "data": {"sum": total}})
+    yield json.dumps({"event": "end", "data": {}})
+
+
+def test_monitor_waits_for_a_steady_window():
+    monitor = ConvergenceMonitor("sender", window=3, max_cov=0.05)
+    assert not monitor(sample(1e8))
+    assert not monitor(sample(9e8))
+    assert not monitor(sample(9.5e8, role="receiver"))
+    assert not monitor(sample(9.4e8))
+    assert monitor(sample(9.6e8))
+    assert monitor.converged
+    assert monitor.steady_bps == pytest.approx(9.333e8, rel=1e-3)
+
+
+def test_monitor_checks_rtt():
+    rtts = iter([0.01, 0.05, 0.01, 0.011, 0.01])
+    monitor = ConvergenceMonitor("sender", window=3, rtt=lambda: next(rtts),
+                                 max_rtt_cov=0.1)
+    assert [monitor(sample(1e8)) for _ in range(5)] == \
+        [False, False, False, False, True]
+
+
+def test_interval_rtt():
+    stats = RttStats()
+    rtt = interval_rtt(stats)
+    assert rtt() is None
+    stats.received, stats.avg = 2, 0.01
+    assert rtt() == pytest.approx(0.01)
+    stats.received, stats.avg = 4, 0.02
+    assert rtt() == pytest.approx(0.03)
+
+
+def test_consume_stops_early():
+    monitor = ConvergenceMonitor("sender", window=2, max_cov=0.01)
+    doc, aggregates = iperf_stream.consume(
+        stream_lines([8000, 16000, 16000, 16000]), stop=monitor)
+    assert "end" not in doc
+    assert aggregates["sender"].intervals == 3
+
+
+class Probe:
+    def stop(self):
+        return RttStats()
+
+
+def test_converged_throughput_is_extrapolated(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"convergence": "yes",
+                                  "convergence_window": "2",
+                                  "convergence_cov": "0.01"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    commands = []
+
+    def run(cmd, reverse=False, on_interval=None, stop=None):
+        commands.append(cmd)
+        return iperf_stream.consume(
+            stream_lines([4 * 10 ** 6, 8 * 10 ** 6, 8 * 10 ** 6, 8 * 10 ** 6]),
+            reverse, on_interval, stop)
+
+    monkeypatch.setattr(iperf_stream, "run", run)
+    # 40 Mbit file, 2.5 MB sent in 3 s, the rest takes 2.5 s at 8 Mbps
+    handler = rfc6349.TcpTest("--forward", 4 * 10 ** 7, "10.0.0.1",
+                              "10.0.0.1")
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: Probe())
+    assert handler.thpt_test() == 8 * 10 ** 6
+    assert "-i" in commands[0]
+    assert handler.converged
+    assert handler.measured_time == 3.0
+    assert handler.actual_transfer_time == 5.5
+    # 6 retransmits for 2.5 MB, 12 for the whole file
+    assert handler.retransmit_bytes == 12 * handler.mtu
+    assert handler.transfer_bytes == 5 * 10 ** 6 + 12 * handler.mtu
+
+
+def test_converged_parallel_streams(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"convergence": "yes", "streams": "2",
+                                  "convergence_window": "2",
+                                  "convergence_cov": "0.01"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+
+    def lines():
+        yield json.dumps({"event": "start", "data": {
+            "version": "iperf 3.17", "timestamp": {"timesecs": 0}}})
+        for i in range(4):
+            streams = [{"socket": 5, "seconds": 1.0, "bytes": 750000,
+                        "bits_per_second": 6e6, "retransmits": 2},
+                       {"socket": 7, "seconds": 1.0, "bytes": 250000,
+                        "bits_per_second": 2e6, "retransmits": 0}]
+            yield json.dumps({"event": "interval", "data": {
+                "streams": streams,
+                "sum": {"seconds": 1.0, "bytes": 10 ** 6,
+                        "bits_per_second": 8e6, "retransmits": 2,
+                        "sender": True}}})
+
+    def run(cmd, reverse=False, on_interval=None, stop=None):
+        return iperf_stream.consume(lines(), reverse, on_interval, stop)
+
+    monkeypatch.setattr(iperf_stream, "run", run)
+    handler = rfc6349.TcpTest("--forward", 4 * 10 ** 7, "10.0.0.1",
+                              "10.0.0.1")
+    handler.mss = 1460
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: Probe())
+    handler.thpt_test()
+    assert handler.converged and handler.streams == 2
+    # stopped after 2 intervals: 2 MB of the 5 MB file, 3 MB at 8 Mbps
+    assert handler.actual_transfer_time == 5.0
+    fast, slow = handler.stream_results
+    assert (fast["thpt"], slow["thpt"]) == (6 * 10 ** 6, 2 * 10 ** 6)
+    assert fast["retransmit_bytes"] == 10 * handler.mtu
+    assert slow["transfer_bytes"] == 1250000
+    handler.max_achievable_thpt = 8e6
+    handler.calculate_stream_metrics()
+    assert handler.fairness == pytest.approx(64 / (2 * 40))
+    assert len(handler.create_dict()["stream_results"]) == 2
+
+
+def test_converged_reverse_has_unknown_retransmits(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"convergence": "yes",
+                                  "convergence_window": "2",
+                                  "convergence_cov": "0.01"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+
+    def run(cmd, reverse=False, on_interval=None, stop=None):
+        return iperf_stream.consume(
+            stream_lines([8 * 10 ** 6] * 4, sender=False),
+            reverse, on_interval, stop)
+
+    monkeypatch.setattr(iperf_stream, "run", run)
+    handler = rfc6349.TcpTest("--reverse", 4 * 10 ** 7, "10.0.0.1",
+                              "10.0.0.1")
+    handler.base_rtt = 0.002
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: Probe())
+    monkeypatch.setattr(handler, "pmtu", lambda: 1500)
+    monkeypatch.setattr(handler, "baseline_rtt", lambda: 0.002)
+    monkeypatch.setattr(handler, "bandwidth", lambda: 10 ** 9)
+    record = rfc6349._run_phases(handler)
+    assert record["converged"]
+    assert record["retransmit_bytes"] is None
+    assert record["tcp_efficiency"] is None
+    assert record["transfer_bytes"] == 5 * 10 ** 6
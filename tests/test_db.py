@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from wpms import db
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().wpms.rfc6349
+
+
+def test_client_is_shared(monkeypatch):
+    monkeypatch.setattr(db, "MongoClient", mongomock.MongoClient)
+    monkeypatch.setattr(db, "_client", None)
+    assert db.get_client() is db.get_client()
+    assert db.DBHandler().client is db.get_client()
+    db.close_client()
+    assert db._client is None
+
+
+def test_repository_flushes_on_batch_size(collection):
+    repo = db.ResultRepository(collection, batch_size=3, flush_interval=60)
+    for i in range(7):
+        repo.add({"i": i})
+    assert collection.count_documents({}) == 6
+    repo.close()
+    assert collection.count_documents({}) == 7
+    assert repo.inserted == 7
+
+
+def test_repository_flushes_on_time(collection):
+    repo = db.ResultRepository(collection, batch_size=100,
+                               flush_interval=0.05).start()
+    repo.add({"i": 0})
+    deadline = time.monotonic() + 2
+    while collection.count_documents({}) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert collection.count_documents({}) == 1
+    repo.close()
+
+
+class Flaky:
+    """collection whose next insert_many calls fail with errors"""
+
+    def __init__(self, collection, errors):
+        self.collection = collection
+        self.errors = list(errors)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def insert_many(self, documents, ordered=True):
+        if self.errors:
+            error = self.errors.pop(0)
+            if callable(error):
+                error = error(documents)
+            raise error
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+def test_repository_keeps_failed_batches(collection):
+    from pymongo.errors import AutoReconnect, BulkWriteError
+
+    def partial(documents):
+        # the first document was written, the second was a duplicate
+        collection.insert_one(documents[0])
+        return BulkWriteError({"nInserted": 1, "writeErrors": [
+            {"index": 1, "code": 11000}, {"index": 2, "code": 91}]})
+
+    repo = db.ResultRepository(Flaky(collection, [AutoReconnect(), partial,
+                                                   AutoReconnect()]),
+                               batch_size=100, flush_interval=0.05)
+    for i in range(3):
+        repo.add({"i": i})
+    with pytest.raises(AutoReconnect):
+        repo.flush()
+    assert len(repo.buffer) == 3
+    with pytest.raises(BulkWriteError):
+        repo.flush()
+    assert [d["i"] for d in repo.buffer] == [2]
+    repo.start()  # the flush thread retries and survives failures
+    deadline = time.monotonic() + 2
+    while repo.buffer and time.monotonic() < deadline:
+        time.sleep(0.01)
+    repo.close()
+    assert sorted(d["i"] for d in collection.find()) == [0, 2]
+    assert repo.inserted == 2
@@ -0,0 +1,109 @@
+import json
+import math
+import os
+import tempfile
+import time
+from unittest import mock
+
+import pytest
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from wpms.downsample import lttb, minmax
+from wpms.results import ResultStore
+
+server = pytest.importorskip("server")
+
+SERIES = [(float(i), math.sin(i / 50) + (5 if i == 777 else 0))
+          for i in range(5000)]
+
+
+@pytest.mark.parametrize("downsample", [lttb, minmax])
+def test_downsample_budget(downsample):
+    kept = downsample(SERIES, 100)
+    assert 2 < len(kept) <= 100
+    assert [p[0] for p in kept] == sorted(p[0] for p in kept)
+    assert SERIES[777] in kept  # the spike survives
+    assert downsample(SERIES[:50], 100) == SERIES[:50]
+
+
+def test_lttb_keeps_ends():
+    kept = lttb(SERIES, 10)
+    assert len(kept) == 10
+    assert kept[0] == SERIES[0] and kept[-1] == SERIES[-1]
+
+
+class HistoryTest(AsyncHTTPTestCase):
+    def get_app(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "results.db")
+        self.store = ResultStore(path)
+        for i in range(250):
+            self.store.append({"test_id": str(i), "timestamp": 3600.0 * i,
+                               "mode": ("forward", "reverse")[i % 2],
+                               "actual_thpt": 1e8 + i})
+            self.store.append_latency("pi-1", {"data": 0.01 + i / 1e4,
+                                               "station": "pi-1"},
+                                      ts=60.0 * i)
+        self.store.flush()
+        server.HistoryHandler.cache.clear()
+        return server.make_app(path)
+
+    def get_json(self, path, **kwargs):
+        response = self.fetch(path, **kwargs)
+        assert response.code == 200, response.body
+        return response, json.loads(response.body)
+
+    def test_results_pages(self):
+        _, page = self.get_json("/api/results?mode=reverse&limit=100")
+        assert (len(page["results"]), page["total"], page["next"]) == \
+            (100, 125, 100)
+        _, page = self.get_json("/api/results?mode=reverse&limit=100"
+                                "&offset=100")
+        assert (len(page["results"]), page["next"]) == (25, None)
+
+    def test_series_downsampled(self):
+        _, body = self.get_json("/api/results/series/actual_thpt"
+                                "?points=20&method=minmax&start=3600")
+        assert (body["total"], body["method"]) == (249, "minmax")
+        assert len(body["points"]) <= 20
+        _, body = self.get_json("/api/latency?station=pi-1&points=50")
+        assert (body["total"], len(body["points"])) == (250, 50)
+        response = self.fetch("/api/latency?method=spline")
+        assert response.code == 400
+        # text fields have no series
+        _, body = self.get_json("/api/results/series/mode")
+        assert (body["total"], body["points"]) == (0, [])
+        _, body = self.get_json("/api/latency?field=station")
+        assert body["total"] == 0
+
+    def test_conditional_requests(self):
+        path = "/api/results/series/actual_thpt?points=50"
+        response, _ = self.get_json(path)
+        etag = response.headers["Etag"]
+        modified = response.headers["Last-Modified"]
+        assert self.fetch(path, headers={"If-None-Match": etag}).code == 304
+        assert self.fetch(path, headers={
+            "If-Modified-Since": modified}).code == 304
+        self.store.append({"test_id": "new", "timestamp": 3600.0 * 300,
+                           "actual_thpt": 1e8})
+        self.store.flush()
+        response = self.fetch(path, headers={"If-None-Match": etag})
+        assert response.code == 200
+        assert json.loads(response.body)["total"] == 251
+
+    @gen_test
+    async def test_queries_leave_the_loop_free(self):
+        series = ResultStore.series
+
+        def slow_series(store, *args, **kwargs):
+            time.sleep(0.5)
+            return series(store, *args, **kwargs)
+
+        with mock.patch.object(ResultStore, "series", slow_series):
+            slow = self.http_client.fetch(
+                self.get_url("/api/results/series/actual_thpt?points=9"))
+            started = time.monotonic()
+            await self.http_client.fetch(self.get_url("/metrics"))
+            assert time.monotonic() - started < 0.25
+            assert (await slow).code == 200
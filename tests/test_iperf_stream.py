@@ -0,0 +1,57 @@
+import json
+
+from wpms import iperf_stream
+
+
+def stream_lines(intervals, reverse=False):
+    yield json.dumps({"event": "start", "data": {"version": "iperf 3.17"}})
+    for i in range(intervals):
+        yield json.dumps({"event": "interval", "data": {
+            "streams": [],
+            "sum": {"start": i, "end": i + 1, "seconds": 1.0,
+                    "bytes": 1000 * (i + 1),
+                    "bits_per_second": 8000.0 * (i + 1),
+                    "retransmits": 1, "sender": not reverse}}})
+    yield ""
+    yield json.dumps({"event": "server_output_json", "data": {"end": {}}})
+    yield json.dumps({"event": "end", "data": {"sum_received": {}}})
+
+
+def test_consume_folds_intervals():
+    samples = []
+    doc, aggregates = iperf_stream.consume(stream_lines(4),
+                                           on_interval=samples.append)
+    assert set(doc) == {"start", "end", "server_output_json"}
+    sender = aggregates["sender"]
+    assert sender.intervals == 4
+    assert sender.bytes == 10000
+    assert sender.retransmits == 4
+    assert sender.min_bps == 8000.0
+    assert sender.max_bps == 32000.0
+    assert sender.mean_bps == 20000.0
+    assert sender.bits_per_second == 20000.0
+    assert [s["start"] for s in samples] == [0, 1, 2, 3]
+
+
+def test_consume_reverse_is_receiver():
+    _, aggregates = iperf_stream.consume(stream_lines(2, reverse=True),
+                                         reverse=True)
+    assert list(aggregates) == ["receiver"]
+
+
+def test_consume_error_and_bad_lines():
+    lines = [b'{"event": "error", "data": "unable to connect"}', b"garbage"]
+    doc, aggregates = iperf_stream.consume(lines)
+    assert doc == {"error": "unable to connect"}
+    assert aggregates == {}
+
+
+def test_run_drains_stderr(tmp_path, caplog):
+    # more stderr than a pipe buffer holds before the first line on stdout
+    script = tmp_path / "iperf3"
+    script.write_text(
+        "head -c 200000 /dev/zero | tr '\\\\0' x >&2\n"
+        "echo '{\"event\": \"error\", \"data\": \"unable to connect\"}'\n")
+    doc, _ = iperf_stream.run(["sh", str(script)])
+    assert doc == {"error": "unable to connect"}
+    assert "iperf3 stderr" in caplog.text
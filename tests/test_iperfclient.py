@@ -1,4 +1,4 @@
-from wmps.netperf import IperfClient
+from wpms.netperf import IperfClient
 
 
 def test_client_init_ok():
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from wpms.histogram import Histogram
+from wpms.latency import LatencyProber
+
+
+def test_histogram_exact_below_sub_buckets():
+    h = Histogram()
+    for v in range(1, 101):
+        h.record(v)
+    assert h.percentile(50) == 50
+    assert h.percentile(99) == 99
+    assert h.percentile(100) == 100
+    assert h.mean == 50.5
+
+
+def test_histogram_relative_error():
+    h = Histogram(sub_bucket_bits=8)
+    values = [int(1.37 ** i) for i in range(10, 60)]
+    for v in values:
+        h.record(v)
+    for p in (10, 50, 90):
+        exact = sorted(values)[max(1, -(-p * len(values) // 100)) - 1]
+        assert h.percentile(p) == pytest.approx(exact, rel=1 / 128)
+    assert h.percentile(100) == max(values)
+
+
+def test_histogram_merge_and_reset():
+    a, b = Histogram(), Histogram()
+    a.record(10)
+    b.record(100000, count=3)
+    a.merge(b)
+    assert a.total == 4 and a.min == 10 and a.max == 100000
+    a.reset()
+    assert a.percentile(50) is None
+
+
+class Loopback:
+    """answers every ping like server.py, optionally dropping some"""
+
+    def __init__(self, drop=()):
+        self.prober = None
+        self.drop = drop
+        self.emitted = []
+
+    async def emit(self, event, data=None):
+        if event == 'ping_from_client':
+            if data not in self.drop:
+                asyncio.get_running_loop().call_soon(self.prober.on_pong, data)
+        else:
+            self.emitted.append((event, data))
+
+
+def test_pipelined_probes_and_reports():
+    server = Loopback(drop={3})
+
+    async def main():
+        prober = LatencyProber(server.emit, interval=0.001, window=4,
+                               report_interval=0.02)
+        server.prober = prober
+        prober.start()
+        await asyncio.sleep(0.1)
+        prober.stop()
+        return prober
+
+    prober = asyncio.run(main())
+    reports = [data for event, data in server.emitted]
+    assert reports and all(r['count'] > 0 for r in reports)
+    assert sum(r['lost'] for r in reports) + prober.lost == 1
+    assert set(reports[0]['percentiles']) == {'50', '90', '99', '99.9'}
+
+
+def test_window_bounds_inflight():
+    async def main():
+        prober = LatencyProber(lambda *a: asyncio.sleep(0), window=3)
+        for _ in range(10):
+            await prober.send_probe()
+        return prober
+
+    prober = asyncio.run(main())
+    assert len(prober.inflight) == 3
+    assert prober.lost == 7
+    assert prober.on_pong(0) is None and prober.late == 1
+
+
+def test_report_when_every_probe_is_lost():
+    emitted = []
+
+    async def emit(event, data=None):
+        emitted.append((event, data))
+
+    async def main():
+        prober = LatencyProber(emit, window=2, station="rpi")
+        for _ in range(5):
+            await prober.send_probe()
+        return prober, await prober.report()
+
+    prober, summary = asyncio.run(main())
+    assert summary['data'] is None and summary['count'] == 0
+    assert summary['lost'] == 3 and summary['station'] == "rpi"
+    assert emitted[-1] == ('client_latency', summary)
+    assert prober.lost == 0
+
+
+def test_failed_report_keeps_losses():
+    async def emit(event, data=None):
+        if event == 'client_latency':
+            raise ConnectionError("disconnected")
+
+    async def main():
+        prober = LatencyProber(emit, window=2)
+        for _ in range(5):
+            await prober.send_probe()
+        prober.on_pong(4)
+        with pytest.raises(ConnectionError):
+            await prober.report()
+        return prober
+
+    prober = asyncio.run(main())
+    assert prober.lost == 3
+    assert prober.histogram.total == 1
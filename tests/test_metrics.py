@@ -0,0 +1,146 @@
+import json
+
+import pytest
+from tenacity import retry, stop_after_attempt, wait_none
+
+from wpms import metrics
+from wpms.metrics import Registry
+
+
+def test_span_render():
+    registry = Registry()
+    with registry.span("wpms_phase_seconds", phase="pmtu"):
+        pass
+    with pytest.raises(ValueError):
+        with registry.span("wpms_phase_seconds", phase="pmtu"):
+            raise ValueError
+    registry.observe("wpms_parse_seconds", 0.25, format="nping")
+    registry.inc("wpms_retries_total", phase="pmtu")
+    registry.set("wpms_socketio_connections", 3)
+    text = registry.render()
+    assert "# TYPE wpms_phase_seconds summary" in text
+    assert 'wpms_phase_seconds_count{outcome="error",phase="pmtu"} 1' in text
+    assert 'wpms_parse_seconds{format="nping",quantile="0.5"} 0.25' in text
+    assert 'wpms_parse_seconds_sum{format="nping"} 0.25' in text
+    assert 'wpms_retries_total{phase="pmtu"} 1' in text
+    assert "wpms_socketio_connections 3" in text
+
+
+def test_snapshot_merge():
+    agent = Registry()
+    agent.observe("wpms_phase_seconds", 2.0, phase="bandwidth")
+    agent.inc("wpms_retries_total", 2, phase="bandwidth")
+    snapshot = json.loads(json.dumps(agent.snapshot(reset=True)))
+    assert agent.snapshot() == {"histograms": [], "counters": [],
+                                "gauges": []}
+    server = Registry()
+    server.merge(snapshot, station="pi-1")
+    server.merge(snapshot, station="pi-1")
+    text = server.render()
+    assert ('wpms_phase_seconds_count{phase="bandwidth",station="pi-1"} 2'
+            in text)
+    assert 'wpms_retries_total{phase="bandwidth",station="pi-1"} 4' in text
+
+
+def test_series_are_bounded():
+    registry = Registry(max_series=2)
+    for i in range(5):
+        registry.inc("wpms_socketio_emits_total", event=str(i))
+    assert len(registry.counters) == 2
+    assert registry.dropped == 3
+
+
+def test_retries_and_attempts_are_counted(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    monkeypatch.setattr(metrics, "observe", registry.observe)
+    attempts = []
+
+    @retry(wait=wait_none(), stop=stop_after_attempt(3),
+           before_sleep=metrics.count_retry)
+    @registry.timed("wpms_attempt_seconds", phase="pmtu")
+    def pmtu():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ValueError("no reply")
+        return 1500
+
+    assert pmtu() == 1500
+    assert registry.counters[("wpms_retries_total",
+                              (("phase", "pmtu"),))] == 2
+    text = registry.render()
+    assert 'wpms_attempt_seconds_count{outcome="error",phase="pmtu"} 2' in text
+    assert 'wpms_attempt_seconds_count{outcome="ok",phase="pmtu"} 1' in text
+
+
+def test_subprocess_spans(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    monkeypatch.setattr(metrics, "observe", registry.observe)
+    monkeypatch.setattr(metrics, "span", registry.span)
+    p = metrics.run(["true"], "true")
+    assert p.returncode == 0
+    text = registry.render()
+    assert 'wpms_subprocess_spawn_seconds_count{command="true"} 1' in text
+    assert ('wpms_subprocess_run_seconds_count{command="true",outcome="ok"} 1'
+            in text)
+
+
+def test_merged_series_are_capped_separately():
+    server = Registry(max_series=2, max_merged_series=2)
+    agent = Registry()
+    for phase in ("pmtu", "bandwidth", "thpt"):
+        agent.inc("wpms_retries_total", phase=phase)
+    server.merge(agent.snapshot(), station="pi-1")
+    server.inc("wpms_socketio_emits_total", event="a")
+    server.inc("wpms_socketio_emits_total", event="b")
+    server.inc("wpms_socketio_emits_total", event="c")
+    assert len(server.counters) == 4
+    text = server.render()
+    assert 'wpms_metrics_dropped_series_total{source="local"} 1' in text
+    assert 'wpms_metrics_dropped_series_total{source="merged"} 1' in text
+
+
+@pytest.mark.parametrize("snapshot", [
+    [],
+    {"counters": [["wpms_x", {}, -1]]},
+    {"counters": [["other_metric", {}, 1]]},
+    {"gauges": [["wpms_x", {"bad label": "1"}, 1]]},
+    {"histograms": [["wpms_x", {}, 8, [1, 2], 5, 10, 1, 2]]},
+    {"histograms": [["wpms_x", {}, 8, [0] * 100000, 0, 0, None, None]]},
+    {"gauges": [["wpms_x", {"phase": 'a"} 1\nwpms_fake_total 999\n#'}, 1]]},
+    {"histograms": [["wpms_x", {}, 8, [1], 1, 1, 1, 1],
+                    ["wpms_x", {}, 4, [1], 1, 1, 1, 1]]},
+])
+def test_bad_snapshots_are_rejected(snapshot):
+    registry = Registry()
+    with pytest.raises(ValueError):
+        registry.merge(snapshot, station="pi-1")
+    assert registry.snapshot() == {"histograms": [], "counters": [],
+                                   "gauges": []}
+
+
+def test_label_values_cant_inject_series():
+    registry = Registry()
+    registry.inc("wpms_retries_total", phase='a"} 1\nwpms_fake_total 999\n#')
+    text = registry.render()
+    assert "\nwpms_fake_total" not in text
+    assert 'phase="a\\"} 1\\nwpms_fake_total 999\\n#"' in text
+    agent = Registry()
+    agent.inc("wpms_retries_total", phase="pmtu")
+    with pytest.raises(ValueError):
+        registry.merge(agent.snapshot(),
+                       station='a"} 1\nwpms_fake_total 999\n#')
+
+
+def test_precision_mismatch_merges_nothing():
+    server, agent = Registry(), Registry()
+    server.merge({"histograms": [["wpms_x", {}, 4, [1], 1, 1, 1, 1]]},
+                 station="pi-1")
+    agent.observe("wpms_a", 0.1)
+    agent.observe("wpms_x", 0.1)
+    agent.inc("wpms_retries_total")
+    before = server.snapshot()
+    with pytest.raises(ValueError):
+        server.merge(agent.snapshot(), station="pi-1")
+    assert server.snapshot() == before
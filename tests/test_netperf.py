@@ -0,0 +1,121 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+from wpms import netperf
+from wpms.netperf import IperfError, IperfResult, IperfWorker, arguments
+
+
+def summary(bps, seconds=10.0, **extra):
+    return dict({"bytes": int(bps * seconds / 8), "seconds": seconds,
+                 "bits_per_second": bps}, **extra)
+
+
+def tcp_document(reverse=False):
+    sender = summary(9e8, retransmits=3)
+    receiver = summary(8.9e8)
+    document = {
+        "start": {"version": "iperf 3.9", "timestamp": {"timesecs": 1600000000},
+                  "system_info": "Linux", "sndbuf_actual": 16384,
+                  "rcvbuf_actual": 131072},
+        "end": {"streams": [{"sender": sender, "receiver": receiver}],
+                "sum_sent": sender, "sum_received": receiver,
+                "cpu_utilization_percent": {"host_system": 1.5,
+                                            "remote_system": 2.5},
+                "sender_tcp_congestion": "cubic",
+                "receiver_tcp_congestion": "bbr"},
+    }
+    if reverse:
+        document["server_output_json"] = tcp_document()
+    return document
+
+
+def test_arguments_match_the_cli():
+    assert arguments({
+        "server_hostname": "10.0.0.1", "port": None, "reverse": True,
+        "udp": True, "bitrate": "100000000/10", "pacing_timer": 10,
+        "affinity": 1, "duration": 20, "omit": 1, "get_server_output": True,
+    }) == ["-c", "10.0.0.1", "-R", "-u", "-b", "100000000/10",
+           "--pacing-timer", "10", "-A", "1", "-t", "20", "-O", "1",
+           "--get-server-output"]
+    assert arguments({"reverse": False, "window": 65536, "mss": 1460,
+                      "bytes": "1250000.0", "protocol": "tcp"}) == \
+        ["-w", "65536", "-M", "1460", "-n", "1250000.0"]
+
+
+def test_tcp_result():
+    result = IperfResult.from_json(tcp_document(reverse=True))
+    assert result.version == "iperf 3.9"
+    assert result.sender_tcp_congestion == "cubic"
+    assert result.streams[0].sender.retransmits == 3
+    assert result.streams[0].receiver.bits_per_second == 8.9e8
+    assert result.server_output.streams[0].sender.bytes == 1125000000
+    assert IperfResult.from_json(tcp_document()).server_output is None
+
+
+def test_udp_result():
+    udp = summary(9.5e8, jitter_ms=0.05, lost_packets=2, packets=800000,
+                  lost_percent=0.00025)
+    result = IperfResult.from_json({
+        "start": {}, "end": {"streams": [{"udp": udp}], "sum": udp,
+                             "sum_received": udp}})
+    assert result.sum_received.jitter_ms == 0.05
+    assert result.streams[0].sender == result.streams[0].receiver
+
+
+@pytest.mark.parametrize("document", [None, {}, {"error": "unable to connect"}])
+def test_errors(document):
+    with pytest.raises(IperfError):
+        IperfResult.from_json(document)
+
+
+@pytest.mark.skipif(netperf.available(), reason="libiperf is installed")
+def test_worker_reports_errors_and_survives():
+    with IperfWorker(timeout=30) as worker:
+        for _ in range(2):
+            with pytest.raises(IperfError):
+                worker.run({"server_hostname": "127.0.0.1"})
+            assert worker.process.is_alive()
+
+
+@pytest.fixture
+def iperf_server():
+    """iperf3 -s on a free loopback port"""
+    if shutil.which("iperf3") is None or not netperf.available():
+        pytest.skip("iperf3 and libiperf are required")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        ["iperf3", "-s", "-B", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                server.kill()
+                pytest.skip("iperf3 -s didn't start")
+            time.sleep(0.05)
+    yield port
+    server.kill()
+    server.wait()
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_getaffinity")
+                    or len(os.sched_getaffinity(0)) < 2,
+                    reason="needs cpu affinity and more than one cpu")
+def test_worker_affinity_is_restored(iperf_server):
+    cpus = os.sched_getaffinity(0)
+    with IperfWorker(timeout=30) as worker:
+        result = worker.run({"server_hostname": "127.0.0.1",
+                             "port": iperf_server, "duration": 1,
+                             "affinity": min(cpus)})
+        assert result.sum_received.bits_per_second > 0
+        assert os.sched_getaffinity(worker.process.pid) == cpus
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from wpms import nping
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "nping_icmp.txt")
+
+
+def icmp(kind, ts, seq):
+    if kind == "SENT":
+        return ("SENT ({:.4f}s) ICMP [192.168.1.10 > 202.90.158.6 Echo request "
+                "(type=8/code=0) id=41513 seq={}] IP [ttl=64 id=26123 iplen=28 ]"
+                .format(ts, seq))
+    return ("RCVD ({:.4f}s) ICMP [202.90.158.6 > 192.168.1.10 Echo reply "
+            "(type=0/code=0) id=41513 seq={}] IP [ttl=57 id=48217 iplen=28 ]"
+            .format(ts, seq))
+
+
+def test_recorded_output():
+    with open(FIXTURE, "rb") as f:
+        summary = nping.parse(f)
+    assert (summary.sent, summary.received, summary.lost) == (100, 100, 0)
+    assert summary.min == pytest.approx(0.010704)
+    assert summary.avg == pytest.approx(0.012728)
+    assert summary.max == pytest.approx(0.014864)
+    assert summary.reported_packets == (100, 100, 0)
+    assert summary.min <= summary.percentile(50) <= summary.max
+    assert 0 < summary.stddev < 0.002
+
+
+def test_probes_and_losses():
+    lines = [icmp("SENT", 0, 1), icmp("SENT", 1, 2), icmp("RCVD", 1.012, 2),
+             icmp("SENT", 2, 3), icmp("SENT", 7.5, 4), icmp("RCVD", 7.511, 4),
+             "Max rtt: 12.000ms | Min rtt: 11.000ms | Avg rtt: 11.500ms"]
+    probes = list(nping.iter_probes(lines))
+    assert [(p.seq, p.lost) for p in probes] == [
+        (2, False), (1, True), (3, True), (4, False)]
+    assert probes[0].rtt == pytest.approx(0.012)
+    summary = nping.parse(lines)
+    assert (summary.sent, summary.received) == (4, 2)
+    assert summary.min == 0.011
+
+
+def test_tcp_replies_in_order():
+    lines = ["SENT (0.0303s) TCP 192.168.1.10:21075 > 202.90.158.6:80 S ttl=64",
+             "RCVD (0.0420s) TCP 202.90.158.6:80 > 192.168.1.10:21075 SA ttl=57",
+             "Max rtt: N/A | Min rtt: N/A | Avg rtt: N/A"]
+    summary = nping.parse(lines)
+    assert summary.received == 1
+    assert summary.min == pytest.approx(0.0117)
+    assert summary.reported == (None, None, None)
+
+
+@pytest.mark.parametrize("lines, error", [
+    ([icmp("SENT", 0, 1)], nping.NoSummaryError),
+    (["Max rtt: 12.0ms | Min rtt: 11.0ms"], nping.NpingError),
+    (["Max rtt: 12.0s | Min rtt: 11.0ms | Avg rtt: 11.5ms"], nping.NpingError),
+    (["Raw packets sent: 5 (140B)"], nping.NpingError),
+])
+def test_errors(lines, error):
+    with pytest.raises(error):
+        nping.parse(lines)
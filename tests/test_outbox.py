@@ -0,0 +1,117 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from wpms.outbox import Outbox, Uploader
+
+
+class Api:
+    """state of the stand-in results API"""
+
+    def __init__(self):
+        self.records = []
+        self.posts = 0
+        self.tokens = 0
+        self.clients = set()
+        self.fail_next = 0
+        self.valid_token = None
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=b"{}"):
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            api.clients.add(self.client_address)
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.path == "/api/user/auth-token/":
+                api.tokens += 1
+                api.valid_token = "t%d" % api.tokens
+                return self.reply(200, json.dumps(
+                    {"token": api.valid_token}).encode())
+            if self.headers["Authorization"] != "Token %s" % api.valid_token:
+                return self.reply(401)
+            if api.fail_next:
+                api.fail_next -= 1
+                return self.reply(503)
+            assert self.headers["Content-Encoding"] == "gzip"
+            api.posts += 1
+            api.records.extend(json.loads(gzip.decompress(body)))
+            self.reply(201)
+    return Handler
+
+
+@pytest.fixture
+def api():
+    state = Api()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = "http://127.0.0.1:%d/api/" % server.server_address[1]
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(tmp_path / "outbox.db")
+    yield box
+    box.close()
+
+
+def test_outbox_is_durable(tmp_path):
+    box = Outbox(tmp_path / "outbox.db")
+    box.put({"test_id": "a"})
+    box.close()
+    box = Outbox(tmp_path / "outbox.db")
+    assert [r for _, r in box.peek(10)] == [{"test_id": "a"}]
+    box.ack([i for i, _ in box.peek(10)])
+    assert len(box) == 0
+
+
+def test_batched_upload_reuses_connection_and_token(api, outbox):
+    for i in range(120):
+        outbox.put({"test_id": str(i)})
+    uploader = Uploader(outbox, api.url, {"email": "e"}, batch_size=50)
+    assert uploader.drain(timeout=10)
+    uploader.stop()
+    assert [r["test_id"] for r in api.records] == [str(i) for i in range(120)]
+    assert api.posts == 3
+    assert api.tokens == 1
+    assert len(api.clients) == 1
+
+
+def test_recovers_from_outage_and_expired_token(api, outbox):
+    outbox.put({"test_id": "x"})
+    uploader = Uploader(outbox, api.url, {}, backoff=0.01)
+    uploader.token = "expired"
+    api.fail_next = 3
+    assert uploader.drain(timeout=10)
+    uploader.stop()
+    assert api.records == [{"test_id": "x"}]
+    assert api.tokens == 1
+    assert len(outbox) == 0
+
+
+def test_unreachable_api_keeps_records(outbox):
+    outbox.put({"test_id": "y"})
+    uploader = Uploader(outbox, "http://127.0.0.1:9/api/", {},
+                        backoff=0.01, timeout=0.5)
+    assert not uploader.drain(timeout=0.2)
+    uploader.stop()
+    assert len(outbox) == 1
@@ -0,0 +1,116 @@
+import os
+import struct
+
+import pytest
+
+from tests.test_pcap_rtt import MS, SERVER, TCP_ACK, frame, write_pcap
+from wpms.pcap_index import FlowKey, PcapIndex
+
+
+def client(i):
+    return bytes([10, 0, 0, 10 + i]), 40000 + i
+
+
+def traffic(n, clients=3, t0=0):
+    """n packets round robin over the clients, 1 ms apart"""
+    packets = []
+    for k in range(n):
+        c = client(k % clients)
+        src, dst = (c, SERVER) if k % 2 else (SERVER, c)
+        packets.append((t0 + k * MS, frame(src, dst, k, k, TCP_ACK, 100)))
+    return packets
+
+
+def append_pcap(path, packets, partial=b""):
+    with open(path, "ab") as f:
+        for ts, data in packets:
+            f.write(struct.pack("<IIII", ts // 10 ** 9, ts % 10 ** 9 // 1000,
+                                len(data), len(data)))
+            f.write(data)
+        f.write(partial)
+
+
+def flow_of(i):
+    return ("10.0.0.%d" % (10 + i), 40000 + i, "10.0.0.2", 5201)
+
+
+def seqs(packets):
+    return [struct.unpack_from("!I", data, 14 + 20 + 4)[0]
+            for _, data in packets]
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / "iperf.dump"
+    write_pcap(path, traffic(300))
+    return path
+
+
+def test_flow_and_time_queries(capture):
+    with PcapIndex(capture, chunk=16) as index:
+        assert len(index) == 300
+        assert sorted(index.flows()) == sorted(
+            FlowKey.make(*flow_of(i)) for i in range(3))
+        # either direction of the 5-tuple
+        reverse = flow_of(1)[2:] + flow_of(1)[:2]
+        packets = list(index.packets(reverse, 100 * MS, 130 * MS))
+        assert seqs(packets) == list(range(100, 131, 3))
+        assert [ts for ts, _ in packets] == [k * MS for k in range(100, 131, 3)]
+        assert seqs(index.packets(start=298 * MS)) == [298, 299]
+        assert len(list(index.packets(flow_of(0)))) == 100
+        assert list(index.packets(("10.9.9.9", 1, "10.0.0.2", 5201))) == []
+
+
+def test_index_reused_and_extended(capture):
+    PcapIndex(capture).close()
+    sidecar = str(capture) + ".idx"
+    built = os.stat(sidecar)
+    index = PcapIndex(capture)
+    assert os.stat(sidecar).st_mtime_ns == built.st_mtime_ns
+    assert len(index) == 300
+
+    # a record still being written is left for the next refresh
+    more = traffic(10, t0=400 * MS)
+    append_pcap(capture, more[:5], partial=b"\x00" * 10)
+    index.refresh()
+    assert len(index) == 305
+    assert seqs(index.packets(start=400 * MS)) == list(range(5))
+    index.close()
+
+    with open(capture, "r+b") as f:
+        f.truncate(os.path.getsize(capture) - 10)
+    append_pcap(capture, more[5:])
+    with PcapIndex(capture) as index:
+        assert len(index) == 310
+        assert len(list(index.packets(flow_of(0)))) == 104
+
+
+def test_replaced_capture_is_reindexed(capture):
+    PcapIndex(capture).close()
+    write_pcap(capture, traffic(20, clients=1))
+    with open(capture, "r+b") as f:
+        f.seek(8)
+        f.write(struct.pack("<i", 3600))  # different pcap header
+    with PcapIndex(capture) as index:
+        assert len(index) == 20
+        assert len(index.flows()) == 1
+
+
+def test_capture_with_same_header_is_reindexed(tmp_path, capture):
+    """a new, larger capture of the same interface written to the path"""
+    PcapIndex(capture).close()
+    other = tmp_path / "other.dump"
+    write_pcap(other, traffic(400, clients=2, t0=5 * MS))
+    with open(capture, "rb") as a, open(other, "rb") as b:
+        assert a.read(24) == b.read(24)
+    os.replace(other, capture)
+    with PcapIndex(capture) as index:
+        assert len(index) == 400
+        assert len(index.flows()) == 2
+        assert [ts for ts, _ in index.packets(start=404 * MS)] == [404 * MS]
+
+    # overwritten in place, the inode stays the same
+    write_pcap(capture, traffic(500, clients=1, t0=7 * MS))
+    with PcapIndex(capture) as index:
+        assert len(index) == 500
+        assert len(index.flows()) == 1
@@ -0,0 +1,147 @@
+import struct
+
+import pytest
+
+from wpms.pcap_rtt import (TCP_ACK, TCP_FIN, TCP_RST, TCP_SYN, RttAnalyzer,
+                           analyze, parse_tcp, read_pcap)
+
+CLIENT = (bytes([10, 0, 0, 1]), 40000)
+SERVER = (bytes([10, 0, 0, 2]), 5201)
+MS = 1000000
+
+
+def frame(src, dst, seq, ack, flags, payload=0, sacks=()):
+    options = b""
+    if sacks:
+        options = b"\x01\x01\x05" + bytes([2 + 8 * len(sacks)])
+        for left, right in sacks:
+            options += struct.pack("!II", left, right)
+    tcp = struct.pack("!HHIIBBHHH", src[1], dst[1], seq, ack,
+                      (20 + len(options)) // 4 << 4, flags, 65535, 0, 0)
+    tcp += options
+    # payload is not captured, as with a short snaplen
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp) + payload,
+                     0, 0, 64, 6, 0, src[0], dst[0])
+    return b"\x00" * 12 + b"\x08\x00" + ip + tcp
+
+
+def write_pcap(path, packets):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for ts, data in packets:
+            f.write(struct.pack("<IIII", ts // 10 ** 9, ts % 10 ** 9 // 1000,
+                                len(data), len(data)))
+            f.write(data)
+
+
+def connection(isn_c=1000, isn_s=5000, rtt=10 * MS):
+    """handshake, the client sends with isn_c + 1 next"""
+    return [
+        (0, frame(CLIENT, SERVER, isn_c, 0, TCP_SYN)),
+        (rtt, frame(SERVER, CLIENT, isn_s, isn_c + 1, TCP_SYN | TCP_ACK)),
+        (rtt + MS, frame(CLIENT, SERVER, isn_c + 1, isn_s + 1, TCP_ACK)),
+    ]
+
+
+def test_parse_tcp_sack():
+    data = frame(CLIENT, SERVER, 1, 2, TCP_ACK, 100, sacks=[(10, 20)])
+    src, sport, dst, dport, seq, ack, flags, length, sacks = parse_tcp(1, data)
+    assert (bytes(src), sport, bytes(dst), dport) == CLIENT + SERVER
+    assert (seq, ack, flags, length) == (1, 2, TCP_ACK, 100)
+    assert sacks == [(10, 20)]
+
+
+def test_handshake_and_data_samples(tmp_path):
+    packets = connection(isn_s=5000)
+    seq = 1001
+    for i in range(4):
+        t = 20 * MS + i * 30 * MS
+        packets.append((t, frame(CLIENT, SERVER, seq, 5001, TCP_ACK, 1000)))
+        seq += 1000
+        packets.append((t + 5 * MS, frame(SERVER, CLIENT, 5001, seq, TCP_ACK)))
+    packets.append((200 * MS, frame(CLIENT, SERVER, seq, 5001, TCP_FIN | TCP_ACK)))
+    packets.append((205 * MS, frame(SERVER, CLIENT, 5001, seq + 1,
+                                    TCP_FIN | TCP_ACK)))
+    packets.append((206 * MS, frame(CLIENT, SERVER, seq + 1, 5002, TCP_ACK)))
+    write_pcap(tmp_path / "c.pcap", packets)
+
+    flow, = analyze(tmp_path / "c.pcap")
+    assert flow["a"] == "10.0.0.1:40000"
+    assert flow["b"] == "10.0.0.2:5201"
+    a2b, b2a = flow["a2b"], flow["b2a"]
+    # syn/ack, four data segments and the fin
+    assert a2b["rtt_samples"] == 6
+    assert a2b["rtt_min"] == 5 and a2b["rtt_max"] == 10
+    assert a2b["bytes"] == 4002
+    # the syn/ack (acked after 1 ms) and the fin
+    assert b2a["rtt_samples"] == 2
+    assert b2a["rtt_min"] == 1
+
+
+def test_karn_and_sack(tmp_path):
+    packets = connection()
+    t = 20 * MS
+    for i in range(4):
+        packets.append((t + i * MS,
+                        frame(CLIENT, SERVER, 1001 + i * 100, 5001, TCP_ACK, 100)))
+    # segment 1001 is lost, the next three are sacked
+    for i in range(1, 4):
+        packets.append((t + 10 * MS + i * MS, frame(
+            SERVER, CLIENT, 5001, 1001, TCP_ACK,
+            sacks=[(1101, 1101 + i * 100)])))
+    packets.append((t + 20 * MS, frame(CLIENT, SERVER, 1001, 5001, TCP_ACK, 100)))
+    # this ack follows the retransmission, no sample
+    packets.append((t + 25 * MS, frame(SERVER, CLIENT, 5001, 1401, TCP_ACK)))
+    write_pcap(tmp_path / "k.pcap", packets)
+
+    samples = []
+    flows = []
+    analyzer = RttAnalyzer(flows.append, lambda f, d, ts, rtt: samples.append(
+        (d, rtt // MS)))
+    with open(tmp_path / "k.pcap", "rb") as f:
+        for record in read_pcap(f):
+            analyzer.feed(*record)
+    analyzer.close()
+    # syn, syn/ack, then every sack is matched to the newest sacked segment
+    assert samples == [(0, 10), (1, 1), (0, 10), (0, 10), (0, 10)]
+    assert flows[0]["a2b"]["retransmits"] == 1
+
+
+def test_sequence_wraparound(tmp_path):
+    isn = 2 ** 32 - 1500
+    packets = connection(isn_c=isn)
+    seq = isn + 1
+    for i in range(3):
+        t = 20 * MS + i * 10 * MS
+        packets.append((t, frame(CLIENT, SERVER, seq % 2 ** 32, 5001,
+                                 TCP_ACK, 1000)))
+        seq += 1000
+        packets.append((t + 2 * MS, frame(SERVER, CLIENT, 5001, seq % 2 ** 32,
+                                          TCP_ACK)))
+    write_pcap(tmp_path / "w.pcap", packets)
+    flow, = analyze(tmp_path / "w.pcap")
+    assert flow["a2b"]["rtt_samples"] == 4
+    assert flow["a2b"]["bytes"] == 3001
+
+
+def test_memory_bounded_by_active_flows():
+    finished = []
+    analyzer = RttAnalyzer(finished.append, idle_timeout=1)
+    for i in range(1000):
+        client = (bytes([10, 0, 1, i % 250]), 30000 + i)
+        analyzer.feed(i * MS, 1, frame(client, SERVER, 1, 0, TCP_SYN))
+        analyzer.feed(i * MS + 1, 1, frame(SERVER, client, 1, 2, TCP_RST | TCP_ACK))
+        assert analyzer.active_flows == 0
+    # flows that never close are dropped after idle_timeout
+    for i in range(1000):
+        client = (bytes([10, 0, 2, i % 250]), 30000 + i)
+        analyzer.feed(10 ** 9 + i * 10 * MS, 1, frame(client, SERVER, 1, 0, TCP_SYN))
+        assert analyzer.active_flows <= 150
+    assert len(finished) > 1800
+
+
+def test_rejects_pcapng(tmp_path):
+    path = tmp_path / "x.pcapng"
+    path.write_bytes(b"\x0a\x0d\x0d\x0a" + b"\x00" * 28)
+    with pytest.raises(ValueError, match="pcapng"):
+        analyze(path)
@@ -0,0 +1,37 @@
+from wpms.cache import TtlCache
+from wpms.pmtu import bisect_payload
+
+
+def make_probe(limit):
+    probes = []
+
+    def probe(size):
+        probes.append(size)
+        return size <= limit
+    return probe, probes
+
+
+def test_bisect_finds_largest_payload():
+    probe, probes = make_probe(1372)
+    assert bisect_payload(probe, 536, 1500) == 1372
+    assert len(probes) <= 12
+
+
+def test_bisect_ceiling_first():
+    probe, probes = make_probe(1500)
+    assert bisect_payload(probe, 536, 1500) == 1500
+    assert probes == [1500]
+
+
+def test_bisect_nothing_passes():
+    probe, _ = make_probe(100)
+    assert bisect_payload(probe, 536, 1500) is None
+
+
+def test_cache_ttl(tmp_path):
+    cache = TtlCache(tmp_path / "pmtu.json", ttl=10)
+    key = cache.make_key("10.0.0.1", "eth0")
+    cache.set(key, 1460, now=100)
+    assert cache.get(key, now=105) == 1460
+    assert cache.get(key, now=111) is None
+    assert TtlCache(tmp_path / "pmtu.json").get(key, now=105) == 1460
@@ -0,0 +1,107 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from wpms.prober import ProberThread, RttProber, RttSample, RttStats
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+async def udp_echo_server():
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        EchoProtocol, local_addr=("127.0.0.1", 0))
+    return transport, transport.get_extra_info("sockname")[1]
+
+
+def test_stats_incremental():
+    stats = RttStats()
+    for seq, rtt in enumerate([3, 1, 2, None, 4]):
+        rtt_ns = None if rtt is None else rtt * 1000000
+        stats.add(RttSample(seq, 0, rtt_ns, rtt_ns))
+    assert stats.sent == 5
+    assert stats.lost == 1
+    assert stats.min == 0.001
+    assert stats.max == 0.004
+    assert stats.avg == pytest.approx(0.0025)
+    assert stats.percentile(50) == 0.002
+    assert stats.stddev == pytest.approx(0.00129099, rel=1e-4)
+
+
+def test_udp_echo_loopback():
+    async def main():
+        transport, port = await udp_echo_server()
+        prober = RttProber("127.0.0.1", method="udp", port=port, interval=0)
+        samples = [s async for s in prober.samples(count=10)]
+        transport.close()
+        return prober.stats, samples
+
+    stats, samples = asyncio.run(main())
+    assert [s.seq for s in samples] == list(range(10))
+    assert stats.received == 10
+    assert all(s.recv_ns >= s.sent_ns for s in samples)
+    assert 0 < stats.min <= stats.avg <= stats.max < 1
+
+
+def test_udp_lost_probe():
+    # nothing listens on this port, probes time out
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        prober = RttProber("127.0.0.1", method="udp", port=port,
+                           interval=0, timeout=0.05)
+        stats = asyncio.run(prober.run(count=2))
+    assert stats.lost == 2
+    assert stats.min is None
+
+
+def test_tcp_connect_loopback():
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen(16)
+        prober = RttProber("127.0.0.1", method="tcp",
+                           port=server.getsockname()[1], interval=0)
+        stats = asyncio.run(prober.run(count=5))
+    assert stats.received == 5
+
+
+def test_icmp_loopback():
+    prober = RttProber("127.0.0.1", method="icmp", interval=0, timeout=0.5)
+    try:
+        stats = asyncio.run(prober.run(count=3))
+    except PermissionError:
+        pytest.skip("no permission for ICMP sockets")
+    assert stats.received == 3
+
+
+def test_prober_thread_stop():
+    async def serve(ready, stop):
+        transport, port = await udp_echo_server()
+        ready.append(port)
+        while not stop:
+            await asyncio.sleep(0.01)
+        transport.close()
+
+    ready, stop = [], []
+    server = threading.Thread(target=asyncio.run, args=(serve(ready, stop),))
+    server.start()
+    while not ready:
+        time.sleep(0.01)
+    probe = ProberThread(RttProber("127.0.0.1", method="udp", port=ready[0],
+                                   interval=0.01))
+    probe.start()
+    time.sleep(0.2)
+    stats = probe.stop(timeout=2)
+    stop.append(True)
+    server.join()
+    assert not probe.is_alive()
+    assert stats.received > 0
@@ -0,0 +1,55 @@
+import csv
+
+from wpms.results import ResultStore
+
+
+def record(i, mode="forward", server="10.0.0.1", thpt=100):
+    return {
+        "test_id": "id-%d" % i,
+        "timestamp": 86400.0 * (i // 2) + i,
+        "mode": mode,
+        "server": server,
+        "actual_thpt": thpt,
+    }
+
+
+def test_batched_append(tmp_path):
+    path = tmp_path / "results.db"
+    store = ResultStore(path, batch_size=3)
+    for i in range(4):
+        store.append(record(i))
+    assert ResultStore(path).count() == 3
+    store.close()
+    assert ResultStore(path).count() == 4
+
+
+def test_query_and_aggregate(tmp_path):
+    with ResultStore(tmp_path / "results.db") as store:
+        for i in range(6):
+            store.append(record(i, mode=("forward", "reverse")[i % 2],
+                                thpt=i * 10))
+        store.append(record(0))  # duplicate test_id is ignored
+        store.flush()
+        assert [r["test_id"] for r in store.query(start=86400, end=172800)] \
+            == ["id-2", "id-3"]
+        assert store.count(mode="reverse") == 3
+        assert store.query(limit=2, offset=4)[0]["test_id"] == "id-4"
+        total = store.aggregate("actual_thpt", mode="forward")
+        assert total == [{"bucket": None, "count": 3, "min": 0,
+                          "avg": 20.0, "max": 40}]
+        daily = store.aggregate("actual_thpt", bucket=86400)
+        assert [(d["bucket"], d["avg"]) for d in daily] == \
+            [(0, 5.0), (86400, 25.0), (172800, 45.0)]
+
+
+def test_import_csv(tmp_path):
+    path = tmp_path / "01012023_000000.csv"
+    with open(path, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=["timestamp", "mode", "mtu",
+                                               "test_id"])
+        writer.writeheader()
+        writer.writerow({"timestamp": "01/01/2023, 00:00:00",
+                         "mode": "reverse", "mtu": "1500", "test_id": "x"})
+    with ResultStore(tmp_path / "results.db") as store:
+        assert store.import_csv([path]) == 1
+        assert store.query()[0]["mtu"] == 1500
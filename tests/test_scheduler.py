@@ -0,0 +1,53 @@
+import threading
+import time
+
+from scheduler import Job, Scheduler, ServerSlots, load_plan
+
+
+def test_load_plan(tmp_path):
+    path = tmp_path / "plan.ini"
+    path.write_text(
+        "[plan]\nworkers = 2\nrepetitions = 2\n"
+        "[10.0.0.1]\ncir = 100\nreverse_cir = 200\nports = 5201, 5202\n"
+        "[10.0.0.2]\ndirections = forward\ncir = 100, 300\n")
+    jobs, slots, workers = load_plan(path)
+    assert workers == 2
+    assert len(jobs) == 2 * (2 + 2)
+    assert [(j.direction, j.cir) for j in jobs if j.server == "10.0.0.1"][:2] \
+        == [("reverse", 200), ("forward", 100)]
+    assert list(slots["10.0.0.1"].free_ports) == [5201, 5202]
+    assert slots["10.0.0.2"].concurrency == 1
+
+
+def test_servers_run_concurrently_never_double_booked():
+    lock = threading.Lock()
+    active = {}
+    peak = {"total": 0}
+
+    def runner(job):
+        with lock:
+            active[job.server] = active.get(job.server, 0) + 1
+            assert active[job.server] == 1, "server double booked"
+            peak["total"] = max(peak["total"], sum(active.values()))
+        time.sleep(0.02)
+        with lock:
+            active[job.server] -= 1
+        return {"port": job.port}
+
+    jobs = [Job("10.0.0.%d" % (i % 3), None, "forward", 100, i)
+            for i in range(9)]
+    done = Scheduler(jobs, workers=3, runner=runner).run()
+    assert all(job.ok for job in done)
+    assert peak["total"] == 3
+    assert {job.result["port"] for job in done} == {5201}
+
+
+def test_failed_job_is_reported():
+    def runner(job):
+        raise ValueError("iperf3 busy")
+
+    slots = {"10.0.0.1": ServerSlots([5201, 5202], concurrency=2)}
+    jobs = Scheduler([Job("10.0.0.1", None, "reverse", 100)], slots,
+                     runner=runner).run()
+    assert not jobs[0].ok
+    assert isinstance(jobs[0].error, ValueError)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import sys
+import time
+
+from wpms.ookla.speedtest import ProgressQueue, run_async
+
+RECORDS = [{"type": "testStart"}] + \
+    [{"type": "download", "download": {"bandwidth": i, "progress": i / 20}}
+     for i in range(20)] + \
+    [{"type": "result", "download": {"bandwidth": 19}}]
+
+
+def fake_speedtest(tmp_path, records, sleep=0):
+    script = tmp_path / "speedtest"
+    script.write_text(
+        "#!{}\nimport json, sys, time\n"
+        "for r in {!r}:\n"
+        "    print(json.dumps(r), flush=True)\n"
+        "time.sleep({})\n".format(sys.executable, records, sleep))
+    script.chmod(0o755)
+    return script
+
+
+def test_queue_drops_progress_only():
+    queue = ProgressQueue(maxsize=2)
+    for record in RECORDS:
+        queue.put(record)
+    kept = list(queue.records)
+    assert kept[0]["type"] == "testStart"
+    assert kept[-1]["type"] == "result"
+    assert queue.dropped == 20
+
+
+def test_run_async_forwards_records(tmp_path):
+    sent = []
+
+    async def emit(event, record):
+        sent.append((event, record))
+
+    binary = fake_speedtest(tmp_path, RECORDS)
+    result = asyncio.run(run_async(emit, binary=binary, maxsize=64))
+    assert result["download"]["bandwidth"] == 19
+    assert [r for _, r in sent] == RECORDS
+    assert {e for e, _ in sent} == {"ookla"}
+
+
+def test_slow_socket_drops_progress(tmp_path):
+    sent = []
+
+    async def emit(event, record):
+        sent.append(record)
+        await asyncio.sleep(0.05)
+
+    binary = fake_speedtest(tmp_path, RECORDS)
+    asyncio.run(run_async(emit, binary=binary, maxsize=2))
+    assert sent[0]["type"] == "testStart"
+    assert sent[-1]["type"] == "result"
+    assert len(sent) < len(RECORDS)
+
+
+def test_cancel_terminates_speedtest(tmp_path):
+    binary = fake_speedtest(tmp_path, RECORDS[:1], sleep=60)
+    ticks = []
+
+    async def heartbeat():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        beat = asyncio.ensure_future(heartbeat())
+        task = asyncio.ensure_future(
+            run_async(lambda *a: asyncio.sleep(0), binary=binary))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        started = time.monotonic()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        beat.cancel()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) < 5
+    # the event loop kept running while the speedtest was
+    assert len(ticks) > 10
@@ -0,0 +1,108 @@
+import configparser
+
+import pytest
+
+import rfc6349
+from wpms.netperf import IperfResult
+from wpms.prober import RttStats
+
+
+def stream(bps, retransmits=0, seconds=10.0):
+    return {"bytes": int(bps * seconds / 8), "seconds": seconds,
+            "bits_per_second": bps, "retransmits": retransmits}
+
+
+def document(bps, retransmits):
+    streams = [stream(b, r) for b, r in zip(bps, retransmits)]
+    total = stream(sum(bps), sum(retransmits))
+    return {
+        "start": {"version": "iperf 3.9", "timestamp": {"timesecs": 0},
+                  "sndbuf_actual": 0, "rcvbuf_actual": 0},
+        "end": {"streams": [{"sender": s, "receiver": s} for s in streams],
+                "sum_sent": total, "sum_received": total},
+    }
+
+
+class Probe:
+    def stop(self):
+        return RttStats()
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({"RFC6349": {"streams": "0", "stream_window": "65535",
+                                  "max_streams": "8"}})
+    monkeypatch.setattr(rfc6349, "config", config)
+    handler = rfc6349.TcpTest("--forward", 10 ** 9, "10.0.0.1", "10.0.0.1")
+    handler.mss = 1460
+    handler.rtt = 0.002
+    handler.bb = 10 ** 9
+    handler.set_bdp()
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: Probe())
+    return handler
+
+
+def test_stream_count_follows_bdp(handler):
+    # 2 ms at 1 Gbps is 250000 bytes, four 65535 byte windows
+    assert handler.stream_count() == 4
+    handler.tcp_wnd_size = 10 ** 8
+    assert handler.stream_count() == 8
+    rfc6349.config.set("RFC6349", "streams", "2")
+    assert handler.stream_count() == 2
+
+
+def test_parallel_throughput_breakdown(handler, monkeypatch):
+    calls = []
+
+    def run_iperf(phase=None, **settings):
+        calls.append(settings)
+        return IperfResult.from_json(document(
+            [3e8, 2e8, 2e8, 1e8], [0, 10, 0, 0]))
+    monkeypatch.setattr(handler, "run_iperf", run_iperf)
+    handler.thpt_test()
+    assert calls[0]["num_streams"] == 4
+    assert 62500 <= calls[0]["window"] < 2 * 65535
+    assert handler.thpt == 8e8
+    assert handler.retransmit_bytes == 10 * handler.mtu
+
+    handler.max_achievable_thpt = 8e8
+    handler.calculate_stream_metrics()
+    ttrs = [s["transfer_time_ratio"] for s in handler.stream_results]
+    assert ttrs[0] < ttrs[1] < ttrs[3]
+    assert ttrs[1] == pytest.approx(1.0)
+    assert handler.stream_results[1]["tcp_efficiency"] < 100
+    assert handler.fairness == pytest.approx(64 / (4 * 18))
+    record = handler.create_dict()
+    assert record["streams"] == 4
+    assert len(record["stream_results"]) == 4
+
+
+def test_probe_failure_keeps_iperf_error(handler, monkeypatch):
+    class BrokenProbe:
+        def stop(self):
+            raise OSError("prober died")
+
+    def run_iperf(phase=None, **settings):
+        raise rfc6349.netperf.IperfError("unable to connect")
+    monkeypatch.setattr(handler, "start_rtt_probe", lambda: BrokenProbe())
+    monkeypatch.setattr(handler, "run_iperf", run_iperf)
+    with pytest.raises(rfc6349.netperf.IperfError):
+        handler.thpt_test()
+
+
+def test_unanswered_probe_leaves_buffer_delay_unknown(handler, monkeypatch):
+    def run_iperf(phase=None, **settings):
+        return IperfResult.from_json(document([3e8, 2e8, 2e8, 1e8],
+                                              [0, 0, 0, 0]))
+    monkeypatch.setattr(handler, "run_iperf", run_iperf)
+    monkeypatch.setattr(handler, "pmtu", lambda: 1500)
+    monkeypatch.setattr(handler, "baseline_rtt", lambda: 0.002)
+    monkeypatch.setattr(handler, "bandwidth", lambda: 10 ** 9)
+    handler.base_rtt = 0.002
+    handler.mtu = 1500
+    record = rfc6349._run_phases(handler)
+    assert handler.avg_rtt is None
+    assert record["avg_rtt"] is None
+    assert record["buffer_delay"] is None
+    assert record["tcp_efficiency"] == 100
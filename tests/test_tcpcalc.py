@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from utils import TcpCalc, batch_metrics, get_max_thpt
+
+
+def make_runs(n, seed=1):
+    rnd = random.Random(seed)
+    runs = {name: [] for name in (
+        "link_speed", "mtu", "block_size", "actual_transfer_time",
+        "transfer_bytes", "retransmit_bytes", "avg_rtt", "baseline_rtt")}
+    for _ in range(n):
+        runs["link_speed"].append(rnd.choice([10**8, 2 * 10**8, 10**9]))
+        runs["mtu"].append(rnd.randint(576, 1500))
+        runs["block_size"].append(runs["link_speed"][-1])
+        runs["actual_transfer_time"].append(rnd.uniform(0.5, 30))
+        rtx = rnd.randint(0, 10**5)
+        runs["retransmit_bytes"].append(rtx)
+        runs["transfer_bytes"].append(rnd.randint(10**6, 10**9) + rtx)
+        runs["avg_rtt"].append(rnd.uniform(0.001, 0.2))
+        runs["baseline_rtt"].append(rnd.uniform(0.001, 0.1))
+    return runs
+
+
+def test_batch_matches_scalar_path():
+    runs = make_runs(500)
+    out = batch_metrics(runs)
+    calc = TcpCalc()
+    for i in range(500):
+        max_thpt = get_max_thpt(runs["link_speed"][i], runs["mtu"][i])
+        itt = calc.get_itt(runs["block_size"][i], max_thpt)
+        tx = runs["transfer_bytes"][i]
+        rtx = runs["retransmit_bytes"][i]
+        assert out["max_achievable_thpt"][i] == max_thpt
+        assert out["ideal_transfer_time"][i] == itt
+        assert out["transfer_time_ratio"][i] == calc.get_ttr(
+            runs["actual_transfer_time"][i], itt)
+        assert out["tcp_efficiency"][i] == ((tx - rtx) / tx) * 100
+        assert out["buffer_delay"][i] == calc.get_buffer_delay(
+            runs["avg_rtt"][i], runs["baseline_rtt"][i])
+
+
+def test_zero_baseline_is_masked():
+    out = batch_metrics({"avg_rtt": [0.02, 0.02], "baseline_rtt": [0.01, 0]})
+    assert out["buffer_delay"][0] == 100.0
+    assert out["buffer_delay"].mask.tolist() == [False, True]
+    assert set(out) == {"buffer_delay"}
+
+
+def test_avg_rtt_batch():
+    rtts = [[0.1, 0.2, 0.3], [0.01, 0.02, 0.03]]
+    out = TcpCalc().get_avg_rtt_batch(rtts, [3, 0])
+    assert out[0] == TcpCalc().get_avg_rtt(rtts[0], 3)
+    assert out.mask.tolist() == [False, True]
+
+
+def test_fairness():
+    calc = TcpCalc()
+    assert calc.get_fairness([5e8, 5e8, 5e8]) == pytest.approx(1)
+    assert calc.get_fairness([9e8, 0, 0]) == pytest.approx(1 / 3)
+    assert calc.get_fairness([0, 0]) is None
@@ -0,0 +1,69 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from wpms.transfer import Receiver, TransferError, receive, send_file
+
+
+@pytest.fixture
+def payload(tmp_path):
+    path = tmp_path / "tosend.bin"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+def serve(receiver):
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(receiver.serve_once()))
+    thread.start()
+    return thread, results
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_transfer_to_file(payload, tmp_path, use_mmap):
+    target = tmp_path / "torecv.bin"
+    with Receiver(0, host="127.0.0.1", path=target, use_mmap=use_mmap,
+                  bufsize=64 * 1024) as receiver:
+        thread, results = serve(receiver)
+        result = send_file(payload, "127.0.0.1", receiver.port,
+                           sndbuf=256 * 1024, mss=1200, timeout=10)
+        thread.join()
+    assert target.read_bytes() == payload.read_bytes()
+    assert result["bytes"] == results[0][0] == os.path.getsize(payload)
+    assert result["receiver_seconds"] == pytest.approx(results[0][1],
+                                                       abs=1e-6)
+    assert 0 < result["receiver_seconds"] <= result["seconds"]
+    assert result["sndbuf"] >= 256 * 1024
+    assert result["mss"] <= 1200
+
+
+def test_transfer_discarded(payload):
+    with Receiver(0, host="127.0.0.1") as receiver:
+        thread, results = serve(receiver)
+        result = send_file(payload, "127.0.0.1", receiver.port, timeout=10)
+        thread.join()
+    assert results[0][0] == result["bytes"]
+
+
+@pytest.mark.skipif(not socket.has_dualstack_ipv6(),
+                    reason="no dual-stack IPv6")
+def test_receiver_listens_on_ipv4_and_ipv6(payload):
+    with Receiver(0) as receiver:
+        for host in ("::1", "127.0.0.1"):
+            thread, results = serve(receiver)
+            result = send_file(payload, host, receiver.port, timeout=10)
+            thread.join()
+            assert results[0][0] == result["bytes"]
+
+
+def test_short_transfer_is_an_error(tmp_path):
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall((100).to_bytes(8, "big") + b"x" * 10)
+        a.shutdown(socket.SHUT_WR)
+        with pytest.raises(TransferError, match="10 of 100"):
+            receive(b, tmp_path / "out", use_mmap=True)
+    assert os.path.getsize(tmp_path / "out") == 10
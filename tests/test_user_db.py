@@ -1,7 +1,19 @@
+import importlib
+
 import pytest
-from wmps import db
+from wpms import db
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    monkeypatch.setenv("ADMINUSERNAME", "admin")
+    monkeypatch.setenv("ADMINPASSWORD", "secret")
+    yield importlib.reload(db)
+    monkeypatch.undo()
+    importlib.reload(db)
 
 
 class TestDB:
-    def test_config_username_password_ok(self):
-        assert(db.username)
+    def test_config_username_password_ok(self, credentials):
+        assert(credentials.username == "admin")
+        assert(credentials.get_uri().startswith("mongodb://admin:secret@"))
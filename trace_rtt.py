@@ -1,27 +1,37 @@
-import numpy
-import pandas as pd
-import subprocess
-import csv
-from io import StringIO
-
-
-p = subprocess.run("tcptrace -l -r --csv -f'rtt_min > 0' ./iperf31.dump", shell=True, stdout=subprocess.PIPE)
-d_str = p.stdout.decode()
-csv_file = StringIO(d_str)
-csv_reader = csv.reader(csv_file)
-line = 1
-rows = []
-for row in csv_reader:
-    if line < 9 or len(row) < 140:
-        line += 1
-        continue
-    rows.append(row)
-headers = rows.pop(0)
-
-df = pd.DataFrame(data=rows, columns=headers)
-df_a2b = df['RTT_min_a2b'].apply(lambda x: float(x))
-df_b2a = df['RTT_min_b2a'].apply(lambda x: float(x))
-print((df_a2b))
-print(df_b2a)
+#!/usr/bin/env python3
+"""
+Per flow RTT of a packet capture, replaces tcptrace -l -r --csv.
 
+    python3 trace_rtt.py [capture.pcap]
 
+The capture is streamed, so it may be larger than memory. Only flows
+with RTT samples are printed (the old rtt_min > 0 filter), times in ms.
+"""
+import sys
+
+from wpms.pcap_rtt import iter_flows
+
+
+def fmt(value):
+    return "-" if value is None else "{:.3f}".format(value)
+
+
+def main(path):
+    print("a,b,RTT_min_a2b,RTT_avg_a2b,RTT_p99_a2b,RTT_min_b2a,RTT_avg_b2a,"
+          "RTT_p99_b2a,rexmt_a2b,rexmt_b2a")
+    for flow in iter_flows(path):
+        a2b, b2a = flow["a2b"], flow["b2a"]
+        if not a2b["rtt_samples"] and not b2a["rtt_samples"]:
+            continue
+        print(",".join([
+            flow["a"], flow["b"],
+            fmt(a2b["rtt_min"]), fmt(a2b["rtt_avg"]),
+            fmt(a2b["rtt_percentiles"].get(99)),
+            fmt(b2a["rtt_min"]), fmt(b2a["rtt_avg"]),
+            fmt(b2a["rtt_percentiles"].get(99)),
+            str(a2b["retransmits"]), str(b2a["retransmits"]),
+        ]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "./iperf31.dump")
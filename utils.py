@@ -95,6 +95,23 @@ class TcpCalc:
 
         return avg_rtt
 
+    def get_avg_rtt_batch(self, rtts, durations):
+        """
+        get_avg_rtt for many runs.
+        :rtts 2d array, one row of rtts per run
+        :durations duration of every run
+        returns a masked array, runs with a zero duration are masked
+        """
+        import numpy as np
+        rtts = np.asarray(rtts, dtype=float)
+        # cumsum adds left to right like sum(), np.sum would sum pairwise
+        # and could differ from the scalar path in the last bits
+        if rtts.shape[1]:
+            totals = np.cumsum(rtts, axis=1)[:, -1]
+        else:
+            totals = np.zeros(rtts.shape[0])
+        return _divide(np, totals, np.asarray(durations))
+
     def get_buffer_delay(self, avg_rtt, baseline_rtt):
         """
         Represents the increase in rtt during throughput test vs the baseline
@@ -106,6 +123,71 @@ class TcpCalc:
         """
         return ((avg_rtt -baseline_rtt)/baseline_rtt) * 100
 
+    def get_fairness(self, thpts):
+        """
+        Jain's fairness index of the throughput of parallel connections,
+        1 when all get the same share, 1/n when one takes everything.
+        :thpts - throughput of every connection
+        """
+        squares = sum(t * t for t in thpts)
+        if not squares:
+            return None
+        return sum(thpts) ** 2 / (len(thpts) * squares)
+
+
+def _divide(np, a, b):
+    """a / b with every element where b is 0 masked instead of raising"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.ma.masked_where(b == 0, np.true_divide(a, b))
+
+
+def batch_metrics(runs):
+    """
+    Vectorized RFC 6349 metrics for many runs at once.
+    :runs is a column table, anything with runs[name] giving an array-like
+    column (dict of lists/arrays, numpy structured array, pandas DataFrame):
+        link_speed, mtu -> max_achievable_thpt
+        block_size (+ max_achievable_thpt) -> ideal_transfer_time
+        actual_transfer_time (+ ideal_transfer_time) -> transfer_time_ratio
+        transfer_bytes, retransmit_bytes -> tcp_efficiency
+        avg_rtt, baseline_rtt -> buffer_delay
+    Metrics whose input columns are missing are skipped. The operations are
+    done in the same order as the scalar functions so results are identical;
+    divisions by zero (e.g. a zero baseline rtt) are masked.
+    :returns dict of numpy masked arrays
+    """
+    import numpy as np
+
+    def column(name):
+        try:
+            return np.asarray(runs[name])
+        except (KeyError, ValueError):
+            return None
+
+    out = {}
+    link_speed, mtu = column('link_speed'), column('mtu')
+    if link_speed is not None and mtu is not None:
+        max_fps = _divide(np, link_speed, (mtu + FRAME_BYTE_SIZE) * 8)
+        out['max_achievable_thpt'] = max_fps * (mtu - 40) * 8
+    max_thpt = column('max_achievable_thpt')
+    if max_thpt is None:
+        max_thpt = out.get('max_achievable_thpt')
+    block_size = column('block_size')
+    if block_size is not None and max_thpt is not None:
+        out['ideal_transfer_time'] = _divide(np, block_size, max_thpt)
+    itt = out.get('ideal_transfer_time', column('ideal_transfer_time'))
+    att = column('actual_transfer_time')
+    if att is not None and itt is not None:
+        out['transfer_time_ratio'] = _divide(np, att, itt)
+    tx, rtx = column('transfer_bytes'), column('retransmit_bytes')
+    if tx is not None and rtx is not None:
+        out['tcp_efficiency'] = _divide(np, tx - rtx, tx) * 100
+    avg_rtt, baseline_rtt = column('avg_rtt'), column('baseline_rtt')
+    if avg_rtt is not None and baseline_rtt is not None:
+        out['buffer_delay'] = _divide(np, avg_rtt - baseline_rtt,
+                                      baseline_rtt) * 100
+    return out
+
 
 class TcpMetrics(TcpCalc):
     pass
@@ -1,5 +1,5 @@
 from cryptography.fernet import Fernet
-from db import DBHandler
+from wpms.db import DBHandler
 
 from pymongo.errors import DuplicateKeyError
 
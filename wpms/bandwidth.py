@@ -0,0 +1,99 @@
+import logging
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+class Trial(namedtuple("Trial", ["rate", "received", "lost_percent",
+                                 "jitter_ms"])):
+    """
+    One short UDP run: offered rate and received throughput in bits/s,
+    loss in percent and jitter in ms as reported by the receiver.
+    """
+    __slots__ = ()
+
+
+Estimate = namedtuple("Estimate", ["bandwidth", "jitter_ms", "confidence",
+                                   "probe_time", "trials"])
+
+
+class BandwidthSearch:
+    """
+    Search for the highest offered UDP rate the path carries without loss.
+    The offered load starts at start * ceiling and is doubled after every
+    clean trial. Once a trial sees more than loss percent loss (or more
+    than jitter ms jitter), the rate lies between the highest clean and
+    the lowest lossy trial. Rates around the throughput received in the
+    lossy trial are tried next, since that's what the bottleneck let
+    through, and the bracket is bisected when they miss. The search stops
+    when the bracket is within tolerance (fraction) of its upper end, at
+    the ceiling or after max_trials.
+    confidence is 1 - the relative width of the final bracket, 0 when
+    not even the first trial was clean.
+    :run_trial - callable(rate) returning a Trial
+    """
+
+    def __init__(self, run_trial, ceiling, start=0.5, loss=0.1, jitter=None,
+                 tolerance=0.05, max_trials=10):
+        self.run_trial = run_trial
+        self.ceiling = ceiling
+        self.start = start
+        self.loss = loss
+        self.jitter = jitter
+        self.tolerance = tolerance
+        self.max_trials = max_trials
+
+    def clean(self, trial):
+        if (trial.lost_percent or 0) > self.loss:
+            return False
+        return not (self.jitter and (trial.jitter_ms or 0) > self.jitter)
+
+    def next_rate(self, low, high, hint):
+        """
+        Just below and just above the throughput of the last lossy trial,
+        so that two clean/lossy trials close the bracket, then bisection.
+        """
+        if hint:
+            for rate in (hint * (1 - self.tolerance / 2),
+                         hint * (1 + self.tolerance / 2)):
+                if low < rate < high:
+                    return rate
+        return (low + high) / 2
+
+    def run(self):
+        started = time.monotonic()
+        trials = []
+        best = None  # highest clean trial
+        low, high = 0, None  # clean and lossy bounds of the offered rate
+        rate = min(self.ceiling, self.ceiling * self.start)
+        hint = None
+        while len(trials) < self.max_trials:
+            trial = self.run_trial(rate)
+            trials.append(trial)
+            logger.debug("bandwidth trial %s", trial)
+            if self.clean(trial):
+                low = rate
+                if best is None or trial.received > best.received:
+                    best = trial
+                if high is None:
+                    if rate >= self.ceiling:
+                        break
+                    rate = min(rate * 2, self.ceiling)
+                    continue
+            else:
+                high = rate
+                hint = trial.received
+            if high - low <= self.tolerance * high:
+                break
+            rate = self.next_rate(low, high, hint)
+
+        probe_time = time.monotonic() - started
+        if best is None:
+            # nothing clean, the least lossy trial is all we have
+            fallback = min(trials, key=lambda t: t.lost_percent or 0)
+            return Estimate(fallback.received, fallback.jitter_ms, 0,
+                            probe_time, trials)
+        width = 0 if high is None else (high - low) / high
+        return Estimate(best.received, best.jitter_ms, 1 - width,
+                        probe_time, trials)
@@ -0,0 +1,77 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS baseline (
+    id INTEGER PRIMARY KEY,
+    iface TEXT NOT NULL,
+    dst TEXT NOT NULL,
+    measured REAL NOT NULL,
+    rtt REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS baseline_path
+    ON baseline (iface, dst, measured);
+"""
+
+
+class BaselineStore:
+    """
+    Baseline RTT per path (source interface, destination), the minimum of
+    the RTTs measured on it in the last horizon seconds, so it follows the
+    non-congested RTT when routes change instead of keeping the lowest
+    value ever seen. Samples are appended to a SQLite database in WAL
+    mode, each one in its own transaction together with the read of the
+    new minimum, so tests running in parallel, in threads or processes,
+    don't overwrite each other. Samples older than the horizon are
+    deleted as new ones come in.
+    :horizon - seconds a sample counts towards the minimum
+    """
+
+    def __init__(self, path, horizon=86400):
+        self.path = str(path)
+        self.horizon = horizon
+        self.conn = sqlite3.connect(self.path, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def _minimum(self, iface, dst, now):
+        return self.conn.execute(
+            "SELECT MIN(rtt) FROM baseline "
+            "WHERE iface = ? AND dst = ? AND measured >= ?",
+            (iface, dst, now - self.horizon)).fetchone()[0]
+
+    def update(self, iface, dst, rtt, now=None):
+        """
+        Add the rtt measured on a path.
+        :returns the baseline of the path including it
+        """
+        now = time.time() if now is None else now
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO baseline (iface, dst, measured, rtt) "
+                "VALUES (?, ?, ?, ?)", (iface, dst, now, rtt))
+            self.conn.execute(
+                "DELETE FROM baseline WHERE iface = ? AND dst = ? "
+                "AND measured < ?", (iface, dst, now - self.horizon))
+            return self._minimum(iface, dst, now)
+
+    def get(self, iface, dst, now=None):
+        """:returns the baseline of a path, None without recent samples"""
+        now = time.time() if now is None else now
+        with self.lock:
+            return self._minimum(iface, dst, now)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
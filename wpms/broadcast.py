@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """
+    Server side broadcast layer for dashboard telemetry.
+    Instead of one emit per incoming message, samples are buffered per
+    event type and per agent and flushed as one frame per event type
+    every 1/tick_rate seconds:
+
+        {'batch': {agent: [sample, sample, ...], ...}}
+
+    Every (event, agent) buffer holds at most max_samples samples (limits
+    overrides it per event, 1 keeps only the latest value). When flushing
+    falls behind, the oldest samples are superseded and dropped instead
+    of queueing up.
+    :emit - coroutine function with the signature of AsyncServer.emit
+    """
+
+    def __init__(self, emit, room='/dashboard', tick_rate=10, max_samples=16,
+                 limits=None):
+        self.emit = emit
+        self.room = room
+        self.tick_rate = tick_rate
+        self.max_samples = max_samples
+        self.limits = limits or {}
+        self.buffers = {}
+        self.received = 0
+        self.dropped = 0
+        self.frames = 0
+        self._task = None
+
+    def push(self, event, agent, sample):
+        agents = self.buffers.setdefault(event, {})
+        samples = agents.get(agent)
+        if samples is None:
+            maxlen = self.limits.get(event, self.max_samples)
+            samples = agents[agent] = deque(maxlen=maxlen)
+        elif len(samples) == samples.maxlen:
+            self.dropped += 1
+        samples.append(sample)
+        self.received += 1
+
+    async def flush(self):
+        buffers, self.buffers = self.buffers, {}
+        for event, agents in buffers.items():
+            batch = {agent: list(samples) for agent, samples in agents.items()}
+            await self.emit(event, {'batch': batch}, room=self.room)
+            self.frames += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        while True:
+            started = loop.time()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("dashboard flush failed")
+            await asyncio.sleep(max(0, interval - (loop.time() - started)))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,81 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class TtlCache:
+    """
+    Small persistent key/value cache with a per-entry time to live.
+    Entries are kept in a single JSON document. Every read-modify-write
+    happens under an exclusive flock on a sidecar lock file and the
+    document is replaced atomically, so several rfc6349.py processes can
+    share the same cache file safely.
+    :path - location of the JSON document
+    :ttl - default time to live of an entry in seconds
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = str(path)
+        self.ttl = ttl
+        self.lock_path = self.path + ".lock"
+
+    @staticmethod
+    def make_key(*parts):
+        return "|".join(str(p) for p in parts)
+
+    @contextmanager
+    def _locked(self, shared=False):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            # a missing or corrupted cache is treated as empty
+            return {}
+
+    def _dump(self, entries):
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def get(self, key, now=None):
+        """
+        Returns the cached value of key or None if it is missing or expired.
+        """
+        now = time.time() if now is None else now
+        with self._locked(shared=True):
+            entry = self._load().get(key)
+        if not entry or entry["expires"] <= now:
+            return None
+        return entry["value"]
+
+    def set(self, key, value, ttl=None, now=None):
+        now = time.time() if now is None else now
+        ttl = self.ttl if ttl is None else ttl
+        with self._locked():
+            entries = self._load()
+            # drop expired entries while the document is rewritten anyway
+            entries = {k: v for k, v in entries.items() if v["expires"] > now}
+            entries[key] = {"value": value, "expires": now + ttl}
+            self._dump(entries)
+
+    def delete(self, key):
+        with self._locked():
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._dump(entries)
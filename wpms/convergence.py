@@ -0,0 +1,87 @@
+import logging
+import statistics
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def cov(values):
+    """coefficient of variation, None for a zero mean"""
+    mean = statistics.fmean(values)
+    if not mean:
+        return None
+    return statistics.pstdev(values, mean) / mean
+
+
+class ConvergenceMonitor:
+    """
+    Stop criterion for wpms.iperf_stream.run: the throughput test has
+    converged once the coefficient of variation of the last window
+    interval throughputs of role (sender or receiver) is below max_cov.
+    With an rtt callable, the coefficient of variation of the rtts of the
+    same intervals has to be below max_rtt_cov as well.
+    :rtt - optional callable returning the mean rtt since its last call,
+           None when unknown
+    """
+
+    def __init__(self, role, window=5, max_cov=0.05, rtt=None,
+                 max_rtt_cov=None):
+        self.role = role
+        self.window = window
+        self.max_cov = max_cov
+        self.rtt = rtt
+        self.max_rtt_cov = max_rtt_cov
+        self.throughputs = deque(maxlen=window)
+        self.rtts = deque(maxlen=window)
+        self.intervals = 0
+        self.converged = False
+
+    @property
+    def steady_bps(self):
+        """mean throughput of the last window intervals"""
+        if not self.throughputs:
+            return None
+        return statistics.fmean(self.throughputs)
+
+    def __call__(self, sample):
+        if sample.get("role") != self.role or sample.get("omitted"):
+            return False
+        self.intervals += 1
+        self.throughputs.append(sample.get("bits_per_second", 0))
+        if self.rtt is not None:
+            self.rtts.append(self.rtt())
+        if len(self.throughputs) < self.window:
+            return False
+        variation = cov(self.throughputs)
+        if variation is None or variation > self.max_cov:
+            return False
+        if self.rtt is not None and self.max_rtt_cov:
+            if None in self.rtts:
+                return False
+            rtt_variation = cov(self.rtts)
+            if rtt_variation is None or rtt_variation > self.max_rtt_cov:
+                return False
+        logger.info("throughput converged after %s intervals, cov %.4f",
+                    self.intervals, variation)
+        self.converged = True
+        return True
+
+
+def interval_rtt(stats):
+    """
+    :stats - wpms.prober.RttStats that is being filled by a running probe
+    :returns callable giving the mean rtt of the replies received since
+             its last call, None when there were none
+    """
+    last = [0, 0.0]  # replies, sum of their rtt
+
+    def rtt():
+        received = stats.received
+        total = (stats.avg or 0) * received
+        count = received - last[0]
+        previous = last[1]
+        last[:] = received, total
+        if count <= 0:
+            return None
+        return (total - previous) / count
+    return rtt
@@ -1,35 +1,196 @@
 import configparser
+import logging
 import os
+import threading
+import time
+
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.write_concern import WriteConcern
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
 config = configparser.ConfigParser()
-config.read('wmps/wpms.ini')
+config.read(os.path.join(os.path.dirname(__file__), 'wpms.ini'))
 address = config['mongodb']['address']
 port = config['mongodb']['port']
 username = os.environ.get('ADMINUSERNAME')
 password = os.environ.get('ADMINPASSWORD')
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_uri():
+    return "mongodb://{}:{}@{}:{}".format(username, password, address, port)
+
+
+def get_client():
+    """
+    Process-wide MongoClient, created on first use. MongoClient is thread
+    safe and keeps its own connection pool, so every caller shares one
+    pool, one DNS lookup and one auth handshake.
+    Pool size is max_pool_size/min_pool_size of the [mongodb] section.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    get_uri(),
+                    maxPoolSize=config.getint(
+                        'mongodb', 'max_pool_size', fallback=10),
+                    minPoolSize=config.getint(
+                        'mongodb', 'min_pool_size', fallback=0),
+                    connect=False)
+    return _client
 
-class DBHandler(MongoClient):
-    def __init__(self):
-        self.uri = "mongodb://{}:{}@{}:{}".format(
-            username, password, address, port)
-        print(self.uri)
-        super().__init__(self.uri)
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+class DBHandler:
+    """
+    Kept for existing callers, attribute access goes to the shared client.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
 
     def get_user_model(self):
-        return self.user.model
+        return self.client.user.model
+
+
+def get_write_concern():
+    """write concern of the [mongodb] section, w=1 without journaling by default"""
+    w = config.get('mongodb', 'write_concern_w', fallback='1')
+    return WriteConcern(
+        w=int(w) if w.isdigit() else w,
+        j=config.getboolean('mongodb', 'write_concern_j', fallback=False))
 
-    def __del__(self):
+
+class ResultRepository:
+    """
+    Buffers result documents and writes them with one insert_many once
+    batch_size documents are waiting or the oldest waited flush_interval
+    seconds. start() adds a background thread so a quiet buffer is
+    flushed on time as well, close() flushes what is left.
+    Documents a failed insert_many didn't write go back to the buffer for
+    the next flush, except duplicates of documents already written.
+    """
+
+    def __init__(self, collection, batch_size=100, flush_interval=1.0,
+                 write_concern=None):
+        self.collection = collection.with_options(
+            write_concern=write_concern or get_write_concern())
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.inserted = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, document):
+        with self._lock:
+            if not self.buffer:
+                self._oldest = time.monotonic()
+            self.buffer.append(document)
+            due = len(self.buffer) >= self.batch_size
+        if due or self._expired():
+            self.flush()
+
+    def _expired(self):
+        oldest = self._oldest
+        return oldest is not None and \
+            time.monotonic() - oldest >= self.flush_interval
+
+    def flush(self):
+        """
+        :returns the number of documents written
+        :raises PyMongoError when not all of them were, after the
+        documents to retry were put back
+        """
+        with self._lock:
+            documents, self.buffer = self.buffer, []
+            oldest, self._oldest = self._oldest, None
+        if not documents:
+            return 0
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # documents are given their _id before they are sent, so a
+            # retried document that was written comes back as a duplicate
+            errors = e.details.get("writeErrors", [])
+            self._requeue([documents[error["index"]] for error in errors
+                           if error.get("code") != DUPLICATE_KEY], oldest)
+            self.inserted += e.details.get("nInserted", 0)
+            raise
+        except PyMongoError:
+            self._requeue(documents, oldest)
+            raise
+        self.inserted += len(documents)
+        return len(documents)
+
+    def _requeue(self, documents, oldest):
+        if not documents:
+            return
+        with self._lock:
+            self.buffer[:0] = documents
+            self._oldest = oldest
+        logger.warning("%s results not written, retrying on the next flush",
+                       len(documents))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval / 2):
+            if self._expired():
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("flushing results failed")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
         self.close()
-        print("DB connection closed")
+
+
+def get_result_repository(**kwargs):
+    database = config.get('mongodb', 'database', fallback='wpms')
+    collection = config.get('mongodb', 'results_collection', fallback='rfc6349')
+    return ResultRepository(get_client()[database][collection], **kwargs)
 
 
 if __name__ == "__main__":
     # create unique index on username field
-    client = DBHandler()
+    client = get_client()
     client.user.model.create_index([('username', 1)], unique=True)
@@ -0,0 +1,71 @@
+"""
+Reduce a time series of (x, y) points, x ascending, to a point budget for
+plotting.
+"""
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets (Steinarsson 2013): keeps the first and
+    the last point and in between the point of every bucket that forms
+    the largest triangle with the point kept before it and the average
+    of the next bucket, which preserves the visual shape of the series.
+    :returns at most threshold points
+    """
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:threshold]
+    out = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # average of the next bucket, the last point after the last one
+        following = points[end:min(int((i + 2) * every) + 1, n)]
+        avg_x = sum(p[0] for p in following) / len(following)
+        avg_y = sum(p[1] for p in following) / len(following)
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[n - 1])
+    return out
+
+
+def minmax(points, threshold):
+    """
+    Splits the points into threshold // 2 buckets and keeps the lowest
+    and the highest point of each, in x order, so spikes and drops
+    survive any reduction.
+    :returns at most threshold points
+    """
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    buckets = max(threshold // 2, 1)
+    every = n / buckets
+    out = []
+    for i in range(buckets):
+        bucket = points[int(i * every):int((i + 1) * every)]
+        if not bucket:
+            continue
+        low = min(bucket, key=lambda p: p[1])
+        high = max(bucket, key=lambda p: p[1])
+        if low is high:
+            out.append(low)
+        elif low[0] <= high[0]:
+            out.extend((low, high))
+        else:
+            out.extend((high, low))
+    return out
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
@@ -0,0 +1,93 @@
+import math
+
+
+class Histogram:
+    """
+    HDR style histogram of non negative integers (e.g. microseconds).
+    Values below 2**sub_bucket_bits are counted exactly, above that every
+    power of two range is split into 2**(sub_bucket_bits - 1) buckets, so
+    the relative error of a reported value stays below
+    1 / 2**(sub_bucket_bits - 1) whatever the magnitude, while memory only
+    grows with the log of the largest value recorded.
+    """
+
+    def __init__(self, sub_bucket_bits=8):
+        self.bits = sub_bucket_bits
+        self.half = 1 << (sub_bucket_bits - 1)
+        self.counts = []
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        bucket = value.bit_length() - self.bits
+        if bucket <= 0:
+            return value
+        return bucket * self.half + (value >> bucket)
+
+    def _highest_equivalent(self, index):
+        if index < 2 * self.half:
+            return index
+        bucket = (index >> (self.bits - 1)) - 1
+        sub = index - bucket * self.half
+        return ((sub + 1) << bucket) - 1
+
+    def record(self, value, count=1):
+        value = int(value)
+        if value < 0:
+            raise ValueError("Histogram values must not be negative")
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.total += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.bits != self.bits:
+            raise ValueError("Histograms must have the same precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else None
+
+    def percentile(self, p):
+        """
+        Value at percentile p in [0, 100], reported as the highest value
+        equivalent to its bucket and clamped to the recorded min/max.
+        """
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                value = self._highest_equivalent(index)
+                return max(self.min, min(value, self.max))
+        return self.max
+
+    def percentiles(self, ps=(50, 90, 99, 99.9)):
+        return {p: self.percentile(p) for p in ps}
+
+    def reset(self):
+        self.counts = []
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
@@ -0,0 +1,226 @@
+import json
+import logging
+import subprocess
+import threading
+from collections import deque
+
+from wpms import metrics
+
+logger = logging.getLogger(__name__)
+
+# events whose payload is kept, intervals are folded and dropped
+DOCUMENT_EVENTS = ("start", "end", "error", "server_output_json",
+                   "server_output_text")
+
+
+class IntervalAggregate:
+    """
+    Running aggregate of the per-interval sums reported by one side
+    (sender or receiver) of an iperf3 test. streams has an aggregate of
+    the intervals of every stream, by socket.
+    """
+
+    def __init__(self, role):
+        self.role = role
+        self.streams = {}
+        self.intervals = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.retransmits = 0
+        self.min_bps = None
+        self.max_bps = None
+        self.mean_bps = 0.0
+        self.lost_packets = 0
+        self.packets = 0
+        self.jitter_ms = None
+
+    def add(self, interval):
+        bps = interval.get("bits_per_second", 0)
+        self.intervals += 1
+        self.bytes += interval.get("bytes", 0)
+        self.seconds += interval.get("seconds", 0)
+        self.retransmits += interval.get("retransmits", 0)
+        self.lost_packets += interval.get("lost_packets", 0)
+        self.packets += interval.get("packets", 0)
+        if "jitter_ms" in interval:
+            self.jitter_ms = interval["jitter_ms"]
+        if self.min_bps is None or bps < self.min_bps:
+            self.min_bps = bps
+        if self.max_bps is None or bps > self.max_bps:
+            self.max_bps = bps
+        self.mean_bps += (bps - self.mean_bps) / self.intervals
+
+    def add_streams(self, intervals):
+        for interval in intervals:
+            socket = interval.get("socket")
+            if socket not in self.streams:
+                self.streams[socket] = IntervalAggregate(self.role)
+            self.streams[socket].add(interval)
+
+    @property
+    def bits_per_second(self):
+        if not self.seconds:
+            return 0
+        return self.bytes * 8 / self.seconds
+
+    def as_dict(self):
+        return {
+            "role": self.role,
+            "intervals": self.intervals,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "bits_per_second": self.bits_per_second,
+            "min_bps": self.min_bps,
+            "max_bps": self.max_bps,
+            "mean_bps": self.mean_bps,
+            "retransmits": self.retransmits,
+            "lost_packets": self.lost_packets,
+            "packets": self.packets,
+            "jitter_ms": self.jitter_ms,
+        }
+
+
+def iter_events(lines):
+    """
+    Parse iperf3 --json-stream output, one JSON object per line.
+    Yields (event, data) tuples.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logger.warning("skipping malformed iperf3 line %r", line[:80])
+            continue
+        yield record.get("event"), record.get("data")
+
+
+def interval_samples(events, document, reverse=False):
+    """
+    Split the event stream: start/end/error/server output are stored in
+    document, the interval sums are yielded as flat samples, with the
+    intervals of the single streams under streams.
+    A client in reverse mode is the receiving side of the test.
+    """
+    for event, data in events:
+        if event == "interval":
+            total = data.get("sum", {})
+            sender = total.get("sender", not reverse)
+            sample = dict(total)
+            sample["role"] = "sender" if sender else "receiver"
+            sample["streams"] = data.get("streams", [])
+            yield sample
+        elif event in DOCUMENT_EVENTS:
+            document[event] = data
+
+
+def fold_intervals(samples, aggregates, on_interval=None, stop=None):
+    """
+    Fold samples into aggregates (role -> IntervalAggregate) and hand
+    every sample, without its streams, to on_interval. Samples are not
+    kept, so memory stays the same no matter how many intervals the test
+    reports. Folding ends early once stop(sample) returns True.
+    """
+    for sample in samples:
+        role = sample["role"]
+        if role not in aggregates:
+            aggregates[role] = IntervalAggregate(role)
+        aggregates[role].add_streams(sample.pop("streams", ()))
+        aggregates[role].add(sample)
+        if on_interval is not None:
+            on_interval(sample)
+        if stop is not None and stop(sample):
+            return
+
+
+def consume(lines, reverse=False, on_interval=None, stop=None):
+    """
+    Run the generator pipeline over iperf3 --json-stream lines.
+    :returns (document, aggregates) where document has the same
+    start/end/error/server_output_json keys as iperf3 --json output,
+    without end and server output when stop ended the test
+    """
+    document = {}
+    aggregates = {}
+    samples = interval_samples(iter_events(lines), document, reverse)
+    fold_intervals(samples, aggregates, on_interval, stop)
+    return document, aggregates
+
+
+def _drain(pipe, tail):
+    """read pipe until it closes, keeping its last lines in tail"""
+    for line in pipe:
+        tail.append(line.decode(errors="replace").rstrip())
+
+
+def run(cmd, reverse=False, on_interval=None, stop=None):
+    """
+    Start iperf3 with --json-stream appended to cmd and consume its
+    output while the test is running. iperf3 is terminated when stop
+    ends the test early. stderr is read by a thread so iperf3 can't block
+    on a full pipe, its last lines are logged when the test fails.
+    """
+    proc = metrics.popen(
+        list(cmd) + ["--json-stream"], "iperf3",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stderr = deque(maxlen=20)
+    drain = threading.Thread(target=_drain, args=(proc.stderr, stderr),
+                             daemon=True)
+    drain.start()
+    document = {}
+    try:
+        with metrics.span("wpms_subprocess_run_seconds", command="iperf3"):
+            document, aggregates = consume(proc.stdout, reverse, on_interval,
+                                           stop)
+    finally:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+        drain.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        if stderr and (proc.returncode > 0 or "error" in document):
+            logger.warning("iperf3 stderr: %s", "\n".join(stderr))
+    return document, aggregates
+
+
+class DashboardForwarder:
+    """
+    Forwards interval samples to the server.py Socket.IO server which
+    relays them to the /dashboard room, or any other dict as event.
+    Forwarding is best effort, a dashboard that can't be reached never
+    fails a test.
+    """
+
+    def __init__(self, url, event="iperf_interval", **tags):
+        self.url = url
+        self.event = event
+        self.tags = tags
+        self.sio = None
+        try:
+            import socketio
+            self.sio = socketio.Client()
+            self.sio.connect(url, wait_timeout=2)
+        except Exception as e:
+            logger.warning("dashboard %s not reachable: %s", url, e)
+            self.sio = None
+
+    def __call__(self, sample):
+        if self.sio is None:
+            return
+        msg = dict(self.tags)
+        msg.update(sample)
+        try:
+            self.sio.emit(self.event, msg)
+        except Exception as e:
+            logger.warning("dropping interval sample: %s", e)
+
+    def close(self):
+        if self.sio is not None:
+            self.sio.disconnect()
+            self.sio = None
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from wpms.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyProber:
+    """
+    Pipelined latency probing over the Socket.IO connection.
+    Every probe carries a sequence number and a new probe is sent every
+    interval seconds without waiting for the previous pong, so up to
+    window probes are in flight. Send times are kept in a bounded table,
+    a probe more than window sequence numbers behind or older than
+    timeout counts as lost. Latencies go into a histogram (microseconds) and every
+    report_interval seconds a summary is emitted instead of one message
+    per sample.
+    :emit - coroutine function, e.g. socketio.AsyncClient.emit
+    :station - name the server stores the summaries under
+    """
+
+    def __init__(self, emit, interval=0.05, window=64, timeout=5.0,
+                 report_interval=1.0, station=None):
+        self.emit = emit
+        self.station = station
+        self.interval = interval
+        self.window = window
+        self.timeout = timeout
+        self.report_interval = report_interval
+        self.inflight = OrderedDict()
+        self.histogram = Histogram()
+        self.seq = 0
+        self.lost = 0
+        self.late = 0
+        self.running = False
+        self._task = None
+
+    def _expire(self, now):
+        while self.inflight:
+            seq, sent = next(iter(self.inflight.items()))
+            if seq > self.seq - self.window and now - sent < self.timeout:
+                break
+            del self.inflight[seq]
+            self.lost += 1
+
+    async def send_probe(self):
+        now = time.perf_counter()
+        self._expire(now)
+        seq = self.seq
+        self.seq += 1
+        self.inflight[seq] = now
+        await self.emit('ping_from_client', seq)
+
+    def on_pong(self, seq):
+        sent = self.inflight.pop(seq, None)
+        if sent is None:
+            # already counted as lost or not ours
+            self.late += 1
+            return None
+        latency = time.perf_counter() - sent
+        self.histogram.record(latency * 1e6)
+        return latency
+
+    def summary(self):
+        """
+        Summary of the probes since the last report, data and the latency
+        fields are None when every probe of the interval was lost.
+        :returns None without any answered or lost probe
+        """
+        h = self.histogram
+        if not h.total:
+            if not self.lost:
+                return None
+            return {'data': None, 'count': 0, 'lost': self.lost,
+                    'min': None, 'mean': None, 'max': None,
+                    'percentiles': {}}
+        percentiles = h.percentiles()
+        return {
+            'data': percentiles[50] / 1e6,  # seconds, plotted by the dashboard
+            'count': h.total,
+            'lost': self.lost,
+            'min': h.min / 1e6,
+            'mean': h.mean / 1e6,
+            'max': h.max / 1e6,
+            'percentiles': {str(p): v / 1e6 for p, v in percentiles.items()},
+        }
+
+    async def report(self):
+        summary = self.summary()
+        if summary is None:
+            return None
+        if self.station is not None:
+            summary['station'] = self.station
+        # pongs arriving while the summary is sent go into a new histogram,
+        # the samples and losses are kept for the next report if it fails
+        reported, self.histogram = self.histogram, Histogram()
+        try:
+            await self.emit('client_latency', summary)
+        except Exception:
+            self.histogram.merge(reported)
+            raise
+        self.lost -= summary['lost']
+        return summary
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        next_report = loop.time() + self.report_interval
+        while self.running:
+            started = loop.time()
+            await self.send_probe()
+            if started >= next_report:
+                await self.report()
+                next_report = started + self.report_interval
+            await asyncio.sleep(max(0, self.interval - (loop.time() - started)))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def stop(self):
+        self.running = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,299 @@
+import functools
+import logging
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from wpms.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (50, 90, 99, 100)
+NAME = re.compile(r"wpms_[a-z0-9_]+$")
+LABEL = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*$")
+CONTROL = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\")
+                                           .replace('"', '\\"')
+                                           .replace("\n", "\\n"))
+                          for k, v in pairs) + "}"
+
+
+class Registry:
+    """
+    In-process metrics: durations go to wpms.histogram.Histogram of
+    microseconds (memory grows with the log of the longest duration),
+    counters and gauges are plain numbers. At most max_series label
+    combinations are kept, further ones are dropped.
+    render() gives the Prometheus text format, durations as summaries.
+    snapshot()/merge() move the data of one process to another, e.g.
+    from an agent to server.py. Merged series are limited to
+    max_merged_series of their own, so agents can't crowd out the
+    series of this process. Dropped series are counted in
+    wpms_metrics_dropped_series_total.
+    """
+
+    def __init__(self, max_series=1000, max_merged_series=1000):
+        self.max_series = max_series
+        self.max_merged_series = max_merged_series
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.merged = set()
+        self.dropped = 0
+        self.dropped_merged = 0
+
+    def _series(self, table, key, default, merged=False):
+        if key not in table:
+            if merged:
+                if len(self.merged) >= self.max_merged_series:
+                    self.dropped_merged += 1
+                    return None
+                self.merged.add(key)
+            elif (len(self.histograms) + len(self.counters) +
+                    len(self.gauges) - len(self.merged)) >= self.max_series:
+                self.dropped += 1
+                return None
+            table[key] = default()
+        return table[key]
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            histogram = self._series(self.histograms, _key(name, labels),
+                                     Histogram)
+            if histogram is not None:
+                histogram.record(max(0, round(seconds * 1e6)))
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if self._series(self.counters, key, int) is not None:
+                self.counters[key] += value
+
+    def set(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            if self._series(self.gauges, key, int) is not None:
+                self.gauges[key] = value
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Time the block into name, labelled with outcome ok or error.
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=outcome,
+                         **labels)
+
+    def timed(self, name, **labels):
+        """decorator, a span for every call"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self, reset=False):
+        """JSON serializable copy of the data, reset starts over"""
+        with self.lock:
+            data = {
+                "histograms": [
+                    [name, dict(labels), h.bits, h.counts, h.total, h.sum,
+                     h.min, h.max]
+                    for (name, labels), h in self.histograms.items()],
+                "counters": [[name, dict(labels), value] for (name, labels),
+                             value in self.counters.items()],
+                "gauges": [[name, dict(labels), value] for (name, labels),
+                           value in self.gauges.items()],
+            }
+            if reset:
+                self.histograms = {}
+                self.counters = {}
+                self.gauges = {}
+                self.merged = set()
+        return data
+
+    def merge(self, data, **labels):
+        """
+        Add a snapshot of another registry, with labels added to all of
+        its series. Counters add up, gauges are replaced.
+        :raises ValueError when data isn't a valid snapshot, nothing is
+        merged then
+        """
+        histograms, counters, gauges = _validate(data)
+        if not all(isinstance(v, str) and not CONTROL.search(v)
+                   for v in labels.values()):
+            raise ValueError("bad labels {!r}".format(labels))
+        with self.lock:
+            # a histogram can't change its precision, check them all
+            # before anything is merged
+            pending = {}
+            for name, own, bits, *_ in histograms:
+                key = _key(name, dict(own, **labels))
+                existing = self.histograms.get(key)
+                if existing is None:
+                    existing = pending.setdefault(key, Histogram(bits))
+                if existing.bits != bits:
+                    raise ValueError("precision of {} differs".format(name))
+            for name, own, bits, counts, total, sum_, min_, max_ in \
+                    histograms:
+                histogram = Histogram(bits)
+                histogram.counts = list(counts)
+                histogram.total = total
+                histogram.sum = sum_
+                histogram.min = min_
+                histogram.max = max_
+                target = self._series(self.histograms,
+                                      _key(name, dict(own, **labels)),
+                                      lambda: Histogram(bits), merged=True)
+                if target is not None:
+                    target.merge(histogram)
+            for name, own, value in counters:
+                key = _key(name, dict(own, **labels))
+                if self._series(self.counters, key, int,
+                                merged=True) is not None:
+                    self.counters[key] += value
+            for name, own, value in gauges:
+                key = _key(name, dict(own, **labels))
+                if self._series(self.gauges, key, int,
+                                merged=True) is not None:
+                    self.gauges[key] = value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, table in (("counter", self.counters),
+                                ("gauge", self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(table.items()):
+                    if name not in typed:
+                        lines.append("# TYPE {} {}".format(name, kind))
+                        typed.add(name)
+                    lines.append("{}{} {}".format(name, _labels(labels),
+                                                  value))
+            typed = set()
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append("# TYPE {} summary".format(name))
+                    typed.add(name)
+                for q in QUANTILES:
+                    lines.append("{}{} {}".format(
+                        name, _labels(labels, [("quantile", str(q / 100))]),
+                        h.percentile(q) / 1e6))
+                lines.append("{}_sum{} {}".format(name, _labels(labels),
+                                                  h.sum / 1e6))
+                lines.append("{}_count{} {}".format(name, _labels(labels),
+                                                    h.total))
+            lines.append("# TYPE wpms_metrics_dropped_series_total counter")
+            for source, dropped in (("local", self.dropped),
+                                    ("merged", self.dropped_merged)):
+                lines.append('wpms_metrics_dropped_series_total'
+                             '{{source="{}"}} {}'.format(source, dropped))
+        return "\n".join(lines) + "\n"
+
+
+def _number(value, minimum=None):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+            value != value or (minimum is not None and value < minimum):
+        raise ValueError("bad value {!r}".format(value))
+    return value
+
+
+def _series_labels(name, labels):
+    if not isinstance(name, str) or not NAME.match(name):
+        raise ValueError("bad metric name {!r}".format(name))
+    if not isinstance(labels, dict) or not all(
+            isinstance(k, str) and LABEL.match(k) and isinstance(v, str)
+            and not CONTROL.search(v) for k, v in labels.items()):
+        raise ValueError("bad labels of {}".format(name))
+
+
+def _validate(data):
+    """:returns the histograms, counters and gauges of a snapshot"""
+    if not isinstance(data, dict):
+        raise ValueError("snapshot is not an object")
+    histograms = data.get("histograms", [])
+    counters = data.get("counters", [])
+    gauges = data.get("gauges", [])
+    for rows, width in ((histograms, 8), (counters, 3), (gauges, 3)):
+        if not isinstance(rows, list) or not all(
+                isinstance(row, list) and len(row) == width for row in rows):
+            raise ValueError("malformed snapshot")
+    for name, labels, bits, counts, total, sum_, min_, max_ in histograms:
+        _series_labels(name, labels)
+        if not isinstance(bits, int) or not 1 <= bits <= 16:
+            raise ValueError("bad precision of {}".format(name))
+        if not isinstance(counts, list) or \
+                len(counts) > (66 - bits) << (bits - 1):
+            raise ValueError("bad counts of {}".format(name))
+        for count in counts:
+            if not isinstance(count, int):
+                raise ValueError("bad counts of {}".format(name))
+            _number(count, 0)
+        if total != sum(counts):
+            raise ValueError("bad total of {}".format(name))
+        _number(sum_, 0)
+        for value in (min_, max_):
+            if value is not None:
+                _number(value, 0)
+    for name, labels, value in counters:
+        _series_labels(name, labels)
+        _number(value, 0)
+    for name, labels, value in gauges:
+        _series_labels(name, labels)
+        _number(value)
+    return histograms, counters, gauges
+
+
+registry = Registry()
+observe = registry.observe
+inc = registry.inc
+span = registry.span
+timed = registry.timed
+
+
+def count_retry(retry_state):
+    """tenacity before_sleep callback counting the retries of a phase"""
+    registry.inc("wpms_retries_total", phase=retry_state.fn.__name__)
+    logger.warning("%s attempt %s failed, retrying",
+                   retry_state.fn.__name__, retry_state.attempt_number)
+
+
+def popen(cmd, command, **kwargs):
+    """subprocess.Popen, the time it takes goes to the spawn latency"""
+    start = time.perf_counter()
+    try:
+        return subprocess.Popen(cmd, **kwargs)
+    finally:
+        observe("wpms_subprocess_spawn_seconds", time.perf_counter() - start,
+                command=command)
+
+
+def run(cmd, command, **kwargs):
+    """
+    subprocess.run with the spawn latency and run time of the command.
+    :command - name of the command in the metrics
+    """
+    with popen(cmd, command, **kwargs) as proc:
+        with span("wpms_subprocess_run_seconds", command=command):
+            stdout, stderr = proc.communicate()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
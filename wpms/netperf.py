@@ -1,45 +1,340 @@
-from attr import attrib
-from iperf3 import Client
-
-allowed_keys = [
-    'duration',
-    'bind_address',
-    'server_hostname',
-    'port',
-    'blksize',
-    'num_streams',
-    'zerocopy',
-    'verbose',
-    'reverse',
-    'json_output',
-    'serveroutput'
-]
-
-
-class IperfClient(Client):
-    """Iperf3 object that accepts
-    params: bandwidth- bits/sec
+import ctypes
+import ctypes.util
+import logging
+import multiprocessing
+import os
+from collections import namedtuple
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+logger = logging.getLogger(__name__)
+
+# setting -> iperf3 command line option, flags take no value
+OPTIONS = {
+    'server_hostname': '-c',
+    'port': '-p',
+    'duration': '-t',
+    'bytes': '-n',
+    'bind_address': '-B',
+    'blksize': '-l',
+    'num_streams': '-P',
+    'bandwidth': '-b',
+    'bitrate': '-b',
+    'window': '-w',
+    'mss': '-M',
+    'omit': '-O',
+    'affinity': '-A',
+    'pacing_timer': '--pacing-timer',
+    'interval': '-i',
+}
+FLAGS = {
+    'reverse': '-R',
+    'udp': '-u',
+    'zerocopy': '-Z',
+    'verbose': '-V',
+    'get_server_output': '--get-server-output',
+    'serveroutput': '--get-server-output',
+}
+
+allowed_keys = list(OPTIONS) + list(FLAGS) + ['protocol', 'json_output']
+
+
+class IperfError(ValueError):
+    pass
+
+
+def arguments(settings):
+    """iperf3 command line options of a settings dict, without -J"""
+    args = []
+    for key, value in settings.items():
+        if value is None or value is False:
+            continue
+        if key in OPTIONS:
+            args += [OPTIONS[key], str(value)]
+        elif key in FLAGS:
+            args.append(FLAGS[key])
+        elif key == 'protocol' and value == 'udp':
+            args.append('-u')
+    return args
+
+
+class Summary(namedtuple('Summary', [
+        'bytes', 'seconds', 'bits_per_second', 'retransmits',
+        'jitter_ms', 'lost_packets', 'packets', 'lost_percent'])):
+    """sender or receiver totals of a stream or of all streams"""
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return None
+        return cls(
+            data.get('bytes', 0),
+            float(data.get('seconds', 0)),
+            data.get('bits_per_second', 0),
+            data.get('retransmits'),
+            data.get('jitter_ms'),
+            data.get('lost_packets'),
+            data.get('packets'),
+            data.get('lost_percent'))
+
+
+Stream = namedtuple('Stream', ['sender', 'receiver'])
+
+
+class IperfResult(namedtuple('IperfResult', [
+        'version', 'timestamp', 'system_info', 'sndbuf_actual',
+        'rcvbuf_actual', 'sender_tcp_congestion', 'receiver_tcp_congestion',
+        'host_system_util', 'remote_system_util', 'sum_sent', 'sum_received',
+        'streams', 'server_output'])):
+    """
+    The parts of an iperf3 JSON document the RFC 6349 phases use.
+    UDP streams report one summary, it is used as sender and receiver.
+    server_output is the IperfResult of the server with
+    get_server_output, otherwise None.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            raise IperfError("iperf3 returned no result")
+        if data.get('error'):
+            raise IperfError(data['error'])
+        start = data.get('start', {})
+        end = data.get('end', {})
+        cpu = end.get('cpu_utilization_percent', {})
+        streams = []
+        for stream in end.get('streams', []):
+            udp = stream.get('udp')
+            streams.append(Stream(
+                Summary.from_json(stream.get('sender', udp)),
+                Summary.from_json(stream.get('receiver', udp))))
+        server_output = data.get('server_output_json')
+        return cls(
+            start.get('version'),
+            start.get('timestamp', {}).get('timesecs'),
+            start.get('system_info'),
+            start.get('sndbuf_actual', 0),
+            start.get('rcvbuf_actual', 0),
+            end.get('sender_tcp_congestion', ''),
+            end.get('receiver_tcp_congestion', ''),
+            cpu.get('host_system', 0),
+            cpu.get('remote_system', 0),
+            Summary.from_json(end.get('sum_sent', end.get('sum'))),
+            Summary.from_json(end.get('sum_received', end.get('sum'))),
+            streams,
+            cls.from_json(server_output) if server_output else None)
+
+
+_lib = None
+
+
+def libiperf():
+    """libiperf loaded with ctypes, OSError when it isn't installed"""
+    global _lib
+    if _lib is None:
+        name = ctypes.util.find_library('iperf') or 'libiperf.so.0'
+        lib = ctypes.CDLL(name)
+        lib.iperf_new_test.restype = ctypes.c_void_p
+        lib.iperf_new_test.argtypes = ()
+        lib.iperf_defaults.restype = ctypes.c_int
+        lib.iperf_defaults.argtypes = (ctypes.c_void_p,)
+        lib.iperf_parse_arguments.restype = ctypes.c_int
+        lib.iperf_parse_arguments.argtypes = (
+            ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_char_p))
+        lib.iperf_run_client.restype = ctypes.c_int
+        lib.iperf_run_client.argtypes = (ctypes.c_void_p,)
+        lib.iperf_get_test_json_output_string.restype = ctypes.c_char_p
+        lib.iperf_get_test_json_output_string.argtypes = (ctypes.c_void_p,)
+        lib.iperf_free_test.restype = None
+        lib.iperf_free_test.argtypes = (ctypes.c_void_p,)
+        lib.iperf_strerror.restype = ctypes.c_char_p
+        lib.iperf_strerror.argtypes = (ctypes.c_int,)
+        _lib = lib
+    return _lib
+
+
+def available():
+    try:
+        libiperf()
+    except OSError:
+        return False
+    return True
+
+
+class IperfClient:
+    """Iperf3 client running in this process through libiperf.
+    params: bandwidth/bitrate- bits/sec, 'n[KMG][/burst]' is accepted
     blksize- bulksize
+    bytes- bytes to transmit instead of duration
     duration- duration in seconds
-    num_stream- number of streams to use
-    protocol- socket protocol tcp/udp
+    num_streams- number of streams to use
+    protocol- socket protocol tcp/udp, or udp=True
     reverse- server sends, client receives
     server_hostname- server hostname/IP
+    window- socket buffer size
+    mss- TCP maximum segment size
+    omit- seconds to omit at the start
+    affinity- cpu the client runs on
+    get_server_output- include the server result
     zercopy- toggle zerocopy
+    Settings are applied with iperf_parse_arguments, so they mean exactly
+    what the same iperf3 command line options mean. libiperf keeps global
+    state, run one test at a time per process, see IperfWorker.
      """
 
     def __init__(self, **kwargs):
-        super().__init__()
         self.valid_keys = []
+        self.settings = {}
         for k in kwargs:
             if k in allowed_keys:
                 self.valid_keys.append(k)
+                self.settings[k] = kwargs[k]
                 self.__setattr__(k, kwargs[k])
             else:
                 print("key not valid: ", k)
 
+    def get_config(self):
+        return self.valid_keys
+
+    def arguments(self):
+        return arguments(self.settings)
+
     def do_test(self):
         return self.run()
 
-    def get_config(self):
-        return self.valid_keys
+    def run(self):
+        """
+        :returns IperfResult
+        :raises IperfError
+        """
+        lib = libiperf()
+        argv = [b'iperf3'] + [a.encode() for a in self.arguments()] + [b'-J']
+        test = lib.iperf_new_test()
+        if not test:
+            raise IperfError("iperf_new_test failed")
+        pinned = None
+        try:
+            lib.iperf_defaults(test)
+            # getopt state is global, start over for every test
+            ctypes.c_int.in_dll(ctypes.CDLL(None), 'optind').value = 0
+            if lib.iperf_parse_arguments(
+                    test, len(argv), (ctypes.c_char_p * len(argv))(*argv)) < 0:
+                raise IperfError(self._error(lib))
+            affinity = self.settings.get('affinity')
+            if affinity is not None and hasattr(os, 'sched_setaffinity'):
+                pinned = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, {int(str(affinity).split(',')[0])})
+            # the json document is printed as well, keep stdout clean
+            stdout = os.dup(1)
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            try:
+                status = lib.iperf_run_client(test)
+            finally:
+                os.dup2(stdout, 1)
+                os.close(stdout)
+                os.close(devnull)
+            text = lib.iperf_get_test_json_output_string(test)
+            if not text:
+                raise IperfError(self._error(lib) if status < 0
+                                 else "iperf3 returned no result")
+            return IperfResult.from_json(loads(text))
+        finally:
+            lib.iperf_free_test(test)
+            # the worker process runs the next tests, unpin it again
+            if pinned is not None:
+                os.sched_setaffinity(0, pinned)
+
+    @staticmethod
+    def _error(lib):
+        errno = ctypes.c_int.in_dll(lib, 'i_errno').value
+        return lib.iperf_strerror(errno).decode(errors='replace')
+
+
+def _serve(conn):
+    """worker process loop, one settings dict in, one result out"""
+    while True:
+        try:
+            settings = conn.recv()
+        except EOFError:
+            return
+        if settings is None:
+            return
+        try:
+            conn.send((True, IperfClient(**settings).run()))
+        except Exception as e:
+            conn.send((False, IperfError(str(e))))
+
+
+class IperfWorker:
+    """
+    Runs IperfClient tests one after the other in a child process that is
+    started on first use and kept for the next runs. libiperf is not
+    re-entrant and may exit() on some errors, in the worker neither can
+    hurt the caller: a worker that died or timed out is replaced by the
+    next run.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        if self.process is None or not self.process.is_alive():
+            methods = multiprocessing.get_all_start_methods()
+            # the caller may have threads running, don't fork it
+            context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn')
+            self.conn, child = context.Pipe()
+            self.process = context.Process(target=_serve, args=(child,),
+                                           daemon=True)
+            self.process.start()
+            child.close()
+        return self
+
+    def run(self, settings, timeout=None):
+        """
+        :returns IperfResult
+        :raises IperfError, also when the worker died or timed out
+        """
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            self.conn.send(settings)
+            if not self.conn.poll(timeout):
+                self.close(kill=True)
+                raise IperfError("iperf3 timed out after {}s".format(timeout))
+            ok, value = self.conn.recv()
+        except (EOFError, OSError):
+            self.close(kill=True)
+            raise IperfError("iperf3 worker died")
+        if not ok:
+            raise value
+        return value
+
+    def close(self, kill=False):
+        if self.process is None:
+            return
+        try:
+            if not kill:
+                self.conn.send(None)
+                self.process.join(5)
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = self.conn = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
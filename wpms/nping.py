@@ -0,0 +1,197 @@
+import logging
+import math
+import re
+from collections import OrderedDict, namedtuple
+
+from wpms.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+PACKET = re.compile(r"(SENT|RCVD) \((\d+(?:\.\d+)?)s\) (\S+)")
+ICMP_SEQ = re.compile(r" seq=(\d+)\]")
+RTT_SUMMARY = re.compile(
+    r"Max rtt: (\S+) \| Min rtt: (\S+) \| Avg rtt: (\S+)\s*$")
+RTT_VALUE = re.compile(r"(\d+(?:\.\d+)?)ms$")
+PACKET_SUMMARY = re.compile(
+    r"Raw packets sent: (\d+) .*\| Rcvd: (\d+) .*\| Lost: (\d+)")
+CONNECT_SUMMARY = re.compile(
+    r"TCP connection attempts: (\d+) \| Successful connections: (\d+) "
+    r"\| Failed: (\d+)")
+
+
+class NpingError(ValueError):
+    """nping output that can't be parsed"""
+
+
+class NoSummaryError(NpingError):
+    """nping ended without printing its rtt summary"""
+
+
+class Probe(namedtuple("Probe", ["seq", "sent", "received", "rtt", "lost"])):
+    """
+    One probe, times are seconds since nping started as printed on its
+    SENT/RCVD lines, received and rtt are None when it was lost.
+    """
+    __slots__ = ()
+
+
+class Summary:
+    """
+    Statistics of the probes in seconds, with the same attributes as
+    wpms.prober.RttStats. min/avg/max are replaced by the figures of
+    nping's own summary once it is read, nping measures them in
+    microseconds while SENT/RCVD lines only have 0.1 ms resolution.
+    Percentiles come from a wpms.histogram.Histogram of microseconds.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.min = None
+        self.max = None
+        self.avg = None
+        self._m2 = 0.0
+        self.histogram = Histogram()
+        self.reported = None  # (max, min, avg) rtt as printed, in seconds
+        self.reported_packets = None  # (sent, received, lost) as printed
+
+    def add(self, probe):
+        self.sent += 1
+        if probe.lost:
+            return
+        rtt = probe.rtt
+        self.received += 1
+        self.histogram.record(round(rtt * 1e6))
+        if self.reported is not None:
+            return
+        if self.min is None or rtt < self.min:
+            self.min = rtt
+        if self.max is None or rtt > self.max:
+            self.max = rtt
+        if self.avg is None:
+            self.avg = rtt
+        else:
+            delta = rtt - self.avg
+            self.avg += delta / self.received
+            self._m2 += delta * (rtt - self.avg)
+
+    def report(self, max_rtt, min_rtt, avg_rtt):
+        self.reported = (max_rtt, min_rtt, avg_rtt)
+        if min_rtt is not None:
+            self.max, self.min, self.avg = self.reported
+
+    @property
+    def lost(self):
+        return self.sent - self.received
+
+    @property
+    def stddev(self):
+        if self.received < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.received - 1))
+
+    def percentile(self, p):
+        value = self.histogram.percentile(p)
+        return None if value is None else value / 1e6
+
+    def as_dict(self):
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "min": self.min,
+            "avg": self.avg,
+            "max": self.max,
+            "stddev": self.stddev,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+def _rtt(value, line):
+    if value == "N/A":
+        return None
+    match = RTT_VALUE.match(value)
+    if not match:
+        raise NpingError("unexpected rtt {!r} in {!r}".format(value, line))
+    return float(match.group(1)) / 1000
+
+
+def iter_probes(lines, summary=None, timeout=5.0):
+    """
+    Parse nping output, lines may be str or bytes, e.g. a pipe.
+    Yields a Probe as soon as its reply is read, or as lost once a later
+    line is timeout seconds past it or the output ended without a reply.
+    ICMP replies are matched by sequence number, TCP and UDP replies to
+    the oldest probe waiting for one.
+    :summary - Summary the probes and nping's summary lines are added to
+    :raises NpingError on malformed summary lines
+    """
+    pending = OrderedDict()  # seq -> sent time
+    count = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode(errors="replace")
+        match = PACKET.match(line)
+        if match:
+            kind, ts, protocol = match.groups()
+            ts = float(ts)
+            seq = None
+            if protocol == "ICMP":
+                icmp = ICMP_SEQ.search(line)
+                seq = int(icmp.group(1)) if icmp else None
+            if kind == "SENT":
+                count += 1
+                pending[count if seq is None else seq] = ts
+            else:
+                if seq is None:
+                    seq = next(iter(pending), None)
+                sent = pending.pop(seq, None)
+                if sent is not None:
+                    probe = Probe(seq, sent, ts, ts - sent, False)
+                    if summary is not None:
+                        summary.add(probe)
+                    yield probe
+            while pending:
+                seq, sent = next(iter(pending.items()))
+                if sent >= ts - timeout:
+                    break
+                del pending[seq]
+                yield _lost(seq, sent, summary)
+        elif line.startswith("Max rtt:"):
+            rtts = RTT_SUMMARY.match(line)
+            if not rtts:
+                raise NpingError("malformed rtt summary {!r}".format(line))
+            if summary is not None:
+                summary.report(*[_rtt(v, line) for v in rtts.groups()])
+        elif line.startswith(("Raw packets sent:", "TCP connection attempts:")):
+            packets = PACKET_SUMMARY.match(line) or CONNECT_SUMMARY.match(line)
+            if not packets:
+                raise NpingError("malformed packet summary {!r}".format(line))
+            if summary is not None:
+                summary.reported_packets = tuple(
+                    int(v) for v in packets.groups())
+    for seq, sent in pending.items():
+        yield _lost(seq, sent, summary)
+
+
+def _lost(seq, sent, summary):
+    probe = Probe(seq, sent, None, None, True)
+    if summary is not None:
+        summary.add(probe)
+    return probe
+
+
+def parse(lines, timeout=5.0, require_summary=True):
+    """
+    :returns Summary of nping output
+    :raises NoSummaryError when require_summary and nping printed no rtt
+            summary, NpingError on malformed summary lines
+    """
+    summary = Summary()
+    for _ in iter_probes(lines, summary, timeout):
+        pass
+    if require_summary and summary.reported is None:
+        raise NoSummaryError("no rtt summary in nping output")
+    return summary
@@ -1,13 +1,123 @@
+import asyncio
+import logging
 import subprocess
+from collections import deque
 from pathlib import Path
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+logger = logging.getLogger(__name__)
+
 speedtest = Path('wpms') / 'ookla' / 'speedtest'
+# intermediate results, only the latest one is worth forwarding
+PROGRESS_TYPES = ('ping', 'download', 'upload')
+
+
 def run(server=None):
     """create speedtest and return process"""
-    proc = subprocess.Popen([speedtest, '-f', 'jsonl'], 
-        stdout=subprocess.PIPE, 
+    proc = subprocess.Popen([speedtest, '-f', 'jsonl'],
+        stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         encoding='utf-8',
         errors='replace')
 
     return proc
+
+
+class ProgressQueue:
+    """
+    FIFO of speedtest records for a slow consumer. Once maxsize records
+    are waiting, the oldest progress record is dropped to make room;
+    testStart, result, log and error records are never dropped.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.records = deque()
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def put(self, record):
+        if len(self.records) >= self.maxsize:
+            for old in self.records:
+                if old is not None and old.get('type') in PROGRESS_TYPES:
+                    self.records.remove(old)
+                    self.dropped += 1
+                    break
+        self.records.append(record)
+        self._ready.set()
+
+    async def get(self):
+        while not self.records:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.records.popleft()
+
+
+async def read_records(stream):
+    """parse the jsonl output of the speedtest cli line by line"""
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield loads(line)
+        except ValueError:
+            logger.warning("skipping malformed speedtest line %r", line[:80])
+
+
+async def run_async(emit, server=None, binary=speedtest, maxsize=8,
+                    event='ookla'):
+    """
+    Run the speedtest cli without blocking the event loop and forward its
+    records with emit(event, record), e.g. sio.emit of the agent.
+    Progress records are dropped when emit can't keep up (see ProgressQueue).
+    Cancelling the task terminates the speedtest process.
+    :returns the result record or None
+    """
+    cmd = [str(binary), '-f', 'jsonl']
+    if server:
+        cmd += ['-s', str(server)]
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL)
+    queue = ProgressQueue(maxsize)
+
+    async def reader():
+        try:
+            async for record in read_records(proc.stdout):
+                queue.put(record)
+        finally:
+            queue.put(None)
+
+    reader_task = asyncio.ensure_future(reader())
+    result = None
+    try:
+        while True:
+            record = await queue.get()
+            if record is None:
+                break
+            if record.get('type') == 'result':
+                result = record
+            await emit(event, record)
+        await proc.wait()
+    finally:
+        reader_task.cancel()
+        if proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), 5)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        if queue.dropped:
+            logger.debug("dropped %s speedtest progress records",
+                         queue.dropped)
+    return result
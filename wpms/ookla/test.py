@@ -1,21 +1,12 @@
-import subprocess
-import json
+import asyncio
 
-proc = subprocess.Popen(['./speedtest', '-f', 'jsonl'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8', errors='replace')
+from speedtest import run_async
 
-while True:
-    d = proc.stdout.readline()
-    if d == '' and proc.poll() is not None:
-        break
-    if d:
-        value = d.strip()
-        serialize = json.loads(value)
-        msg_type = serialize.pop('type')
-        print(serialize)
-        #if  msg_type == 'testStart':
-        #    print(serialize)
-        #elif msg_type == 'result':
-        #    print('result: \t', serialize)
-        
-    #print('errs: ',  errs)
 
+async def show(event, record):
+    msg_type = record.pop('type')
+    print(msg_type, record)
+
+
+if __name__ == '__main__':
+    asyncio.run(run_async(show, binary='./speedtest'))
@@ -0,0 +1,198 @@
+import gzip
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    data TEXT NOT NULL,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class Outbox:
+    """
+    Durable local queue of results waiting for upload, a SQLite database
+    in WAL mode. put() is committed before it returns, so a result
+    survives a dropped uplink, a crash or a reboot until it was acked.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def put(self, record):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO outbox (created, data) VALUES (?, ?)",
+                (time.time(), json.dumps(record)))
+
+    def peek(self, limit):
+        """oldest limit records as (id, record) tuples"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, data FROM outbox WHERE failed = 0 "
+                "ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?",
+                                  [(i,) for i in ids])
+
+    def fail(self, ids):
+        """park records the server rejected so they don't block the queue"""
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE outbox SET failed = 1 WHERE id = ?",
+                                  [(i,) for i in ids])
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE failed = 0").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class UploadError(Exception):
+    pass
+
+
+class Uploader:
+    """
+    Drains an Outbox to the results API.
+    A keep-alive requests.Session is reused for every request, the auth
+    token is requested once and only refreshed when the API answers 401,
+    records are posted in gzip compressed batches and failures are retried
+    with exponential backoff (backoff doubling up to max_backoff seconds).
+    :credentials - payload of the token request (email, station, password)
+    """
+
+    def __init__(self, outbox, base_url, credentials,
+                 token_url="user/auth-token/", rfc_url="netmon/rfcdata/",
+                 batch_size=50, backoff=1, max_backoff=300, timeout=10):
+        import requests
+        self.outbox = outbox
+        self.base_url = base_url.rstrip("/") + "/"
+        self.credentials = credentials
+        self.token_url = token_url
+        self.rfc_url = rfc_url
+        self.batch_size = batch_size
+        self.min_backoff = backoff
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.token = None
+        self.uploaded = 0
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        })
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_token(self):
+        if self.token is None:
+            res = self.session.post(self.base_url + self.token_url,
+                                    data=json.dumps(self.credentials),
+                                    timeout=self.timeout)
+            if res.status_code != 200:
+                raise UploadError("token request failed {}".format(
+                    res.status_code))
+            self.token = res.json()["token"]
+            logger.debug("new upload token")
+        return self.token
+
+    def post(self, records):
+        body = gzip.compress(json.dumps(records).encode())
+        for _ in range(2):
+            headers = {
+                "Authorization": "Token {}".format(self.get_token()),
+                "Content-Encoding": "gzip",
+            }
+            res = self.session.post(self.base_url + self.rfc_url, data=body,
+                                    headers=headers, timeout=self.timeout)
+            if res.status_code != 401:
+                return res
+            self.token = None  # expired, ask for a new one once
+        return res
+
+    def upload_batch(self):
+        """
+        Upload the oldest batch.
+        :returns number of records uploaded, 0 if the outbox is empty
+        :raises UploadError or requests.RequestException to be retried
+        """
+        batch = self.outbox.peek(self.batch_size)
+        if not batch:
+            return 0
+        ids = [i for i, _ in batch]
+        res = self.post([record for _, record in batch])
+        if res.status_code >= 500 or res.status_code in (401, 408, 429):
+            raise UploadError("upload failed {}".format(res.status_code))
+        if res.status_code >= 400:
+            logger.error("results rejected %s: %s", res.status_code,
+                         res.text[:200])
+            self.outbox.fail(ids)
+            return 0
+        self.outbox.ack(ids)
+        self.uploaded += len(ids)
+        return len(ids)
+
+    def drain(self, timeout=None):
+        """
+        Upload until the outbox is empty or timeout seconds passed.
+        :returns True when the outbox was emptied
+        """
+        import requests
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stop.is_set():
+            try:
+                if not self.upload_batch() and not len(self.outbox):
+                    return True
+                self.backoff = self.min_backoff
+                continue
+            except (UploadError, requests.RequestException) as e:
+                logger.warning("upload failed, retry in %ss: %s",
+                               self.backoff, e)
+            wait = self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            self._stop.wait(wait)
+        return False
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            self.drain()
+            self._stop.wait(interval)
+
+    def start(self, interval=5):
+        """keep draining in a background thread, new results every interval s"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            args=(interval,), daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.session.close()
@@ -0,0 +1,371 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import socket
+import struct
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+
+from wpms.pcap_rtt import PCAP_MAGIC, PCAPNG_MAGIC, parse_ip
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"WPMSIDX\0"
+INDEX_VERSION = 2
+# magic, version, chunk, capture identity, indexed end, packets, flows
+HEADER = struct.Struct("=8sII56sQQQ")
+# device, inode, digest of the first record, follows the pcap header
+SOURCE = struct.Struct("=QQ16s")
+# address a, address b, port a, port b, protocol, address length
+FLOW = struct.Struct("=16s16sHHBBxx")
+NO_FLOW = 0xFFFFFFFF
+PORT_PROTOCOLS = (6, 17, 132)  # tcp, udp, sctp
+
+
+class FlowKey(namedtuple("FlowKey", ["src", "sport", "dst", "dport", "proto"])):
+    """
+    A flow, both directions of a 5-tuple. The endpoints are ordered so
+    (a, b) and (b, a) give the same key.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, src, sport, dst, dport, proto=6):
+        if (_pack_address(dst), dport) < (_pack_address(src), sport):
+            src, sport, dst, dport = dst, dport, src, sport
+        return cls(src, sport, dst, dport, proto)
+
+
+def _pack_address(host):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return socket.inet_pton(family, host)
+
+
+def _unpack_address(raw, size):
+    family = socket.AF_INET if size == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, raw[:size])
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class PcapIndex:
+    """
+    Random access to a pcap file by flow and time.
+    The capture is memory mapped and a sidecar index (path + ".idx") is
+    built on first open: per packet the record offset, timestamp and flow
+    number, the flow table, the packets of every flow sorted by time and
+    the min/max timestamp of every chunk packets. The index is memory
+    mapped as well, so a query only touches the pages of the index and of
+    the capture it needs.
+    The sidecar is written under an flock and replaced atomically, other
+    processes reuse it. When the capture grew since the index was written
+    only the new records are parsed, a capture that was replaced by
+    another file is indexed from scratch. Captures are told apart by the
+    pcap header, the device and inode of the file and a digest of the
+    first record, tcpdump writes the same header for every capture on an
+    interface and may reuse the file.
+    """
+
+    def __init__(self, path, index_path=None, chunk=1024):
+        self.path = str(path)
+        self.index_path = index_path or self.path + ".idx"
+        self.chunk = chunk
+        self._pcap = None
+        self._index = None
+        self._views = []
+        self.refresh()
+
+    # capture
+
+    def _map_capture(self):
+        with open(self.path, "rb") as f:
+            header = f.read(24)
+            if header[:4] == PCAPNG_MAGIC:
+                raise ValueError("pcapng is not supported, convert it with "
+                                 "editcap -F pcap")
+            if len(header) < 24 or header[:4] not in PCAP_MAGIC:
+                raise ValueError("{} is not a pcap file".format(self.path))
+            pcap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        endian, self.frac_ns = PCAP_MAGIC[header[:4]]
+        self.record = struct.Struct(endian + "IIII")
+        self.linktype = struct.unpack(endian + "I", header[20:24])[0] \
+            & 0x0FFFFFFF
+        first = b""
+        if len(pcap) >= 24 + 16:
+            end = 24 + 16 + self.record.unpack_from(pcap, 24)[2]
+            if end <= len(pcap):
+                first = pcap[24:end]
+        digest = hashlib.blake2b(first, digest_size=16).digest()
+        return header + SOURCE.pack(stat.st_dev, stat.st_ino, digest), pcap
+
+    def _records(self, pcap, offset):
+        """yields (offset, ts, flow tuple or None) from offset to the last
+        complete record"""
+        size = len(pcap)
+        unpack = self.record.unpack_from
+        while offset + 16 <= size:
+            sec, frac, incl_len, _ = unpack(pcap, offset)
+            end = offset + 16 + incl_len
+            if end > size:
+                break  # still being written
+            yield offset, sec * 1000000000 + frac * self.frac_ns, \
+                self._flow(pcap[offset + 16:end])
+            offset = end
+
+    def _flow(self, data):
+        ip = parse_ip(self.linktype, data)
+        if ip is None:
+            return None
+        src, dst, proto, offset, _ = ip
+        sport = dport = 0
+        if proto in PORT_PROTOCOLS and len(data) >= offset + 4:
+            sport, dport = struct.unpack_from("!HH", data, offset)
+        a, b = (bytes(src), sport), (bytes(dst), dport)
+        if b < a:
+            a, b = b, a
+        return a[0], b[0], a[1], b[1], proto
+
+    # sidecar
+
+    @contextmanager
+    def _locked(self):
+        with open(self.index_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, source, size):
+        """existing index as arrays if it belongs to this capture"""
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        if len(raw) < HEADER.size:
+            return None
+        magic, version, chunk, indexed, end, n, n_flows = \
+            HEADER.unpack_from(raw)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION \
+                or indexed != source or end > size:
+            return None
+        sections = self._sections(n, n_flows, chunk)
+        arrays = {}
+        for name, code, start, count in sections[:-1]:
+            arrays[name] = array(code)
+            arrays[name].frombytes(
+                raw[start:start + count * arrays[name].itemsize])
+        flows = []
+        for i in range(n_flows):
+            a, b, sport, dport, proto, size = FLOW.unpack_from(
+                raw, sections[-1][2] + i * FLOW.size)
+            flows.append((a[:size], b[:size], sport, dport, proto, size))
+        return end, arrays, flows
+
+    @staticmethod
+    def _sections(n, n_flows, chunk):
+        """(name, typecode, byte offset, count) of the arrays in the index,
+        the flow table follows the last one"""
+        chunks = (n + chunk - 1) // chunk
+        layout = [("offsets", "Q", n), ("ts", "q", n), ("flow_ids", "I", n),
+                  ("ptr", "Q", n_flows + 1), ("postings", "I", n),
+                  ("chunk_min", "q", chunks), ("chunk_max", "q", chunks)]
+        sections = []
+        position = _align(HEADER.size)
+        for name, code, count in layout:
+            sections.append((name, code, position, count))
+            position = _align(position + count * array(code).itemsize)
+        sections.append(("flows", None, position, n_flows))
+        return sections
+
+    def _update(self, source, pcap):
+        loaded = self._load(source, len(pcap))
+        if loaded is not None:
+            end, old, flows = loaded
+            if end + 16 > len(pcap):
+                return
+            offsets, ts, flow_ids = old["offsets"], old["ts"], old["flow_ids"]
+            ptr, postings = old["ptr"], old["postings"]
+            members = [postings[ptr[i]:ptr[i + 1]].tolist()
+                       for i in range(len(flows))]
+        else:
+            end = 24
+            offsets, ts, flow_ids = array("Q"), array("q"), array("I")
+            flows, members = [], []
+        ids = {flow[:5]: i for i, flow in enumerate(flows)}
+        start = len(ts)
+        appended = set()
+        for offset, stamp, flow in self._records(pcap, end):
+            offsets.append(offset)
+            ts.append(stamp)
+            end = offset + 16 + self.record.unpack_from(pcap, offset)[2]
+            if flow is None:
+                flow_ids.append(NO_FLOW)
+                continue
+            fid = ids.get(flow)
+            if fid is None:
+                fid = ids[flow] = len(flows)
+                flows.append(flow + (len(flow[0]),))
+                members.append([])
+            flow_ids.append(fid)
+            members[fid].append(len(ts) - 1)
+            appended.add(fid)
+        if loaded is not None and len(ts) == start:
+            return
+        logger.debug("indexed %s new packets of %s", len(ts) - start,
+                     self.path)
+
+        for fid in appended:
+            members[fid].sort(key=lambda i: (ts[i], i))
+        ptr, postings = array("Q", [0]), array("I")
+        for packets in members:
+            postings.extend(packets)
+            ptr.append(len(postings))
+        chunk_min, chunk_max = array("q"), array("q")
+        for i in range(0, len(ts), self.chunk):
+            part = ts[i:i + self.chunk]
+            chunk_min.append(min(part))
+            chunk_max.append(max(part))
+        self._write(source, end, {
+            "offsets": offsets, "ts": ts, "flow_ids": flow_ids, "ptr": ptr,
+            "postings": postings, "chunk_min": chunk_min,
+            "chunk_max": chunk_max}, flows)
+
+    def _write(self, source, end, arrays, flows):
+        sections = self._sections(len(arrays["ts"]), len(flows), self.chunk)
+        tmp_path = "{}.{}.tmp".format(self.index_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.chunk,
+                                source, end, len(arrays["ts"]), len(flows)))
+            for name, _, position, _ in sections:
+                f.write(b"\0" * (position - f.tell()))
+                if name == "flows":
+                    for flow in flows:
+                        f.write(FLOW.pack(flow[0].ljust(16, b"\0"),
+                                          flow[1].ljust(16, b"\0"), *flow[2:]))
+                else:
+                    f.write(arrays[name].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def _map_index(self):
+        with open(self.index_path, "rb") as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, chunk, _, _, n, n_flows = HEADER.unpack_from(index)
+        self.chunk = chunk
+        view = memoryview(index)
+        self._views = [view]
+        for name, code, position, count in self._sections(n, n_flows, chunk):
+            if code is None:
+                self._flow_table = position
+                self.flow_count = count
+                continue
+            section = view[position:position + count * array(code).itemsize]
+            section = section.cast(code)
+            self._views.append(section)
+            setattr(self, "_" + name, section)
+        return index
+
+    def refresh(self):
+        """pick up packets appended to the capture since the last call"""
+        source, pcap = self._map_capture()
+        try:
+            with self._locked():
+                self._update(source, pcap)
+                self._close_maps()
+                self._index = self._map_index()
+        except BaseException:
+            pcap.close()
+            raise
+        self._pcap = pcap
+        index = self._index
+        self.flow_ids = {}
+        for i in range(self.flow_count):
+            a, b, sport, dport, proto, size = FLOW.unpack_from(
+                index, self._flow_table + i * FLOW.size)
+            key = FlowKey(_unpack_address(a, size), sport,
+                          _unpack_address(b, size), dport, proto)
+            self.flow_ids[key] = i
+
+    # queries
+
+    def __len__(self):
+        return len(self._ts)
+
+    def flows(self):
+        return list(self.flow_ids)
+
+    def _packet(self, i):
+        offset = self._offsets[i]
+        incl_len = self.record.unpack_from(self._pcap, offset)[2]
+        return self._ts[i], memoryview(self._pcap)[offset + 16:
+                                                   offset + 16 + incl_len]
+
+    def packets(self, flow=None, start=None, end=None):
+        """
+        Packets of a flow and/or between start and end (ns, inclusive).
+        A flow is a FlowKey or (src, sport, dst, dport[, proto]) in either
+        direction. Packets of a flow come in time order, without a flow
+        in capture order.
+        :yields (timestamp in ns, frame as a memoryview into the capture)
+        """
+        start = -(1 << 63) if start is None else start
+        end = (1 << 63) - 1 if end is None else end
+        if flow is not None:
+            yield from self._flow_packets(FlowKey.make(*flow), start, end)
+            return
+        ts = self._ts
+        for c in range(len(self._chunk_min)):
+            if self._chunk_max[c] < start or self._chunk_min[c] > end:
+                continue
+            for i in range(c * self.chunk, min((c + 1) * self.chunk, len(ts))):
+                if start <= ts[i] <= end:
+                    yield self._packet(i)
+
+    def _flow_packets(self, flow, start, end):
+        fid = self.flow_ids.get(flow)
+        if fid is None:
+            return
+        ts, postings = self._ts, self._postings
+        lo, hi = self._ptr[fid], self._ptr[fid + 1]
+        # first posting at or after start
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[postings[mid]] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        for p in range(lo, self._ptr[fid + 1]):
+            i = postings[p]
+            if ts[i] > end:
+                break
+            yield self._packet(i)
+
+    def _close_maps(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        for m in (self._pcap, self._index):
+            try:
+                if m is not None:
+                    m.close()
+            except BufferError:
+                pass  # packets still referenced, unmapped when released
+        self._pcap = self._index = None
+
+    def close(self):
+        self._close_maps()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
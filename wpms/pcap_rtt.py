@@ -0,0 +1,439 @@
+import logging
+import socket
+import struct
+from collections import deque
+
+from wpms.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+# pcap magic numbers, microsecond and nanosecond timestamps
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1000),
+    b"\xa1\xb2\xc3\xd4": (">", 1000),
+    b"\x4d\x3c\xb2\xa1": ("<", 1),
+    b"\xa1\xb2\x3c\x4d": (">", 1),
+}
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPV6_EXTENSIONS = (0, 43, 60)
+IPPROTO_TCP = 6
+IPPROTO_FRAGMENT = 44
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+TCPOPT_EOL = 0
+TCPOPT_NOP = 1
+TCPOPT_SACK = 5
+
+SEQ_MOD = 1 << 32
+SEQ_HALF = 1 << 31
+
+
+def read_pcap(f):
+    """
+    Stream the records of a pcap file one at a time.
+    :f - binary file object
+    :yields (timestamp in ns, linktype, captured bytes)
+    """
+    header = f.read(24)
+    if len(header) < 24:
+        raise ValueError("not a pcap file, too short")
+    if header[:4] == PCAPNG_MAGIC:
+        raise ValueError("pcapng is not supported, write the capture with "
+                         "tcpdump -w or convert it with editcap -F pcap")
+    try:
+        endian, frac_ns = PCAP_MAGIC[header[:4]]
+    except KeyError:
+        raise ValueError("not a pcap file, bad magic {}".format(header[:4]))
+    linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + "IIII")
+    while True:
+        head = f.read(16)
+        if len(head) < 16:
+            return
+        sec, frac, incl_len, _ = record.unpack(head)
+        data = f.read(incl_len)
+        if len(data) < incl_len:
+            logger.warning("truncated pcap record at end of file")
+            return
+        yield sec * 1000000000 + frac * frac_ns, linktype, data
+
+
+def parse_ip(linktype, data):
+    """
+    Decode the link and IP headers of a captured frame.
+    Lengths come from the IP header, so captures taken with a short
+    snaplen still account for the full payload. Fragments after the
+    first one are skipped.
+    :returns (src, dst, protocol, transport offset, transport length)
+             or None when the frame isn't IP
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        ethertype = (data[12] << 8) | data[13]
+        offset = 14
+        while ethertype in ETHERTYPE_VLAN and len(data) >= offset + 4:
+            ethertype = (data[offset + 2] << 8) | data[offset + 3]
+            offset += 4
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset = 20
+    elif linktype == LINKTYPE_NULL:
+        offset = 4
+    elif linktype in LINKTYPE_RAW:
+        offset = 0
+    else:
+        raise ValueError("unsupported linktype {}".format(linktype))
+    if len(data) < offset + 20:
+        return None
+
+    version = data[offset] >> 4
+    if version == 4:
+        ihl = (data[offset] & 0x0F) * 4
+        nxt = data[offset + 9]
+        if ((data[offset + 6] << 8) | data[offset + 7]) & 0x1FFF:
+            return None  # not the first fragment
+        total = (data[offset + 2] << 8) | data[offset + 3]
+        src = data[offset + 12:offset + 16]
+        dst = data[offset + 16:offset + 20]
+        length = total - ihl
+        offset += ihl
+    elif version == 6:
+        if len(data) < offset + 40:
+            return None
+        length = (data[offset + 4] << 8) | data[offset + 5]
+        nxt = data[offset + 6]
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        offset += 40
+        while nxt in IPV6_EXTENSIONS or nxt == IPPROTO_FRAGMENT:
+            if len(data) < offset + 8:
+                return None
+            if nxt == IPPROTO_FRAGMENT:
+                if ((data[offset + 2] << 8) | data[offset + 3]) & 0xFFF8:
+                    return None
+                ext = 8
+            else:
+                ext = (data[offset + 1] + 1) * 8
+            nxt = data[offset]
+            offset += ext
+            length -= ext
+    else:
+        return None
+    return src, dst, nxt, offset, length
+
+
+def parse_tcp(linktype, data):
+    """
+    Decode the TCP header of a captured frame.
+    :returns (src, sport, dst, dport, seq, ack, flags, payload length,
+              sack blocks) or None when the frame isn't TCP
+    """
+    ip = parse_ip(linktype, data)
+    if ip is None or ip[2] != IPPROTO_TCP:
+        return None
+    src, dst, _, offset, length = ip
+    if len(data) < offset + 20:
+        return None
+    sport, dport, seq, ack, off, flags = struct.unpack_from(
+        "!HHIIBB", data, offset)
+    doff = (off >> 4) * 4
+    sacks = ()
+    if doff > 20:
+        sacks = _sack_blocks(data, offset + 20, min(offset + doff, len(data)))
+    return src, sport, dst, dport, seq, ack, flags, length - doff, sacks
+
+
+def _sack_blocks(data, i, end):
+    blocks = []
+    while i < end:
+        kind = data[i]
+        if kind == TCPOPT_EOL:
+            break
+        if kind == TCPOPT_NOP:
+            i += 1
+            continue
+        if i + 1 >= end or data[i + 1] < 2:
+            break
+        size = data[i + 1]
+        if kind == TCPOPT_SACK:
+            for j in range(i + 2, min(i + size, end) - 7, 8):
+                blocks.append(struct.unpack_from("!II", data, j))
+        i += size
+    return blocks
+
+
+def _unwrap(seq, ref):
+    """32 bit sequence number to the 64 bit value closest to ref"""
+    delta = (seq - ref) % SEQ_MOD
+    if delta >= SEQ_HALF:
+        delta -= SEQ_MOD
+    return ref + delta
+
+
+class Segment:
+    __slots__ = ("start", "end", "ts", "retransmitted", "sacked")
+
+    def __init__(self, start, end, ts):
+        self.start = start
+        self.end = end
+        self.ts = ts
+        self.retransmitted = False
+        self.sacked = False
+
+
+class HalfFlow:
+    """
+    One direction of a connection. Sequence numbers are kept relative to
+    the first one seen and unwrapped to 64 bit. Only segments that are
+    sent but not yet acknowledged are stored, so memory follows the data
+    in flight, capped at max_outstanding segments.
+    """
+
+    def __init__(self, max_outstanding):
+        self.max_outstanding = max_outstanding
+        self.isn = None
+        self.snd_max = 0
+        self.una = 0
+        self.outstanding = deque()
+        self.histogram = Histogram()
+        self.packets = 0
+        self.retransmits = 0
+        self.fin = False
+
+    def relative(self, seq):
+        return _unwrap((seq - self.isn) % SEQ_MOD, self.snd_max)
+
+    def send(self, ts, seq, length):
+        self.packets += 1
+        if self.isn is None:
+            self.isn = seq
+        if not length:
+            return
+        start = self.relative(seq)
+        end = start + length
+        if start >= self.snd_max:
+            self.outstanding.append(Segment(start, end, ts))
+            if len(self.outstanding) > self.max_outstanding:
+                self.outstanding.popleft()
+            self.snd_max = end
+            return
+        # retransmission, the acks of everything it overlaps are ambiguous
+        self.retransmits += 1
+        for segment in self.outstanding:
+            if segment.start >= end:
+                break
+            if segment.end > start:
+                segment.retransmitted = True
+        if end > self.snd_max:
+            segment = Segment(self.snd_max, end, ts)
+            segment.retransmitted = True
+            self.outstanding.append(segment)
+            self.snd_max = end
+
+    def acknowledge(self, ts, ack, sacks):
+        """
+        Process an ack sent by the other side. Karn's rule: a segment that
+        was ever retransmitted never gives a sample.
+        :returns rtt sample in ns or None
+        """
+        if self.isn is None:
+            return None
+        rtt = None
+        ack = self.relative(ack)
+        if self.una < ack <= self.snd_max:
+            self.una = ack
+            acked = []
+            while self.outstanding and self.outstanding[0].end <= ack:
+                segment = self.outstanding.popleft()
+                if not segment.sacked:
+                    acked.append(segment)
+            if acked and not any(s.retransmitted for s in acked):
+                rtt = ts - acked[-1].ts
+        for i, (left, right) in enumerate(sacks):
+            left = self.relative(left)
+            right = self.relative(right)
+            newest = None
+            for segment in self.outstanding:
+                if segment.start >= right:
+                    break
+                if segment.start >= left and not segment.sacked:
+                    segment.sacked = True
+                    newest = segment
+            # the first block holds the segment that triggered this ack
+            if i == 0 and rtt is None and newest is not None \
+                    and not newest.retransmitted:
+                rtt = ts - newest.ts
+        if rtt is not None:
+            self.histogram.record(rtt // 1000)
+        return rtt
+
+    def summary(self):
+        h = self.histogram
+        ms = (lambda us: None if us is None else us / 1000)
+        return {
+            "packets": self.packets,
+            "bytes": self.snd_max,
+            "retransmits": self.retransmits,
+            "rtt_samples": h.total,
+            "rtt_min": ms(h.min),
+            "rtt_avg": ms(h.mean),
+            "rtt_max": ms(h.max),
+            "rtt_percentiles": {p: ms(v) for p, v in h.percentiles().items()}
+            if h.total else {},
+        }
+
+
+def _address(raw, port):
+    family = socket.AF_INET if len(raw) == 4 else socket.AF_INET6
+    host = socket.inet_ntop(family, bytes(raw))
+    return "{}:{}".format(host, port) if family == socket.AF_INET \
+        else "[{}]:{}".format(host, port)
+
+
+class Flow:
+    """a TCP connection, a is the endpoint of the first packet seen"""
+
+    def __init__(self, a, b, ts, max_outstanding):
+        self.a = a
+        self.b = b
+        self.first = ts
+        self.last = ts
+        self.halves = (HalfFlow(max_outstanding), HalfFlow(max_outstanding))
+
+    @property
+    def closed(self):
+        return all(h.fin and not h.outstanding for h in self.halves)
+
+    def summary(self):
+        return {
+            "a": _address(*self.a),
+            "b": _address(*self.b),
+            "first": self.first / 1e9,
+            "last": self.last / 1e9,
+            "a2b": self.halves[0].summary(),
+            "b2a": self.halves[1].summary(),
+        }
+
+
+class RttAnalyzer:
+    """
+    Reconstructs TCP flows from captured packets and matches data
+    segments with the acks of the other direction, in the spirit of
+    tcptrace -r. Sequence numbers are followed per direction, duplicate
+    acks give no sample, SACK blocks acknowledge segments above a hole
+    and retransmitted segments are excluded (Karn's rule).
+    RTT samples go into a histogram per direction (microseconds).
+    A flow is finished on RST, once both FINs are acknowledged or when
+    idle for idle_timeout seconds of capture time; its summary is passed
+    to on_flow and its state dropped, so memory is bounded by the active
+    flows, not by the size of the capture.
+    :on_flow - callable(summary dict)
+    :on_sample - optional callable(flow, direction, ts_ns, rtt_ns),
+                 direction 0 is a to b
+    """
+
+    def __init__(self, on_flow, on_sample=None, idle_timeout=300,
+                 max_outstanding=32768):
+        self.on_flow = on_flow
+        self.on_sample = on_sample
+        self.idle_timeout = int(idle_timeout * 1e9)
+        self.max_outstanding = max_outstanding
+        self.flows = {}
+        self.next_sweep = None
+
+    @property
+    def active_flows(self):
+        return len(self.flows)
+
+    def feed(self, ts, linktype, data):
+        tcp = parse_tcp(linktype, data)
+        if tcp is None:
+            return
+        src, sport, dst, dport, seq, ack, flags, length, sacks = tcp
+        key = (bytes(src), sport, bytes(dst), dport)
+        rkey = (key[2], dport, key[0], sport)
+        flow = self.flows.get(min(key, rkey))
+        if flow is not None:
+            direction = 0 if flow.a == (key[0], sport) else 1
+            half = flow.halves[direction]
+            if flags & TCP_SYN and not flags & TCP_ACK \
+                    and half.isn is not None and seq != half.isn:
+                self.finish(flow)  # port reused by a new connection
+                flow = None
+        if flow is None:
+            flow = Flow((key[0], sport), (key[2], dport), ts,
+                        self.max_outstanding)
+            self.flows[min(key, rkey)] = flow
+            direction = 0
+        flow.last = ts
+
+        half = flow.halves[direction]
+        length += bool(flags & TCP_SYN) + bool(flags & TCP_FIN)
+        half.send(ts, seq, length)
+        if flags & TCP_FIN:
+            half.fin = True
+        if flags & TCP_ACK:
+            rtt = flow.halves[1 - direction].acknowledge(ts, ack, sacks)
+            if rtt is not None and self.on_sample is not None:
+                self.on_sample(flow, 1 - direction, ts, rtt)
+
+        if flags & TCP_RST or flow.closed:
+            self.finish(flow)
+        if self.next_sweep is None or ts >= self.next_sweep:
+            self.sweep(ts)
+
+    def sweep(self, now):
+        """finish flows idle for idle_timeout"""
+        for flow in [f for f in self.flows.values()
+                     if now - f.last >= self.idle_timeout]:
+            self.finish(flow)
+        self.next_sweep = now + self.idle_timeout // 4
+
+    def finish(self, flow):
+        a, b = flow.a, flow.b
+        key = min((a[0], a[1], b[0], b[1]), (b[0], b[1], a[0], a[1]))
+        if self.flows.get(key) is flow:
+            del self.flows[key]
+            self.on_flow(flow.summary())
+
+    def close(self):
+        for flow in list(self.flows.values()):
+            self.finish(flow)
+
+
+def iter_flows(path, **kwargs):
+    """
+    Analyze a capture file.
+    :yields a summary dict per TCP flow as soon as the flow is finished
+    """
+    finished = []
+    analyzer = RttAnalyzer(finished.append, **kwargs)
+    with open(path, "rb") as f:
+        for ts, linktype, data in read_pcap(f):
+            analyzer.feed(ts, linktype, data)
+            if finished:
+                yield from finished
+                finished.clear()
+    analyzer.close()
+    yield from finished
+
+
+def analyze(path, **kwargs):
+    return list(iter_flows(path, **kwargs))
@@ -0,0 +1,30 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def bisect_payload(probe, floor, ceiling):
+    """
+    Find the largest payload size in [floor, ceiling] accepted by probe.
+    probe(size) must return True when a packet with a payload of size
+    bytes and the DF bit set made it to the server. The ceiling is tried
+    first since it is the common case, after that the search halves the
+    interval on every attempt so at most log2(ceiling - floor) + 2 probes
+    are needed instead of one probe for every 10 bytes.
+    :returns the payload size or None when not even the floor got through
+    """
+    if floor > ceiling:
+        raise ValueError("PMTU floor must not be greater than the ceiling")
+    if probe(ceiling):
+        return ceiling
+    good, bad = floor - 1, ceiling  # largest known good, smallest known bad
+    while bad - good > 1:
+        size = (good + bad) // 2
+        if probe(size):
+            good = size
+        else:
+            bad = size
+        logger.debug("PMTU search window %s - %s", good, bad)
+    if good < floor:
+        return None
+    return good
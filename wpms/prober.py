@@ -0,0 +1,354 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+PROBE_FORMAT = "!IQ"  # sequence number, send timestamp (ns)
+PROBE_SIZE = struct.calcsize(PROBE_FORMAT)
+
+# every prober in the process gets its own ICMP identifier
+_instances = itertools.count()
+
+
+class RttSample(namedtuple("RttSample", ["seq", "sent_ns", "recv_ns", "rtt_ns"])):
+    """
+    A single probe. sent_ns/recv_ns are wall clock timestamps in nanoseconds,
+    rtt_ns is measured with the monotonic performance counter. recv_ns and
+    rtt_ns are None when the probe was lost.
+    """
+    __slots__ = ()
+
+    @property
+    def lost(self):
+        return self.rtt_ns is None
+
+    @property
+    def rtt(self):
+        """rtt in seconds"""
+        return None if self.rtt_ns is None else self.rtt_ns / 1e9
+
+
+class RttStats:
+    """
+    Incremental rtt statistics in seconds. min/max/avg/stddev are updated
+    in O(1) per sample (Welford), percentiles come from a sorted copy of
+    the samples kept with bisect.insort.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.min = None
+        self.max = None
+        self.avg = None
+        self._m2 = 0.0
+        self._sorted = []
+
+    def add(self, sample):
+        self.sent += 1
+        if sample.lost:
+            return
+        rtt = sample.rtt
+        self.received += 1
+        if self.min is None or rtt < self.min:
+            self.min = rtt
+        if self.max is None or rtt > self.max:
+            self.max = rtt
+        if self.avg is None:
+            self.avg = rtt
+        else:
+            delta = rtt - self.avg
+            self.avg += delta / self.received
+            self._m2 += delta * (rtt - self.avg)
+        bisect.insort(self._sorted, rtt)
+
+    @property
+    def lost(self):
+        return self.sent - self.received
+
+    @property
+    def stddev(self):
+        if self.received < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.received - 1))
+
+    def percentile(self, p):
+        """nearest-rank percentile, p in [0, 100]"""
+        if not self._sorted:
+            return None
+        rank = max(1, math.ceil(p / 100 * len(self._sorted)))
+        return self._sorted[rank - 1]
+
+    def as_dict(self):
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "min": self.min,
+            "avg": self.avg,
+            "max": self.max,
+            "stddev": self.stddev,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class RttProber:
+    """
+    In-process rtt prober.
+    :method - icmp: echo request/reply, uses an unprivileged ping socket when
+              net.ipv4.ping_group_range allows it and a raw socket otherwise
+              tcp: time of the TCP handshake, a RST (closed port) is a reply too
+              udp: round trip of a datagram through a UDP echo server
+    :port - destination port for tcp and udp
+    :interval - seconds between the start of two probes
+    :timeout - seconds before a probe is considered lost
+    :df - set the don't fragment bit like nping --df
+    """
+
+    def __init__(self, host, method="icmp", port=7, interval=0.1, timeout=1.0,
+                 df=True):
+        if method not in ("icmp", "tcp", "udp"):
+            raise ValueError("Unknown probe method {}".format(method))
+        self.host = host
+        self.method = method
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.df = df
+        self.stats = RttStats()
+        self._sock = None
+        self._raw = False
+        self._ident = (os.getpid() + next(_instances)) & 0xffff
+        self._waiters = {}
+
+    def _set_df(self, sock):
+        if self.df and hasattr(socket, "IP_MTU_DISCOVER"):
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER,
+                            socket.IP_PMTUDISC_DO)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self.method == "icmp":
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                     socket.IPPROTO_ICMP)
+            except PermissionError:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                     socket.IPPROTO_ICMP)
+                self._raw = True
+            sock.setblocking(False)
+            self._set_df(sock)
+            sock.connect((self.host, 0))
+        elif self.method == "udp":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._set_df(sock)
+            sock.connect((self.host, self.port))
+        else:
+            return
+        self._sock = sock
+        loop.add_reader(sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            except RuntimeError:
+                pass
+            self._sock.close()
+            self._sock = None
+        for fut in self._waiters.values():
+            fut.cancel()
+        self._waiters.clear()
+
+    def _on_readable(self):
+        try:
+            data = self._sock.recv(2048)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            # e.g. ICMP port unreachable reported on a connected UDP socket
+            logger.debug("probe socket error %s", e)
+            return
+        recv_ns = time.perf_counter_ns()
+        seq = self._parse_reply(data)
+        fut = self._waiters.pop(seq, None)
+        if fut is not None and not fut.done():
+            fut.set_result(recv_ns)
+
+    def _parse_reply(self, data):
+        if self.method == "udp":
+            if len(data) < PROBE_SIZE:
+                return None
+            return struct.unpack_from(PROBE_FORMAT, data)[0]
+        if self._raw:
+            data = data[(data[0] & 0x0f) * 4:]  # strip the IPv4 header
+        if len(data) < 8:
+            return None
+        icmp_type, _, _, ident, seq = struct.unpack_from("!BBHHH", data)
+        if icmp_type != ICMP_ECHO_REPLY:
+            return None
+        if self._raw and ident != self._ident:
+            return None
+        return seq
+
+    def _echo_request(self, seq, sent_ns):
+        payload = struct.pack(PROBE_FORMAT, seq, sent_ns)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0,
+                             self._ident, seq)
+        checksum = icmp_checksum(header + payload)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum,
+                             self._ident, seq)
+        return header + payload
+
+    async def _tcp_probe(self):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            start = time.perf_counter_ns()
+            try:
+                await loop.sock_connect(sock, (self.host, self.port))
+            except ConnectionRefusedError:
+                pass  # the RST took one round trip as well
+            return time.perf_counter_ns() - start
+        finally:
+            sock.close()
+
+    async def probe(self, seq):
+        """
+        Send one probe and wait for its reply.
+        :returns RttSample
+        """
+        sent_ns = time.time_ns()
+        try:
+            if self.method == "tcp":
+                rtt_ns = await asyncio.wait_for(self._tcp_probe(),
+                                                self.timeout)
+            else:
+                loop = asyncio.get_running_loop()
+                key = seq & 0xffff if self.method == "icmp" else seq
+                fut = loop.create_future()
+                self._waiters[key] = fut
+                if self.method == "icmp":
+                    packet = self._echo_request(key, sent_ns)
+                else:
+                    packet = struct.pack(PROBE_FORMAT, seq, sent_ns)
+                start = time.perf_counter_ns()
+                self._sock.send(packet)
+                try:
+                    recv = await asyncio.wait_for(fut, self.timeout)
+                finally:
+                    self._waiters.pop(key, None)
+                rtt_ns = recv - start
+        except (asyncio.TimeoutError, OSError) as e:
+            logger.debug("probe %s lost: %r", seq, e)
+            return RttSample(seq, sent_ns, None, None)
+        return RttSample(seq, sent_ns, sent_ns + rtt_ns, rtt_ns)
+
+    async def samples(self, count=None):
+        """
+        Async generator of RttSample, one probe every interval seconds,
+        forever or until count probes were sent. Every sample is also
+        folded into self.stats.
+        """
+        loop = asyncio.get_running_loop()
+        await self.open()
+        try:
+            seq = 0
+            while count is None or seq < count:
+                started = loop.time()
+                sample = await self.probe(seq)
+                self.stats.add(sample)
+                yield sample
+                seq += 1
+                delay = self.interval - (loop.time() - started)
+                if delay > 0 and (count is None or seq < count):
+                    await asyncio.sleep(delay)
+        finally:
+            self.close()
+
+    async def run(self, count=None):
+        async for _ in self.samples(count):
+            pass
+        return self.stats
+
+
+class ProberThread(threading.Thread):
+    """
+    Runs an RttProber on its own event loop next to blocking code, e.g.
+    while an iperf3 subprocess is running.
+
+        probe = ProberThread(RttProber(host))
+        probe.start()
+        ...
+        stats = probe.stop()
+    """
+
+    def __init__(self, prober, count=None):
+        super().__init__(daemon=True)
+        self.prober = prober
+        self.count = count
+        self.error = None
+        self._loop = None
+        self._task = None
+        self._ready = threading.Event()
+
+    def run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._task = self._loop.create_task(self.prober.run(self.count))
+            self._ready.set()
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
+            self._loop.close()
+
+    def result(self, timeout=None):
+        """
+        Wait for count probes to complete.
+        :returns RttStats
+        """
+        self.join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.prober.stats
+
+    def stop(self, timeout=None):
+        """
+        Cancel the probing and wait for the thread to finish.
+        :returns RttStats
+        """
+        self._ready.wait()
+        if self.is_alive() and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                pass  # loop finished in the meantime
+        return self.result(timeout)
@@ -0,0 +1,247 @@
+import csv
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    test_id TEXT NOT NULL UNIQUE,
+    ts REAL NOT NULL,
+    mode TEXT,
+    server TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+CREATE INDEX IF NOT EXISTS results_mode_ts ON results (mode, ts);
+CREATE INDEX IF NOT EXISTS results_server_ts ON results (server, ts);
+CREATE TABLE IF NOT EXISTS latency (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    station TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS latency_station_ts ON latency (station, ts);
+CREATE INDEX IF NOT EXISTS latency_ts ON latency (ts);
+"""
+
+
+def to_epoch(timestamp):
+    """
+    TcpTest.create_dict timestamps are local time strings, numbers are
+    taken as epoch seconds already.
+    """
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+
+
+def parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+class ResultStore:
+    """
+    Append-only store of RFC 6349 results in a single SQLite database in
+    WAL mode, so readers never block the writer. Results are indexed by
+    time, mode, server and test_id and the complete create_dict record is
+    kept as JSON. append() buffers records and writes them in one
+    transaction once batch_size records are waiting or on flush()/close().
+    The latency summaries agents report (wpms.latency.LatencyProber) are
+    kept the same way per station with append_latency().
+    """
+
+    def __init__(self, path, batch_size=100):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_latency = []
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, record):
+        self.pending.append((
+            record["test_id"],
+            to_epoch(record["timestamp"]),
+            record.get("mode"),
+            record.get("server"),
+            json.dumps(record),
+            ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def append_latency(self, station, summary, ts=None):
+        """
+        :summary - wpms.latency.LatencyProber.summary(), data is the median
+        :ts - epoch seconds, defaults to now
+        """
+        self.pending_latency.append((
+            time.time() if ts is None else ts,
+            station,
+            json.dumps(summary),
+            ))
+        if len(self.pending_latency) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending and not self.pending_latency:
+            return 0
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO results "
+                "(test_id, ts, mode, server, data) VALUES (?, ?, ?, ?, ?)",
+                self.pending)
+            self.conn.executemany(
+                "INSERT INTO latency (ts, station, data) VALUES (?, ?, ?)",
+                self.pending_latency)
+        count = len(self.pending) + len(self.pending_latency)
+        self.pending = []
+        self.pending_latency = []
+        return count
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def _where(start, end, mode=None, server=None, station=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if mode is not None:
+            clauses.append("mode = ?")
+            params.append(mode)
+        if server is not None:
+            clauses.append("server = ?")
+            params.append(server)
+        if station is not None:
+            clauses.append("station = ?")
+            params.append(station)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, params
+
+    def query(self, start=None, end=None, mode=None, server=None,
+              limit=None, offset=0):
+        """
+        Results between start (inclusive) and end (exclusive) epoch seconds,
+        oldest first.
+        """
+        where, params = self._where(start, end, mode, server)
+        sql = "SELECT data FROM results" + where + " ORDER BY ts, id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return [json.loads(row[0]) for row in self.conn.execute(sql, params)]
+
+    def count(self, start=None, end=None, mode=None, server=None):
+        where, params = self._where(start, end, mode, server)
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM results" + where, params).fetchone()[0]
+
+    def series(self, field, start=None, end=None, mode=None, server=None):
+        """
+        (ts, value) of a numeric result field, oldest first, results
+        where the field is missing or not a number are left out.
+        """
+        where, params = self._where(start, end, mode, server)
+        where += " AND " if where else " WHERE "
+        sql = ("SELECT ts, json_extract(data, ?) FROM results" + where +
+               "json_type(data, ?) IN ('integer', 'real') ORDER BY ts, id")
+        path = "$." + field
+        return self.conn.execute(sql, [path] + params + [path]).fetchall()
+
+    def latency_series(self, field="data", start=None, end=None,
+                       station=None):
+        """
+        (ts, value) of a numeric field of the latency summaries, oldest
+        first
+        """
+        where, params = self._where(start, end, station=station)
+        where += " AND " if where else " WHERE "
+        sql = ("SELECT ts, json_extract(data, ?) FROM latency" + where +
+               "json_type(data, ?) IN ('integer', 'real') ORDER BY ts, id")
+        path = "$." + field
+        return self.conn.execute(sql, [path] + params + [path]).fetchall()
+
+    def version(self, table="results", start=None, end=None, **filters):
+        """
+        (count, last id, last ts) of the rows of table in the range, it
+        changes whenever a row is added to the range.
+        """
+        if table not in ("results", "latency"):
+            raise ValueError("unknown table {!r}".format(table))
+        where, params = self._where(start, end, **filters)
+        return self.conn.execute(
+            "SELECT COUNT(*), MAX(id), MAX(ts) FROM " + table + where,
+            params).fetchone()
+
+    def aggregate(self, field, start=None, end=None, mode=None, server=None,
+                  bucket=None):
+        """
+        count/min/avg/max of a numeric result field, e.g. actual_thpt.
+        :bucket - bucket size in seconds (86400 for daily values), None
+        aggregates the whole range
+        :returns a list of dicts, one per bucket
+        """
+        where, params = self._where(start, end, mode, server)
+        value = "json_extract(data, ?)"
+        if bucket:
+            group = "CAST(ts / ? AS INTEGER) * ?"
+            sql = ("SELECT {g} AS bucket, COUNT({v}), MIN({v}), AVG({v}), "
+                   "MAX({v}) FROM results{w} GROUP BY bucket ORDER BY bucket"
+                   ).format(g=group, v=value, w=where)
+            params = [bucket, bucket] + ["$." + field] * 4 + params
+        else:
+            sql = ("SELECT NULL, COUNT({v}), MIN({v}), AVG({v}), MAX({v}) "
+                   "FROM results{w}").format(v=value, w=where)
+            params = ["$." + field] * 4 + params
+        keys = ("bucket", "count", "min", "avg", "max")
+        return [dict(zip(keys, row)) for row in self.conn.execute(sql, params)]
+
+    def import_csv(self, paths):
+        """
+        Load the one-result-per-file csv files written by older versions.
+        """
+        imported = 0
+        for path in paths:
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    record = {k: parse_value(v) for k, v in row.items()}
+                    record["test_id"] = row["test_id"]
+                    record["timestamp"] = row["timestamp"]
+                    self.append(record)
+                    imported += 1
+        self.flush()
+        return imported
+
+
+if __name__ == "__main__":
+    # python3 -m wpms.results /var/local/starmon/results.db /var/local/starmon/*.csv
+    started = time.monotonic()
+    with ResultStore(sys.argv[1], batch_size=1000) as store:
+        count = store.import_csv(sys.argv[2:])
+    print("imported {} results in {:.1f}s".format(
+        count, time.monotonic() - started))
@@ -0,0 +1,41 @@
+import fcntl
+import socket
+import struct
+
+SIOCGIFADDR = 0x8915
+
+
+def source_address(destination, port=9):
+    """
+    Returns the local address the kernel would use to reach destination.
+    Connecting a UDP socket only performs the route lookup, no packet is sent.
+    """
+    family = socket.AF_INET6 if ":" in destination else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as s:
+        s.connect((destination, port))
+        return s.getsockname()[0]
+
+
+def interface_address(ifname):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        packed = struct.pack("256s", ifname.encode()[:15])
+        res = fcntl.ioctl(s.fileno(), SIOCGIFADDR, packed)
+    return socket.inet_ntoa(res[20:24])
+
+
+def egress_interface(destination):
+    """
+    Name of the interface used to reach destination, e.g. eth0 or wlan0.
+    Falls back to the source address when the interface can't be resolved.
+    """
+    try:
+        src = source_address(destination)
+    except OSError:
+        return "default"
+    for _, ifname in socket.if_nameindex():
+        try:
+            if interface_address(ifname) == src:
+                return ifname
+        except OSError:
+            continue
+    return src
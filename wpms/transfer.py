@@ -0,0 +1,182 @@
+import logging
+import mmap
+import os
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!Q")  # file size
+ACK = struct.Struct("!QQ")  # bytes received, receiver transfer time (ns)
+BUFSIZE = 256 * 1024
+
+
+class TransferError(Exception):
+    pass
+
+
+def tune(sock, sndbuf=None, rcvbuf=None, mss=None):
+    """
+    Set socket buffers and the TCP maximum segment size, must happen
+    before connect/listen for the window scale and MSS to be negotiated.
+    :returns the effective values, Linux doubles the buffer sizes asked for
+    """
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if mss:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG, mss)
+    return {
+        "sndbuf": sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        "rcvbuf": sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+        "mss": sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_MAXSEG),
+    }
+
+
+def _recv_exact(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise TransferError("connection closed after {} of {} bytes"
+                                .format(received, size))
+        received += n
+    return bytes(data)
+
+
+def send_file(path, host, port, sndbuf=None, mss=None, timeout=None):
+    """
+    Send a file with socket.sendfile, the kernel copies it from the page
+    cache to the socket without passing through Python.
+    :returns dict with bytes, seconds (until the receiver acked the last
+             byte), receiver_seconds (first to last byte at the receiver),
+             throughput in bits/s and the effective socket options
+    """
+    size = os.path.getsize(path)
+    with socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET,
+                       socket.SOCK_STREAM) as sock:
+        options = tune(sock, sndbuf=sndbuf, mss=mss)
+        sock.settimeout(timeout)
+        sock.connect((host, port))
+        options["mss"] = sock.getsockopt(socket.IPPROTO_TCP,
+                                         socket.TCP_MAXSEG)
+        with open(path, "rb") as f:
+            # before the header, the receiver starts timing once it's read
+            start = time.perf_counter()
+            sock.sendall(HEADER.pack(size))
+            sent = sock.sendfile(f) if size else 0
+        received, elapsed_ns = ACK.unpack(_recv_exact(sock, ACK.size))
+        seconds = time.perf_counter() - start
+    if sent != size or received != size:
+        raise TransferError("sent {} received {} of {} bytes".format(
+            sent, received, size))
+    receiver_seconds = elapsed_ns / 1e9
+    return dict(options, bytes=size, seconds=seconds,
+                receiver_seconds=receiver_seconds,
+                throughput=size * 8 / receiver_seconds
+                if receiver_seconds else None)
+
+
+def receive(conn, path=None, use_mmap=False, bufsize=BUFSIZE):
+    """
+    Receive one file from a connected socket.
+    Data is read with recv_into into a buffer allocated once. Without a
+    path it is discarded, with use_mmap the file is preallocated and the
+    socket reads straight into its mapping, otherwise the buffer is
+    written to the file.
+    :returns (bytes received, seconds from the first to the last byte)
+    """
+    size = HEADER.unpack(_recv_exact(conn, HEADER.size))[0]
+    received = 0
+    start = time.perf_counter_ns()
+    if path is not None and use_mmap and size:
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as sink:
+                view = memoryview(sink)
+                try:
+                    while received < size:
+                        n = conn.recv_into(view[received:],
+                                           min(size - received, bufsize))
+                        if not n:
+                            break
+                        received += n
+                finally:
+                    view.release()
+            if received < size:
+                f.truncate(received)
+    else:
+        buf = memoryview(bytearray(bufsize))
+        f = open(path, "wb") if path is not None else None
+        try:
+            while received < size:
+                n = conn.recv_into(buf, min(size - received, bufsize))
+                if not n:
+                    break
+                if f is not None:
+                    f.write(buf[:n])
+                received += n
+        finally:
+            if f is not None:
+                f.close()
+    elapsed_ns = time.perf_counter_ns() - start
+    if received < size:
+        raise TransferError("connection closed after {} of {} bytes".format(
+            received, size))
+    conn.sendall(ACK.pack(received, elapsed_ns))
+    return received, elapsed_ns / 1e9
+
+
+class Receiver:
+    """
+    Listening side of the file transfer test.
+    :host - address to listen on, all IPv4 and IPv6 addresses by default
+    :path - where received files are stored, None discards the data
+    """
+
+    def __init__(self, port, host="", path=None, use_mmap=False,
+                 rcvbuf=None, mss=None, bufsize=BUFSIZE):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.bufsize = bufsize
+        dualstack = not host and socket.has_dualstack_ipv6()
+        family = socket.AF_INET6 if ":" in host or dualstack \
+            else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if dualstack:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        # accepted sockets inherit buffers and mss from the listener
+        self.options = tune(self.sock, rcvbuf=rcvbuf, mss=mss)
+        self.sock.bind((host, port))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+    def serve_once(self):
+        conn, addr = self.sock.accept()
+        with conn:
+            received, seconds = receive(conn, self.path, self.use_mmap,
+                                        self.bufsize)
+        logger.info("received %s bytes from %s in %.3fs", received, addr[0],
+                    seconds)
+        return received, seconds
+
+    def serve_forever(self):
+        while True:
+            try:
+                self.serve_once()
+            except (TransferError, OSError) as e:
+                logger.warning("transfer failed: %s", e)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()